@@ -0,0 +1,311 @@
+"""
+Automatic choice of the optimization level (and of the limits
+LIMIT, or LIMIT_Y and LIMIT_Z, of level 2) of the new block method,
+see momentBlockNew2D.py and momentBlockNew3D.py.
+
+The time of preprocessing plus moment computation of each level
+is estimated from:
+- the histogram of the shapes of the blocks of the decomposition
+  (which blocks are computed in the traditional way at level 2,
+  how many distinct shapes the cache of level 4 computes)
+- the costs on the current machine of one entry of the table of
+  central moments, of one column of the PowerMatrix and of one
+  block with each method, measured once with microbenchmarks on
+  random blocks and then stored in the file TUNING_FILE
+The plan with the minimum estimated time is chosen; the plan
+chosen for a family of images (e.g. the images of a list file)
+is stored in TUNING_FILE too, and used for the next images of the
+same family.
+
+Usage:
+  python3 autotune.py DIM family image [image ...]
+  python3 autotune.py DIM family -list list_file
+choose the plan for the given images, store it for the family
+and print the estimated time of all plans.
+"""
+
+import json
+import os
+import platform
+import random
+import sys
+import time
+from collections import Counter
+
+# file storing the machine costs and the plans of the families,
+# next to this module, so that it does not depend on the current directory
+TUNING_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "autotune.json")
+
+#---------------------STATISTICS-----------------------
+
+def blockStats(ibr):
+  """
+  Return the statistics of a block decomposition needed to
+  estimate the costs: shape histogram, max sides, image side.
+  """
+  columns = ibr.columns()
+  dim = len(columns)//2
+  sides = [[d+1 for d in map(sub, columns[dim+a], columns[a])] for a in range(dim)]
+  shapes = Counter(zip(*sides))
+  return {"dim": dim, "shapes": shapes, "blocks": ibr.size(),
+          "max_sides": [max(s) if len(s)>0 else 0 for s in sides],
+          "origsize": ibr.origsize}
+
+def tableEntries(sides):
+  """
+  Return the number of entries of the table of central moments
+  built by setCentralMoments for the given max sides (sorted,
+  decreasing), counted as in its loops.
+  """
+  if len(sides)==2:
+    More, Less = sides
+    return More + sum([More-y+1 for y in range(2, Less+1)])
+  More, Mid, Less = sides
+  count = More + sum([More-y+1 for y in range(2, Mid+1)])
+  for z in range(2, Less+1):
+    count += sum([More-y+1 for y in range(z, Mid+1)])
+  return count
+
+def traditionalBlocks(shapes, limits):
+  """
+  Return the number of blocks computed in the traditional way
+  at level 2 with the given limits.
+  """
+  count = 0
+  for shape, num in shapes.items():
+    ordered = sorted(shape)
+    if len(shape)==2: old = ordered[0]>limits[0]
+    else: old = ordered[1]>limits[0] or ordered[0]>limits[1]
+    if old: count += num
+  return count
+
+#---------------------COSTS-----------------------
+
+def bestOf(function, argom, times=3):
+  best = None
+  for t in range(times):
+    start = time.perf_counter()
+    function(argom)
+    elapsed = time.perf_counter()-start
+    if best is None or elapsed<best: best = elapsed
+  return best
+
+def randomBlocks(dim, num=2000, side=8, span=200):
+  """
+  Return a set of num random blocks with sides up to side,
+  inside a square (cube) of size span.
+  """
+  rnd = random.Random(1)
+  if dim==2: ibr = BW_BlockImage2D()
+  else: ibr = BW_BlockImage3D()
+  for i in range(num):
+    corner = [rnd.randrange(span-side) for a in range(dim)]
+    ibr.append(*(corner + [c+rnd.randrange(side) for c in corner]))
+  ibr.origsize = span
+  return ibr
+
+def measureCosts(dim):
+  """
+  Measure the costs (seconds) on the current machine: per entry
+  of the table of central moments and per column of the PowerMatrix,
+  per block at levels 1 (table), 2 (traditional way), 3 and 4.
+  """
+  module = blockModule(dim)
+  # private engine, the engine of the module is not changed
+  if dim==2: engine = module.BW_BlockEngine2D()
+  else: engine = module.BW_BlockEngine3D()
+  ibr = randomBlocks(dim)
+  n = ibr.size()
+  costs = dict()
+  side = 200 if dim==2 else 40
+  sides = (side,)*dim
+  costs["entry"] = bestOf(module.setCentralMoments, sides) / tableEntries(sides)
+  costs["power"] = bestOf(lambda N: PowerMatrix(3, N), 20000) / 20000
+  # table for all blocks
+  engine.setOptimizationLevel(1)
+  engine.preprocessing(ibr)
+  costs["table_block"] = bestOf(engine.blockMoments, ibr) / n
+  # traditional way for all blocks
+  engine.setOptimizationLevel(2)
+  if dim==2: engine.setLimits(0)
+  else: engine.setLimits(0, 0)
+  engine.preprocessing(ibr)
+  costs["old_block"] = bestOf(engine.blockMoments, ibr) / n
+  engine.setOptimizationLevel(3)
+  engine.preprocessing(ibr)
+  costs["sep_block"] = bestOf(engine.blockMoments, ibr) / n
+  # cache: misses on an empty cache, then hits
+  engine.setOptimizationLevel(4)
+  engine.cache = ShapeCache()
+  cold = bestOf(engine.blockMoments, ibr, 1)
+  costs["lazy_block"] = bestOf(engine.blockMoments, ibr) / n
+  costs["lazy_miss"] = max(cold - costs["lazy_block"]*n, 0) / max(engine.cache.misses, 1)
+  return costs
+
+def loadTuning():
+  if not os.path.exists(TUNING_FILE): return {"costs":{}, "plans":{}}
+  f = open(TUNING_FILE, "r")
+  data = json.load(f)
+  f.close()
+  return data
+
+def saveTuning(data):
+  f = open(TUNING_FILE, "w")
+  json.dump(data, f, indent=1, sort_keys=True)
+  f.close()
+
+def machineCosts(dim, refresh=False):
+  """
+  Return the costs of the current machine for images of
+  dimension dim, measuring them only the first time.
+  """
+  data = loadTuning()
+  key = "%s %dD" % (platform.node(), dim)
+  if refresh or key not in data["costs"]:
+    data["costs"][key] = measureCosts(dim)
+    saveTuning(data)
+  return data["costs"][key]
+
+#---------------------PLANS-----------------------
+
+def candidatePlans(dim, max_sides):
+  """
+  Return the list of plans (level, limits) to be evaluated.
+  """
+  plans = [(0, None), (1, None), (3, None), (4, None)]
+  ordered = sorted(max_sides, reverse=True)
+  powers = [2**i for i in range(0, 16) if 2**i<=max(ordered[-1],1)]
+  if dim==2:
+    plans += [(2, [L]) for L in powers]
+  else:
+    mids = [2**i for i in range(0, 16) if 2**i<=max(ordered[1],1)]
+    plans += [(2, [LY, LZ]) for LY in mids for LZ in powers if LZ<=LY]
+  return plans
+
+def estimateTime(stats, level, limits, costs):
+  """
+  Return the estimated times (preprocessing, moments) of a plan
+  for a block decomposition with the given statistics.
+  """
+  n = stats["blocks"]
+  ordered = sorted(stats["max_sides"], reverse=True)
+  if level==0:
+    pre = tableEntries([ordered[0]]*stats["dim"]) * costs["entry"]
+    mom = n * costs["table_block"]
+  elif level==1:
+    pre = tableEntries(ordered) * costs["entry"]
+    mom = n * costs["table_block"]
+  elif level==2:
+    sides = [ordered[0]] + [min(s,L) for s,L in zip(ordered[1:], limits)]
+    pre = tableEntries(sides) * costs["entry"] + (stats["origsize"]+1) * costs["power"]
+    old = traditionalBlocks(stats["shapes"], limits)
+    mom = old * costs["old_block"] + (n-old) * costs["table_block"]
+  elif level==3:
+    pre = ordered[0] * costs["entry"]
+    mom = n * costs["sep_block"]
+  else: # level 4, from an empty cache
+    pre = 0.0
+    mom = n * costs["lazy_block"] + len(stats["shapes"]) * costs["lazy_miss"]
+  return pre, mom
+
+def choosePlan(all_stats, costs):
+  """
+  Return the plan with the minimum estimated time over all
+  the block decompositions whose statistics are in all_stats,
+  and the list of all evaluated plans (sorted by time).
+  A plan is a dictionary with keys level, limits, and the
+  estimated times pre, moments, total.
+  """
+  dim = all_stats[0]["dim"]
+  max_sides = [max([st["max_sides"][a] for st in all_stats]) for a in range(dim)]
+  evaluated = []
+  for level, limits in candidatePlans(dim, max_sides):
+    pre, mom = 0.0, 0.0
+    for stats in all_stats:
+      p, m = estimateTime(stats, level, limits, costs)
+      pre, mom = pre+p, mom+m
+    evaluated.append({"level":level, "limits":limits, "pre":pre, "moments":mom, "total":pre+mom})
+  evaluated.sort(key=lambda plan: plan["total"])
+  return evaluated[0], evaluated
+
+def describePlan(plan):
+  S = "level %d" % plan["level"]
+  if plan["limits"] is not None:
+    S += ", limits " + ",".join([str(L) for L in plan["limits"]])
+  return S + " (estimated %.4f s + %.4f s)" % (plan["pre"], plan["moments"])
+
+def applyPlan(plan, dim):
+  """
+  Set optimization level and limits of the new block method.
+  """
+  module = blockModule(dim)
+  module.setOptimizationLevel(plan["level"])
+  if plan["level"]==2:
+    module.setLimits(*plan["limits"])
+  module.ENGINE.tuned = describePlan(plan)
+
+def tunedPlan(ibr, family, retune=False):
+  """
+  Return the plan stored for the family, or choose it on the
+  block decomposition ibr (and store it) if there is none.
+  """
+  dim = len(ibr.columns())//2
+  data = loadTuning()
+  if retune or family not in data["plans"]:
+    plan, evaluated = choosePlan([blockStats(ibr)], machineCosts(dim))
+    data = loadTuning()
+    data["plans"][family] = plan
+    saveTuning(data)
+  return data["plans"][family]
+
+def blockModule(dim):
+  if dim==2: return momentBlockNew2D
+  return momentBlockNew3D
+
+#---------------------MAIN-----------------------
+
+from operator import sub
+from coordfile import readList
+from bigmatrix import PowerMatrix
+from shapecache import ShapeCache
+from spiliotis2D import BW_BlockImage2D
+from spiliotis3D import BW_BlockImage3D
+import momentBlockNew2D, momentBlockNew3D
+
+def main(arg):
+  try:
+    dim = int(arg[1])
+    assert dim in (2,3)
+    family = arg[2]
+    if arg[3]=="-list": images = readList(arg[4])
+    else:
+      images = arg[3:]
+    assert len(images)>0
+  except:
+    print(__doc__)
+    return
+  if dim==2:
+    from commons2D import readPixels as readInput
+    from spiliotis2D import extractBlocks
+  else:
+    from commons3D import readCubes as readInput
+    from spiliotis3D import extractBlocks
+  costs = machineCosts(dim)
+  print("Machine costs (microseconds):")
+  for key in sorted(costs): print("  %-12s %10.4f" % (key, 1e6*costs[key]))
+  all_stats = []
+  for image_file in images:
+    ibr = extractBlocks(readInput(image_file))
+    stats = blockStats(ibr)
+    print("%s: %d blocks, %d shapes, max sides %s" % (image_file, stats["blocks"], len(stats["shapes"]), stats["max_sides"]))
+    all_stats.append(stats)
+  plan, evaluated = choosePlan(all_stats, costs)
+  print("Estimated time of the plans:")
+  for candidate in evaluated: print("  "+describePlan(candidate))
+  data = loadTuning()
+  data["plans"][family] = plan
+  saveTuning(data)
+  print("Plan for family "+family+": "+describePlan(plan))
+
+if __name__ == "__main__":
+  main(sys.argv)
@@ -0,0 +1,224 @@
+"""
+Moments of many images computed by a pool of threads (or of
+processes) sharing one engine of the new block method
+(BW_BlockEngine2D/3D) or of the new tree method
+(QTR_MomentEngine/OCT_MomentEngine).
+
+The engine is prepared once for all images (preprocessing_once
+with the max side, as main_for_tests.py with 'once'), then each
+thread reads an image, decomposes it and computes its moments
+with the shared engine, whose tables are only read. The results
+are returned in the order of the images.
+With the standard CPython the threads are serialized by the GIL,
+so the time does not decrease with more threads; with a
+free-threaded CPython (3.13t and later, where
+sys._is_gil_enabled() is False) the images are processed in
+parallel.
+
+With processes in place of threads (POSIX only) the engine, with
+its PowerMatrix and tables of central moments, is built once by
+the main process and inherited by the worker processes by fork,
+without pickling it (the objects are moved out of the garbage
+collector with gc.freeze, so that the pages stay shared).
+The images are given to the workers one at a time, the largest
+(by number of black pixels, see countPixels in coordfile.py)
+first, so that the last ones to finish are the smallest; each
+worker returns the moments of an image as a compact vector,
+i.e. the tuple of the moments in the order of orders (see
+commons2D.py and commons3D.py). With level 4 each worker fills
+its own copy of the shape cache.
+
+Usage:
+  python3 batch.py DIM list_file max_side [threads=1,2,4] [method=block] [opt=2]
+compute the moments of the images of list_file (e.g. listaMpeg)
+with one thread and with each number of threads, print time,
+speedup and efficiency against one thread, and check that the
+moments do not change.
+method is block (optimization level opt, 2, 3 or 4) or tree.
+  python3 batch.py DIM list_file max_side processes=1,2,4 [method=block] [opt=2]
+  python3 batch.py DIM list_file max_side processes=all [method=block] [opt=2]
+the same with processes (all: 1, 2, 4, ... up to the number of CPUs).
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import gc
+import multiprocessing
+import os
+import sys
+import time
+
+DEFAULT_THREADS = [1, 2, 4]
+DEFAULT_METHOD = "block"
+DEFAULT_OPT = 2
+
+# (dim, engine, method) of the workers, set before the fork
+WORKER = None
+
+def makeEngine(dim, method, opt, max_side):
+  """
+  Return a new engine, prepared for all images with side
+  up to max_side and ready to be shared by threads.
+  """
+  if method=="block":
+    assert opt in (2,3,4)
+    if dim==2: engine = BW_BlockEngine2D(opt)
+    else: engine = BW_BlockEngine3D(opt)
+    engine.preprocessing_once(max_side)
+    engine.share()
+    return engine
+  if dim==2: engine = QTR_MomentEngine()
+  else: engine = OCT_MomentEngine()
+  # the side of a tree is a power of two greater than the max coordinate
+  engine.preprocessing_once(max_side+1)
+  return engine
+
+def imageMoments(image_file, dim, engine, method):
+  """
+  Read the image, decompose it and return its moments.
+  """
+  if dim==2:
+    black_pixels = readPixels(image_file)
+    if method=="block": return engine.blockMoments(extractBlocks2D(black_pixels))
+    return engine.quadtreeMoments(buildQuadtree(black_pixels))
+  black_pixels = readCubes(image_file)
+  if method=="block": return engine.blockMoments(extractBlocks3D(black_pixels))
+  return engine.octreeMoments(buildOctree(black_pixels))
+
+def batchMoments(images, dim, engine, method, threads=1):
+  """
+  Return the list of the moments of the images, computed by
+  the given number of threads with the shared engine.
+  """
+  if threads==1:
+    return [imageMoments(image_file, dim, engine, method) for image_file in images]
+  with ThreadPoolExecutor(max_workers=threads) as pool:
+    return list(pool.map(lambda image_file: imageMoments(image_file, dim, engine, method), images))
+
+def momentVector(MM, dim):
+  """
+  Return the moments as a tuple of integers, in the order of orders.
+  """
+  if dim==2: return tuple([int(MM[key]) for key in orders2D])
+  return tuple([int(MM[key]) for key in orders3D])
+
+def workerMoments(task):
+  """
+  Compute in a worker process the moments of the image task[1],
+  with the engine inherited from the main process, and return
+  the pair (task[0], vector of the moments).
+  """
+  dim, engine, method = WORKER
+  index, image_file = task
+  return index, momentVector(imageMoments(image_file, dim, engine, method), dim)
+
+def largestFirst(images):
+  """
+  Return the indices of the images sorted by decreasing
+  number of black pixels.
+  """
+  pixels = [countPixels(image_file) for image_file in images]
+  return sorted(range(len(images)), key=lambda i: -pixels[i])
+
+def batchMomentsProcesses(images, dim, engine, method, processes=1, order=None):
+  """
+  Return the list of the vectors of the moments of the images
+  (see momentVector), computed by the given number of worker
+  processes, which inherit the engine by fork; the images are
+  scheduled in the given order of their indices (default
+  largestFirst).
+  """
+  global WORKER
+  if order is None: order = largestFirst(images)
+  WORKER = (dim, engine, method)
+  results = [None]*len(images)
+  tasks = [(i, images[i]) for i in order]
+  # objects created until now are not tracked, their pages are not written
+  gc.freeze()
+  try:
+    with multiprocessing.get_context("fork").Pool(processes) as pool:
+      for index, vector in pool.imap_unordered(workerMoments, tasks, chunksize=1):
+        results[index] = vector
+  finally:
+    gc.unfreeze()
+    WORKER = None
+  return results
+
+def processCounts():
+  """
+  Return 1, 2, 4, ... up to the number of CPUs (included).
+  """
+  cpus = os.cpu_count() or 1
+  counts = []
+  P = 1
+  while P<cpus:
+    counts.append(P)
+    P *= 2
+  return counts + [cpus]
+
+def gilState():
+  is_enabled = getattr(sys, "_is_gil_enabled", None)
+  if is_enabled is None: return "GIL enabled (no free-threaded build)"
+  if is_enabled(): return "free-threaded build, GIL enabled"
+  return "free-threaded build, GIL disabled"
+
+#---------------------MAIN-----------------------
+
+from commons2D import readPixels
+from commons3D import readCubes
+from spiliotis2D import extractBlocks as extractBlocks2D
+from spiliotis3D import extractBlocks as extractBlocks3D
+from quadtree import buildQuadtree
+from octree import buildOctree
+from momentBlockNew2D import BW_BlockEngine2D
+from momentBlockNew3D import BW_BlockEngine3D
+from momentTreeNew2D import QTR_MomentEngine
+from momentTreeNew3D import OCT_MomentEngine
+from commons2D import orders as orders2D
+from commons3D import orders as orders3D
+from coordfile import countPixels, readList, options
+
+def main(arg):
+  try:
+    dim = int(arg[1])
+    assert dim in (2,3)
+    images = readList(arg[2])
+    max_side = int(arg[3])
+    opt = options(arg[4:])
+    processes = "processes" in opt
+    if processes and opt["processes"]=="all": counts = processCounts()
+    elif processes: counts = [int(P) for P in opt["processes"].split(",")]
+    elif "threads" in opt: counts = [int(T) for T in opt["threads"].split(",")]
+    else: counts = DEFAULT_THREADS
+    assert min(counts)>0
+    assert not processes or "fork" in multiprocessing.get_all_start_methods()
+    method = opt.get("method", DEFAULT_METHOD)
+    assert method in ("block", "tree")
+    level = int(opt.get("opt", DEFAULT_OPT))
+    assert method=="tree" or level in (2,3,4)
+  except:
+    print(__doc__)
+    return
+  print("Python", sys.version.split()[0], "-", gilState(), "-", os.cpu_count(), "CPUs")
+  print("%d images, method %s%s" % (len(images), method, " opt %d" % level if method=="block" else ""))
+  engine = makeEngine(dim, method, level, max_side)
+  unit = "processes" if processes else "threads"
+  if processes: order = largestFirst(images)
+  # one worker first, as reference for moments and time
+  counts = [1] + [T for T in counts if T!=1]
+  ok = True
+  for T in counts:
+    start = time.perf_counter()
+    if processes: results = batchMomentsProcesses(images, dim, engine, method, T, order)
+    else: results = batchMoments(images, dim, engine, method, T)
+    elapsed = time.perf_counter()-start
+    if T==1:
+      reference, base = results, elapsed
+    elif results!=reference:
+      print("ERRORE: moments with %d %s differ" % (T, unit))
+      ok = False
+    speedup = base/elapsed
+    print("  %3d %-9s %10.4f s  speedup %6.2f  efficiency %5.1f%%" % (T, unit, elapsed, speedup, 100*speedup/T))
+  if ok: print("TUTTO VA BENE")
+
+if __name__ == "__main__":
+  main(sys.argv)
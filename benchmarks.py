@@ -0,0 +1,379 @@
+"""
+Benchmarks comparing alternative implementations of
+the same stage of the computation on a given image.
+Each comparison prints, for each implementation, the best
+time over the repetitions and the peak of allocated memory,
+and checks that all implementations give the same result.
+
+Usage:
+  python3 benchmarks.py decompose DIM image [times]
+     block decomposition with the image stored as a
+     dictionary and as a bitmap (rows as bytes and as masks)
+  python3 benchmarks.py tree DIM image [times]
+     quadtree (octree) construction: dictionary of location codes,
+     linear tree merged level by level, streaming construction
+     (with and without the Morton sort of the input), top-down
+     construction with the summed area (volume) table
+  python3 benchmarks.py moments DIM image [times]
+     moments from the image: quadtree (octree), block decomposition
+     (old and new method), runs of the rows (also vectorized),
+     fused scan of the rows
+  python3 benchmarks.py preprocess DIM image [times]
+     new block method with each optimization level: time and
+     memory of the preprocessing (level 4 fills its cache during
+     the moment computation), time of the moment computation,
+     and time of the moment computation grouping blocks by shape
+  python3 benchmarks.py treemoments DIM image [times]
+     moments from the quadtree (octree): old method, new method,
+     new method with integers only (exact), leaves grouped by
+     level and vectorized (on the tree and on the linear tree)
+  python3 benchmarks.py kernels DIM image [times]
+     moments of order up to 3 from blocks and tree with the
+     hand-written exact engines and with the generated kernels,
+     and time of the generated kernels of orders 4 to 8
+  python3 benchmarks.py wanted DIM image [times]
+     preprocessing plus moments of the block and tree engines,
+     computing all orders and only the wanted orders of common
+     subsets (centroid, orientation), with the speedups
+In place of image, -list list_file runs the benchmark on all
+images named in the list file (as the files lista*).
+"""
+
+import sys
+import time
+import tracemalloc
+
+def bestTime(function, argom, times=1):
+  """
+  Execute function(argom) the given number of times and
+  return the minimum execution time and the last result.
+  """
+  best = None
+  for t in range(times):
+    start = time.perf_counter()
+    risultato = function(argom)
+    elapsed = time.perf_counter()-start
+    if best is None or elapsed<best: best = elapsed
+  return best, risultato
+
+def peakMemory(function, argom):
+  """
+  Execute function(argom) once and return the peak of memory
+  (in bytes) allocated during the execution.
+  """
+  tracemalloc.start()
+  function(argom)
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return peak
+
+def compare(title, variants, argom, times=1, same=None):
+  """
+  Run and compare the variants, a list of pairs (name, function)
+  on the same argument. If the function same is given, it is
+  applied to all results, and its values must be all equal.
+  Return the list of results.
+  """
+  print("==="+title)
+  results = []
+  for name, function in variants:
+    elapsed, res = bestTime(function, argom, times)
+    peak = peakMemory(function, argom)
+    print("  %-12s time %10.4f s   peak memory %10.1f KB" % (name, elapsed, peak/1024))
+    results.append(res)
+  if same is not None:
+    values = [same(r) for r in results]
+    if all([v==values[0] for v in values]): print("  Same result")
+    else: print("  ERROR: different results")
+  return results
+
+def leafSet(tree):
+  """
+  Return the set of black leaves of a quadtree or octree.
+  """
+  return set(tree.black_leaves())
+
+def blockSet(ibr):
+  """
+  Return the set of blocks of a block decomposition, as tuples.
+  """
+  return set(zip(*ibr.columns()))
+
+#---------------------COMPARISONS-----------------------
+
+def benchDecompose(dim, image_file, times):
+  if dim==2:
+    from commons2D import readPixels as readInput
+    from spiliotis2D import extractBlocks, extractBlocksDict, extractBlocksNumpy, np
+    from spiliotis2D import pixelsToArray as toArray
+    from bitmap import makeBitmap2D as makeBitmap
+  else:
+    from commons3D import readCubes as readInput
+    from spiliotis3D import extractBlocks, extractBlocksDict, extractBlocksNumpy, np
+    from spiliotis3D import voxelsToArray as toArray
+    from bitmap import makeBitmap3D as makeBitmap
+  input_pixels = list(readInput(image_file))
+  print("Number of black elements:", len(input_pixels))
+  variants = [("dictionary",extractBlocksDict),
+      ("bytes rows",lambda px: extractBlocks(makeBitmap(px,"bytes"))),
+      ("mask rows",lambda px: extractBlocks(makeBitmap(px,"mask")))]
+  if np is not None:
+    variants.append(("numpy",extractBlocksNumpy))
+  compare("Block decomposition", variants, input_pixels, times, blockSet)
+  if np is not None:
+    # the image is already in the format used by each method
+    images = (makeBitmap(input_pixels), toArray(input_pixels))
+    compare("Block decomposition without conversion of the input",
+      [("mask rows",lambda im: extractBlocks(im[0])),
+       ("numpy",lambda im: extractBlocksNumpy(im[1]))], images, times, blockSet)
+
+def benchTree(dim, image_file, times):
+  if dim==2:
+    from commons2D import readPixels as readInput
+    from quadtree import buildQuadtree as buildTree
+    from quadtree import buildLinearQuadtree as buildLinear
+    from quadtree import buildStreamQuadtree as buildStream
+    from quadtree import mortonSort
+    from quadtree import buildSummedQuadtree as buildSummed
+  else:
+    from commons3D import readCubes as readInput
+    from octree import buildOctree as buildTree
+    from octree import buildLinearOctree as buildLinear
+    from octree import buildStreamOctree as buildStream
+    from octree import mortonSort
+    from octree import buildSummedOctree as buildSummed
+  input_pixels = list(readInput(image_file))
+  print("Number of black elements:", len(input_pixels))
+  variants = [("location code",buildTree),
+      ("linear",buildLinear),
+      ("sort+stream",buildStream),
+      ("summed table",buildSummed)]
+  compare("Tree construction", variants, input_pixels, times, leafSet)
+  # the input is already in Morton order
+  ordered = mortonSort(input_pixels)
+  compare("Tree construction from input in Morton order",
+    [("location code",buildTree),
+     ("stream",lambda px: buildStream(px, ordered=True))], ordered, times, leafSet)
+
+def roundedMoments(MM):
+  return dict([(key,int(MM[key])) for key in MM])
+
+def benchMoments(dim, image_file, times):
+  if dim==2:
+    from commons2D import readPixels as readInput
+    from quadtree import buildQuadtree as buildTree
+    import momentTreeNew2D as treeNew
+    from spiliotis2D import extractBlocks
+    import momentBlock2D as blockOld
+    import momentBlockNew2D as blockNew
+    import momentRuns2D as runs
+    engine = runs.BW_RunEngine2D()
+    treeMoments = treeNew.quadtreeMoments
+  else:
+    from commons3D import readCubes as readInput
+    from octree import buildOctree as buildTree
+    import momentTreeNew3D as treeNew
+    from spiliotis3D import extractBlocks
+    import momentBlock3D as blockOld
+    import momentBlockNew3D as blockNew
+    import momentRuns3D as runs
+    engine = runs.BW_RunEngine3D()
+    treeMoments = treeNew.octreeMoments
+  def pipeline(decomposF, preprocF, momentsF):
+    def run(px):
+      elements = decomposF(px)
+      preprocF(elements)
+      return momentsF(elements)
+    return run
+  input_pixels = list(readInput(image_file))
+  print("Number of black elements:", len(input_pixels))
+  variants = [("tree",pipeline(buildTree, treeNew.preprocessing, treeMoments)),
+      ("blocks old",pipeline(extractBlocks, blockOld.preprocessing, blockOld.blockMoments)),
+      ("blocks new",pipeline(extractBlocks, blockNew.preprocessing, blockNew.blockMoments)),
+      ("blocks group",pipeline(extractBlocks, lambda ibr: None, blockNew.blockMomentsGrouped)),
+      ("blocks exact",pipeline(extractBlocks, lambda ibr: None, blockNew.blockMomentsExact)),
+      ("blocks vec",pipeline(extractBlocks, lambda ibr: None, blockNew.blockMomentsVec)),
+      ("runs",pipeline(runs.extractRuns, engine.preprocessing, engine.runMoments)),
+      ("runs vec",pipeline(runs.extractRuns, engine.preprocessing, engine.runMomentsVec)),
+      ("fused scan",pipeline(runs.scanImage, engine.preprocessing, engine.scanMoments))]
+  compare("Moments (decomposition and computation)", variants, input_pixels, times, roundedMoments)
+
+def benchPreprocess(dim, image_file, times):
+  if dim==2:
+    from commons2D import readPixels as readInput
+    from spiliotis2D import extractBlocks
+    import momentBlockNew2D as blockNew
+  else:
+    from commons3D import readCubes as readInput
+    from spiliotis3D import extractBlocks
+    import momentBlockNew3D as blockNew
+  ibr = extractBlocks(readInput(image_file))
+  print("Number of blocks:", ibr.num_elem())
+  print("===Preprocessing and moments of the new block method")
+  results = []
+  for level in (0,1,2,3,4):
+    blockNew.setOptimizationLevel(level)
+    blockNew.ENGINE.cache = None # level 4 starts from an empty cache
+    pre_time, res = bestTime(blockNew.preprocessing, ibr, times)
+    pre_peak = peakMemory(blockNew.preprocessing, ibr)
+    mom_time, res = bestTime(blockNew.blockMoments, ibr, times)
+    print("  opt %d  preprocessing %10.4f s %10.1f KB   moments %10.4f s" %
+          (level, pre_time, pre_peak/1024, mom_time))
+    results.append(roundedMoments(res))
+    if level==4: blockNew.ENGINE.cache.statistiche()
+  mom_time, res = bestTime(blockNew.blockMomentsGrouped, ibr, times)
+  print("  grouped by shape, no preprocessing           moments %10.4f s" % mom_time)
+  results.append(roundedMoments(res))
+  if all([r==results[0] for r in results]): print("  Same result")
+  else: print("  ERROR: different results")
+
+def benchTreeMoments(dim, image_file, times):
+  if dim==2:
+    from commons2D import readPixels as readInput
+    from quadtree import buildQuadtree as buildTree
+    from quadtree import buildLinearQuadtree as buildLinear
+    import momentTree2D as treeOld
+    import momentTreeNew2D as treeNew
+    oldMoments = treeOld.quadtreeMoments
+    newMoments = treeNew.quadtreeMoments
+    levelMoments = treeNew.quadtreeMomentsLevels
+    exactMoments = treeNew.quadtreeMomentsExact
+    vecMoments = treeNew.quadtreeMomentsVec
+  else:
+    from commons3D import readCubes as readInput
+    from octree import buildOctree as buildTree
+    from octree import buildLinearOctree as buildLinear
+    import momentTree3D as treeOld
+    import momentTreeNew3D as treeNew
+    oldMoments = treeOld.octreeMoments
+    newMoments = treeNew.octreeMoments
+    levelMoments = treeNew.octreeMomentsLevels
+    exactMoments = treeNew.octreeMomentsExact
+    vecMoments = treeNew.octreeMomentsVec
+  input_pixels = list(readInput(image_file))
+  trees = (buildTree(input_pixels), buildLinear(input_pixels))
+  print("Number of black leaves:", trees[0].num_elem())
+  treeNew.preprocessing(trees[0])
+  compare("Moments from the tree", [
+      ("old",lambda T: oldMoments(T[0])),
+      ("new",lambda T: newMoments(T[0])),
+      ("exact",lambda T: exactMoments(T[0])),
+      ("levels",lambda T: levelMoments(T[0])),
+      ("levels lin.",lambda T: levelMoments(T[1])),
+      ("vec",lambda T: vecMoments(T[0])),
+      ("vec lin.",lambda T: vecMoments(T[1]))], trees, times, roundedMoments)
+
+def benchKernels(dim, image_file, times):
+  from kernelgen import makeOrders, blockMomentsKernel, treeMomentsKernel
+  if dim==2:
+    from commons2D import readPixels as readInput
+    from quadtree import buildQuadtree as buildTree
+    from spiliotis2D import extractBlocks
+    from momentBlockNew2D import blockMomentsExact
+    from momentTreeNew2D import quadtreeMomentsExact as treeMomentsExact
+  else:
+    from commons3D import readCubes as readInput
+    from octree import buildOctree as buildTree
+    from spiliotis3D import extractBlocks
+    from momentBlockNew3D import blockMomentsExact
+    from momentTreeNew3D import octreeMomentsExact as treeMomentsExact
+  input_pixels = list(readInput(image_file))
+  elements = (extractBlocks(input_pixels), buildTree(input_pixels))
+  print("Number of blocks:", elements[0].num_elem(), " leaves:", elements[1].num_elem())
+  orders = makeOrders(dim, 3)
+  compare("Moments up to order 3", [
+      ("blocks exact",lambda E: blockMomentsExact(E[0])),
+      ("blocks kernel",lambda E: blockMomentsKernel(E[0], orders)),
+      ("tree exact",lambda E: treeMomentsExact(E[1])),
+      ("tree kernel",lambda E: treeMomentsKernel(E[1], orders))], elements, times, roundedMoments)
+  print("===Generated kernels of higher order")
+  for max_order in range(4, 9):
+    orders = makeOrders(dim, max_order)
+    block_time, res = bestTime(lambda E: blockMomentsKernel(E[0], orders), elements, times)
+    tree_time, res = bestTime(lambda E: treeMomentsKernel(E[1], orders), elements, times)
+    print("  order %d (%3d moments)  blocks %10.4f s   tree %10.4f s" % (max_order, len(orders), block_time, tree_time))
+
+def benchWanted(dim, image_file, times):
+  if dim==2:
+    from commons2D import readPixels as readInput, wantedOrders
+    from quadtree import buildQuadtree as buildTree
+    from spiliotis2D import extractBlocks
+    import momentBlock2D as blockOld
+    import momentBlockNew2D as blockNew
+    import momentTree2D as treeOld
+    import momentTreeNew2D as treeNew
+    treeOldMoments = treeOld.quadtreeMoments
+    treeNewMoments = treeNew.quadtreeMoments
+    treeExactMoments = treeNew.quadtreeMomentsExact
+    subsets = [("centroid", "00,10,01"), ("orientation", "00,10,01,11,20,02")]
+  else:
+    from commons3D import readCubes as readInput, wantedOrders
+    from octree import buildOctree as buildTree
+    from spiliotis3D import extractBlocks
+    import momentBlock3D as blockOld
+    import momentBlockNew3D as blockNew
+    import momentTree3D as treeOld
+    import momentTreeNew3D as treeNew
+    treeOldMoments = treeOld.octreeMoments
+    treeNewMoments = treeNew.octreeMoments
+    treeExactMoments = treeNew.octreeMomentsExact
+    subsets = [("centroid", "000,100,010,001"), ("orientation", "000,100,010,001,110,101,011,200,020,002")]
+  input_pixels = list(readInput(image_file))
+  elements = (extractBlocks(input_pixels), buildTree(input_pixels))
+  print("Number of blocks:", elements[0].num_elem(), " leaves:", elements[1].num_elem())
+  print("===Preprocessing and moments, all orders and wanted orders (speedup)")
+  engines = [("old blocks", blockOld.preprocessing, blockOld.blockMoments, 0),
+             ("new blocks", blockNew.preprocessing, blockNew.blockMoments, 0),
+             ("blocks exact", None, blockNew.blockMomentsExact, 0),
+             ("blocks vec", None, blockNew.blockMomentsVec, 0),
+             ("old tree", None, treeOldMoments, 1),
+             ("new tree", treeNew.preprocessing, treeNewMoments, 1),
+             ("tree exact", None, treeExactMoments, 1)]
+  ok = True
+  for name, preprocF, momentsF, k in engines:
+    def run(wanted):
+      if wanted is None:
+        if preprocF is not None: preprocF(elements[k])
+        return momentsF(elements[k])
+      if preprocF is not None: preprocF(elements[k], wanted)
+      return momentsF(elements[k], wanted)
+    full_time, full = bestTime(run, None, times)
+    full = roundedMoments(full)
+    line = "  %-12s all %9.4f s" % (name, full_time)
+    for title, keys in subsets:
+      wanted = wantedOrders(keys.split(","))
+      elapsed, res = bestTime(run, wanted, times)
+      line += "   %s %9.4f s (x%.1f)" % (title, elapsed, full_time/max(elapsed, 1e-9))
+      if roundedMoments(res)!=dict([(key, full[key]) for key in wanted]): ok = False
+    print(line)
+  if ok: print("  Same result")
+  else: print("  ERROR: different results")
+
+#---------------------MAIN-----------------------
+
+from coordfile import readList
+
+def main(arg):
+    try:
+      kind = arg[1]
+      dim = int(arg[2])
+      assert dim in (2,3)
+      if arg[3]=="-list":
+        images = readList(arg[4])
+        del arg[3]
+      else:
+        images = [arg[3]]
+      times = int(arg[4]) if len(arg)>4 else 1
+      benchF = {"decompose":benchDecompose, "tree":benchTree,
+                "moments":benchMoments, "preprocess":benchPreprocess,
+                "treemoments":benchTreeMoments, "kernels":benchKernels,
+                "wanted":benchWanted}[kind]
+    except:
+      print(__doc__)
+      return
+    for image_file in images:
+      print("---Image "+image_file)
+      benchF(dim, image_file, times)
+
+if __name__ == "__main__":
+   main(sys.argv)
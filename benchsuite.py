@@ -0,0 +1,238 @@
+"""
+Reproducible benchmark suite, replacing the shell loops of
+script_tests2D.txt and script_tests3D.txt.
+
+The suite is a matrix of datasets x methods x optimization levels.
+Each cell (one image, one method, one level) is executed in a fresh
+Python process running main_for_tests.py with --stats and --methods,
+with a pinned number of repetitions, so that the cells do not share
+caches, preprocessing tables or garbage collector state. The records
+of instrument.py (median and IQR of wall and CPU time, memory peak of
+each stage) are collected, with the environment (Python, platform,
+NumPy, CPU count, git commit, date), in one JSON file.
+
+A dataset can be:
+  FileMpeg        the images of listaMpeg
+  FileScaledMpeg  the images of lista0500, lista1000, lista2000, lista4000
+  FileSolid       the images of lista3D_64, lista3D_128, lista3D_256
+  a list file     (e.g. lista1000, listaDevice39)
+  a directory     all its .txt images (e.g. FileSynthetic2D, see synthetic.py)
+  an image file
+The dimension is 3 for FileSolid, list files and directories whose
+name contains "3D" or "Solid", 2 otherwise. Missing images are skipped.
+The optimization level only matters for block_new, the other
+methods are executed once per image (with level 0).
+
+Usage:
+  python3 benchsuite.py run OUT.json DATASET[,DATASET...] [methods=M1,M2,...] [opts=0,1,2] [times=5]
+execute the suite and write the results in OUT.json
+  python3 benchsuite.py compare BASELINE.json CURRENT.json [threshold=0.10]
+print the ratios of the median wall times of CURRENT over BASELINE
+and flag as regressions the stages slower than 1+threshold (and
+more than the sum of the IQRs); exit with status 1 if any.
+  python3 benchsuite.py show RESULTS.json
+print the records of a results file as a table.
+"""
+
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from coordfile import readList, options
+
+# datasets with a name -> list files of the images
+DATASETS = {
+  "FileMpeg": ["listaMpeg"],
+  "FileScaledMpeg": ["lista0500", "lista1000", "lista2000", "lista4000"],
+  "FileSolid": ["lista3D_64", "lista3D_128", "lista3D_256"],
+}
+
+# methods whose time depends on the optimization level
+OPT_METHODS = ["block_new"]
+
+DEFAULT_METHODS = ["tree_old", "tree_new", "block_old", "block_new"]
+DEFAULT_OPTS = [0, 1, 2]
+DEFAULT_TIMES = 5
+DEFAULT_THRESHOLD = 0.10
+
+PROGRAM = "main_for_tests.py"
+
+#---------------------DATASETS-----------------------
+
+def datasetDim(name):
+  if "3D" in name or "Solid" in name: return 3
+  return 2
+
+def expandDataset(name):
+  """
+  Return the list of pairs (image, dim) of a dataset.
+  """
+  if name in DATASETS:
+    pairs = []
+    for list_file in DATASETS[name]:
+      pairs += [(image, datasetDim(name)) for image in readList(list_file)]
+    return pairs
+  if os.path.isdir(name):
+    images = sorted([f for f in os.listdir(name) if f.endswith(".txt")])
+    return [(os.path.join(name, f), datasetDim(name)) for f in images]
+  if os.path.basename(name).startswith("lista"):
+    return [(image, datasetDim(name)) for image in readList(name)]
+  return [(name, datasetDim(name))]
+
+def buildMatrix(datasets, methods, opts):
+  """
+  Return the list of cells (image, dim, method, opt) of the suite,
+  skipping the missing images.
+  """
+  cells = []
+  for name in datasets:
+    for image, dim in expandDataset(name):
+      if not os.path.exists(image):
+        print("Missing image", image, "skipped")
+        continue
+      for method in methods:
+        for opt in (opts if method in OPT_METHODS else [0]):
+          cells.append((image, dim, method, opt))
+  return cells
+
+#---------------------RUN-----------------------
+
+def gitCommit():
+  try:
+    return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+  except OSError:
+    return None
+
+def environment():
+  """
+  Return the metadata of the machine and of the code.
+  """
+  try:
+    import numpy
+    numpy_version = numpy.__version__
+  except ImportError:
+    numpy_version = None
+  return {"python": platform.python_version(),
+          "implementation": platform.python_implementation(),
+          "platform": platform.platform(),
+          "machine": platform.machine(),
+          "processor": platform.processor(),
+          "node": platform.node(),
+          "cpus": os.cpu_count(),
+          "numpy": numpy_version,
+          "commit": gitCommit(),
+          "date": datetime.datetime.now().isoformat(timespec="seconds")}
+
+def runCell(image, dim, method, opt, times):
+  """
+  Execute one cell in a fresh process and return its records.
+  """
+  handle, stats_file = tempfile.mkstemp(suffix=".jsonl")
+  os.close(handle)
+  command = [sys.executable, PROGRAM, str(dim), str(opt), image, str(times),
+             "--methods="+method, "--stats="+stats_file]
+  completed = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+  f = open(stats_file, "r")
+  records = [json.loads(L) for L in f if L.strip()]
+  f.close()
+  os.remove(stats_file)
+  if completed.returncode!=0:
+    print("ERRORE in", " ".join(command))
+    print(completed.stderr)
+  for r in records:
+    r["cell"] = method
+  return records
+
+def runSuite(out_file, datasets, methods, opts, times):
+  cells = buildMatrix(datasets, methods, opts)
+  results = {"environment": environment(),
+             "config": {"datasets": datasets, "methods": methods, "opts": opts, "times": times},
+             "records": []}
+  for num, (image, dim, method, opt) in enumerate(cells):
+    print("[%d/%d] %s %dD %s opt %d" % (num+1, len(cells), image, dim, method, opt))
+    results["records"] += runCell(image, dim, method, opt, times)
+  f = open(out_file, "w")
+  json.dump(results, f, indent=1)
+  f.close()
+  print("Results written in", out_file)
+
+#---------------------COMPARE-----------------------
+
+def loadResults(file_name):
+  f = open(file_name, "r")
+  results = json.load(f)
+  f.close()
+  return results
+
+def recordKey(r):
+  return (r["image"], r["dim"], str(r["opt"]), r.get("cell"), r["stage"], r["method"])
+
+def compareResults(baseline, current, threshold):
+  """
+  Print the ratio of the median wall times of the records present
+  in both results, and return the list of regressions.
+  """
+  old = {recordKey(r):r for r in baseline["records"]}
+  regressions = []
+  for r in current["records"]:
+    key = recordKey(r)
+    if key not in old: continue
+    b = old[key]
+    if b["wall_median"]<=0: continue
+    ratio = r["wall_median"]/b["wall_median"]
+    slower = r["wall_median"]-b["wall_median"]
+    flag = ratio>1+threshold and slower>b["wall_iqr"]+r["wall_iqr"]
+    if flag: regressions.append((key, ratio))
+    print("%s %-40s opt %-4s %-10s %-40s x%.3f%s" % ("!!" if flag else "  ", key[0], key[2], key[4], key[5],
+                                                     ratio, "  REGRESSION" if flag else ""))
+  return regressions
+
+def describeEnvironment(env):
+  return "%s %s, %s, %s CPUs, numpy %s, commit %s, %s" % (env["implementation"], env["python"],
+          env["platform"], env["cpus"], env["numpy"], (env["commit"] or "?")[:10], env["date"])
+
+#---------------------MAIN-----------------------
+
+def main(arg):
+  try:
+    command = arg[1]
+    assert command in ("run", "compare", "show")
+    if command=="run":
+      out_file = arg[2]
+      datasets = arg[3].split(",")
+      opt = options(arg[4:])
+      methods = opt["methods"].split(",") if "methods" in opt else DEFAULT_METHODS
+      opts = [int(o) for o in opt["opts"].split(",")] if "opts" in opt else DEFAULT_OPTS
+      times = int(opt.get("times", DEFAULT_TIMES))
+    elif command=="compare":
+      baseline, current = loadResults(arg[2]), loadResults(arg[3])
+      threshold = float(options(arg[4:]).get("threshold", DEFAULT_THRESHOLD))
+    else:
+      results = loadResults(arg[2])
+  except:
+    print(__doc__)
+    return 0
+  if command=="run":
+    runSuite(out_file, datasets, methods, opts, times)
+    return 0
+  if command=="show":
+    print("Environment:", describeEnvironment(results["environment"]))
+    for r in results["records"]:
+      print("  %-40s %s opt %-4s %-10s %-40s wall %10.6f s (IQR %.6f)  peak %10.1f KB" %
+            (r["image"], r["dim"], r["opt"], r["stage"], r["method"], r["wall_median"], r["wall_iqr"], r["peak_bytes"]/1024))
+    return 0
+  print("Baseline:", describeEnvironment(baseline["environment"]))
+  print("Current: ", describeEnvironment(current["environment"]))
+  regressions = compareResults(baseline, current, threshold)
+  if len(regressions)==0:
+    print("TUTTO VA BENE: no regression beyond %.0f%%" % (100*threshold))
+    return 0
+  print("ERRORE: %d regressions beyond %.0f%%" % (len(regressions), 100*threshold))
+  return 1
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv))
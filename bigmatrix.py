@@ -24,27 +24,119 @@ class  IntMatrix:
          for y in range(self.dimY):
             print(s+"_"+str(x)+"("+str(y)+")= "+str(self.matrix[x][y]))
 
-class PowerMatrix (IntMatrix):
+class PowerMatrix:
    """
-   Matrix storing S_k(n) for k=0...maxK, n=1..maxN
+   Matrix storing S_k(n) for k=0...maxK, n=0..maxN, with S_k(0)=0.
+   Each row matrix[k] is an array('q') of 64 bit integers, or a list
+   of Python integers if S_k(maxN) does not fit in 64 bits.
+   The rows grow (at least doubling maxN) when a larger n is requested
+   through valueSum, valueSums or grow; the rows can also be accessed
+   directly as matrix[k][n], for n<=maxN.
+   After share() the matrix is read by many threads at once, so it
+   does not grow any more: a larger n raises RuntimeError.
    """
    def __init__(self, maxK, maxN):
-     IntMatrix.__init__(self, maxK+1,maxN+1)
-     #print("Making matrix, maxK=",maxK,"maxN=",maxN, "counting=", counting)
-     #set S_0(n) = n for all n 
-     self.matrix[0][0] = 0
-     for n in range(1, maxN+1):
-        self.matrix[0][n] = n
-     #set S_k(1) = 1 for all k   
-     for k in range(1, maxK+1):
-        self.matrix[k][0] = 0
-        self.matrix[k][1] = 1
-     #compute other values
-     for n in range(2, maxN+1):
-        p = 1; #init p as n^0 = 1
-        for k in range(1, maxK+1):  
-           p *= n # update p to n^k
-           self.matrix[k][n] = p + self.matrix[k][n-1]
+     self.maxK = maxK
+     self.maxN = 0
+     self.matrix = [array("q", [0]) for k in range(maxK+1)]
+     # rows of Python integers converted by valueSums into NumPy arrays
+     self.objects = [None]*(maxK+1)
+     self.shared = False
+     self.grow(maxN)
+     # dimensions of the matrix, as in IntMatrix
+     self.dimX = maxK+1
+
+   @property
+   def dimY(self):
+     return self.maxN+1
+
+   def share(self):
+     """
+     Forbid the matrix to grow, since it is used by many threads.
+     """
+     self.shared = True
+
+   def grow(self, n):
+     """
+     Make the matrix store S_k(m) for all m<=n, at least doubling
+     its size if it must grow.
+     """
+     if n<=self.maxN: return
+     if self.shared:
+       raise RuntimeError("shared PowerMatrix cannot grow from "+str(self.maxN)+" to "+str(n))
+     if self.maxN>0: n = max(n, 2*self.maxN)
+     start = self.maxN+1
+     for k in range(self.maxK+1):
+       row = self.matrix[k]
+       if type(row) is array and faulhaber(k, n)>=2**63:
+         row = self.matrix[k] = row.tolist()
+       if type(row) is array and np is not None:
+         # cumulative sums of m^k with NumPy, on 64 bit integers
+         values = np.arange(start, n+1, dtype=np.int64)**k
+         values[0] += row[-1]
+         row.frombytes(np.cumsum(values).tobytes())
+       else:
+         # S_k(m) = S_k(m-1) + m^k
+         row.extend(accumulate(map(pow, range(start, n+1), repeat(k)), initial=row[-1]))
+         row.pop(start-1) # initial value, already in the row
+     self.maxN = n
 
    def valueSum(self, k, n):
+      if n>self.maxN: self.grow(n)
       return self.matrix[k][n]
+
+   def valueSums(self, k, indices):
+      """
+      Return the NumPy array of S_k(n) for all n in the NumPy
+      array indices, where S_k(n)=0 for n<=0.
+      """
+      indices = np.maximum(indices, 0)
+      if len(indices)>0: self.grow(int(indices.max()))
+      row = self.matrix[k]
+      if type(row) is array:
+        return np.frombuffer(row, dtype=np.int64)[indices]
+      # the row is converted again only if it has grown
+      values = self.objects[k]
+      if values is None or len(values)!=len(row):
+        values = self.objects[k] = np.array(row, dtype=object)
+      return values[indices]
+
+   def printMatrix(self, s=""):
+      IntMatrix.printMatrix(self, s)
+
+def bernoulli(m):
+   """
+   Return the list of the Bernoulli numbers B_0..B_m (as fractions),
+   with B_1 = +1/2.
+   """
+   B = [Fraction(1)]
+   for i in range(1, m+1):
+     B.append(-sum([comb(i+1, j)*B[j] for j in range(i)]) / (i+1))
+   if m>=1: B[1] = -B[1]
+   return B
+
+def faulhaber(k, n):
+   """
+   Return S_k(n) = 1^k + 2^k + ... + n^k from the closed form
+   (Faulhaber's formula), without using the matrix:
+   S_k(n) = 1/(k+1) * sum for j=0..k of C(k+1,j) * B_j * n^(k+1-j).
+   """
+   if n<=0: return 0
+   if k==0: return n
+   if k==1: return n*(n+1)//2
+   if k==2: return n*(n+1)*(2*n+1)//6
+   if k==3: return (n*(n+1)//2)**2
+   B = bernoulli(k)
+   total = sum([comb(k+1, j)*B[j]*n**(k+1-j) for j in range(k+1)])
+   return int(total/(k+1))
+
+from array import array
+from itertools import accumulate, repeat
+from fractions import Fraction
+from math import comb
+
+# NumPy is optional, and only used by valueSums
+try:
+  import numpy as np
+except ImportError:
+  np = None
@@ -0,0 +1,319 @@
+"""
+Dense bitmap representation of 2D and 3D binary images.
+
+The image covers [0,SX] x [0,SY] (x [0,SZ] in 3D) and each row
+(fixed y, and fixed z in 3D) is stored in one of two ways:
+- "bytes": a bytearray of length SX+1 where black pixels
+  are 1 and white pixels are 0 (classes BW_Bitmap2D/3D)
+- "mask": a Python integer whose bit x is 1 iff pixel x
+  is black (classes BW_MaskBitmap2D/3D)
+
+With respect to a dictionary of black pixels, a bitmap takes one
+byte (or one bit) per pixel of the bounding box, and the runs of
+black pixels inside a row are found with the (C-level) bytearray
+search or with bit operations on the whole row, instead of one
+lookup per pixel.
+
+The decomposition methods (block decomposition, quadtree, octree)
+accept a bitmap in place of the list of black pixels.
+"""
+
+from coordfile import maxCoordinates
+from collections import deque
+from itertools import repeat
+from itertools import groupby
+from operator import getitem, setitem, itemgetter, sub
+
+# Global variable defining how rows are stored when a bitmap
+# is built from a list of pixels: "bytes" or "mask"
+ROW_MODE = "mask"
+
+def setRowMode(mode):
+  assert mode in ("bytes","mask")
+  global ROW_MODE
+  ROW_MODE = mode
+
+# translation of a bytearray row of 0/1 values into
+# the digits of a binary number
+DIGITS = bytes.maketrans(b"\x00\x01", b"01")
+
+def rowMask(row):
+  """
+  Return the integer whose bit x is the pixel x of the
+  given bytearray row.
+  """
+  return int(row.translate(DIGITS)[::-1], 2)
+
+def maskRuns(row):
+  """
+  Return the list of runs of black pixels of a row given as
+  an integer bitmask, as pairs (x0,x1) in increasing order of x.
+  Run starts are the black pixels whose left neighbour is white,
+  run ends are the ones whose right neighbour is white: both are
+  found with a few operations on the whole row, then taken
+  lowest bit first, so that the cost depends on the number of
+  runs and not on the length of the row.
+  """
+  starts = row & ~(row << 1)
+  ends = row & ~(row >> 1)
+  found = []
+  while starts:
+    s = starts & -starts
+    e = ends & -ends
+    found.append((s.bit_length()-1, e.bit_length()-1))
+    starts ^= s
+    ends ^= e
+  return found
+
+class BW_Bitmap2D:
+  """
+  Bitmap of a 2D image with one bytearray for each row.
+  """
+  def __init__(self, SX, SY):
+    """
+    Create an all white image covering [0,SX] x [0,SY].
+    """
+    self.max_coords = (SX,SY)
+    self.rows = [bytearray(SX+1) for y in range(SY+1)]
+
+  def set_black(self, x, y):
+    self.rows[y][x] = 1
+
+  def __contains__(self, c):
+    x,y = c
+    return self.rows[y][x]==1
+
+  def runs(self, y):
+    """
+    Return the list of runs of black pixels in row y,
+    as pairs (x0,x1) of the first and last pixel of the run,
+    in increasing order of x.
+    """
+    row = self.rows[y]
+    found = []
+    x0 = row.find(1)
+    while x0>=0:
+      x1 = row.find(0, x0)
+      if x1<0:
+        found.append((x0,len(row)-1))
+        break
+      found.append((x0,x1-1))
+      x0 = row.find(1, x1)
+    return found
+
+  def __len__(self):
+    return sum([row.count(1) for row in self.rows])
+
+  def num_elem(self):
+    """
+    Return the number of black elements, as the decompositions do.
+    """
+    return len(self)
+
+  def __iter__(self):
+    """
+    Iterate on the coordinates of the black pixels.
+    """
+    for y in range(len(self.rows)):
+      for x0,x1 in self.runs(y):
+        for x in range(x0,x1+1):
+          yield (x,y)
+
+class BW_Bitmap3D:
+  """
+  Bitmap of a 3D image with one bytearray for each row,
+  the rows of the slice z are in slices[z].
+  """
+  def __init__(self, SX, SY, SZ):
+    """
+    Create an all white image covering [0,SX] x [0,SY] x [0,SZ].
+    """
+    self.max_coords = (SX,SY,SZ)
+    self.slices = [[bytearray(SX+1) for y in range(SY+1)] for z in range(SZ+1)]
+
+  def set_black(self, x, y, z):
+    self.slices[z][y][x] = 1
+
+  def __contains__(self, c):
+    x,y,z = c
+    return self.slices[z][y][x]==1
+
+  def runs(self, y, z):
+    """
+    Return the list of runs of black voxels in row y of slice z,
+    as pairs (x0,x1) of the first and last voxel of the run,
+    in increasing order of x.
+    """
+    row = self.slices[z][y]
+    found = []
+    x0 = row.find(1)
+    while x0>=0:
+      x1 = row.find(0, x0)
+      if x1<0:
+        found.append((x0,len(row)-1))
+        break
+      found.append((x0,x1-1))
+      x0 = row.find(1, x1)
+    return found
+
+  def __len__(self):
+    return sum([sum([row.count(1) for row in S]) for S in self.slices])
+
+  def num_elem(self):
+    """
+    Return the number of black elements, as the decompositions do.
+    """
+    return len(self)
+
+  def __iter__(self):
+    """
+    Iterate on the coordinates of the black voxels.
+    """
+    for z in range(len(self.slices)):
+      for y in range(len(self.slices[z])):
+        for x0,x1 in self.runs(y,z):
+          for x in range(x0,x1+1):
+            yield (x,y,z)
+
+class BW_MaskBitmap2D(BW_Bitmap2D):
+  """
+  Bitmap of a 2D image with one integer bitmask for each row.
+  """
+  def __init__(self, SX, SY):
+    """
+    Create an all white image covering [0,SX] x [0,SY].
+    """
+    self.max_coords = (SX,SY)
+    self.rows = [0 for y in range(SY+1)]
+
+  def set_black(self, x, y):
+    self.rows[y] |= (1<<x)
+
+  def __contains__(self, c):
+    x,y = c
+    return (self.rows[y]>>x)&1==1
+
+  def runs(self, y):
+    return maskRuns(self.rows[y])
+
+  def __len__(self):
+    return sum([bin(row).count("1") for row in self.rows])
+
+class BW_MaskBitmap3D(BW_Bitmap3D):
+  """
+  Bitmap of a 3D image with one integer bitmask for each row,
+  the rows of the slice z are in slices[z].
+  """
+  def __init__(self, SX, SY, SZ):
+    """
+    Create an all white image covering [0,SX] x [0,SY] x [0,SZ].
+    """
+    self.max_coords = (SX,SY,SZ)
+    self.slices = [[0 for y in range(SY+1)] for z in range(SZ+1)]
+
+  def set_black(self, x, y, z):
+    self.slices[z][y] |= (1<<x)
+
+  def __contains__(self, c):
+    x,y,z = c
+    return (self.slices[z][y]>>x)&1==1
+
+  def runs(self, y, z):
+    return maskRuns(self.slices[z][y])
+
+  def __len__(self):
+    return sum([sum([bin(row).count("1") for row in S]) for S in self.slices])
+
+def fillRows(rows, black_pixels):
+  """
+  Set to 1 the black pixels in the bytearray rows (rows[y][x]).
+  For a BinaryImage the coordinates are taken from its columns,
+  row by row with map, without building a tuple per pixel.
+  """
+  if hasattr(black_pixels, "column"):
+    X, Y = black_pixels.column(0), black_pixels.column(1)
+    deque(map(setitem, map(rows.__getitem__, Y), X, repeat(1)), maxlen=0)
+    return
+  for x,y in black_pixels:
+    rows[y][x] = 1
+
+def fillSlices(slices, black_cubes):
+  """
+  Set to 1 the black voxels in the bytearray rows of the
+  slices (slices[z][y][x]), as fillRows.
+  """
+  if hasattr(black_cubes, "column"):
+    X, Y, Z = black_cubes.column(0), black_cubes.column(1), black_cubes.column(2)
+    rows = map(getitem, map(slices.__getitem__, Z), Y)
+    deque(map(setitem, rows, X, repeat(1)), maxlen=0)
+    return
+  for x,y,z in black_cubes:
+    slices[z][y][x] = 1
+
+def fillMasks(masks, keys, xs):
+  """
+  Set to 1 the bits xs[i] of the integer bitmasks masks[keys[i]].
+  Consecutive pixels with the same key (e.g. pixels sorted by row)
+  are set together: their bits are put in a bytearray spanning only
+  them, converted with rowMask, so neither a bytearray bitmap of the
+  whole image nor one big integer operation per pixel is needed.
+  """
+  for key, group in groupby(zip(keys, xs), itemgetter(0)):
+    found = [x for k,x in group]
+    low = min(found)
+    span = bytearray(max(found)-low+1)
+    deque(map(setitem, repeat(span), map(sub, found, repeat(low)), repeat(1)), 0)
+    masks[key] |= rowMask(span) << low
+
+def isBitmap(image):
+  return isinstance(image,(BW_Bitmap2D,BW_Bitmap3D))
+
+def makeBitmap2D(black_pixels, mode=None):
+  """
+  Build the bitmap of a 2D image given as a list of black
+  pixels (or as a BinaryImage), return it.
+  The rows are stored according to mode, by default
+  according to the global variable ROW_MODE.
+  If the argument already is a bitmap, return it as it is.
+  """
+  if isBitmap(black_pixels): return black_pixels
+  SX, SY = maxCoordinates(black_pixels, 2)
+  if (mode or ROW_MODE)=="mask":
+    # masks built directly, without the bytearray rows
+    M = BW_MaskBitmap2D(SX, SY)
+    if hasattr(black_pixels, "column"):
+      fillMasks(M.rows, black_pixels.column(1), black_pixels.column(0))
+    else:
+      fillMasks(M.rows, [y for x,y in black_pixels], [x for x,y in black_pixels])
+    return M
+  B = BW_Bitmap2D(SX, SY)
+  fillRows(B.rows, black_pixels)
+  return B
+
+def makeBitmap3D(black_cubes, mode=None):
+  """
+  Build the bitmap of a 3D image given as a list of black
+  voxels (or as a BinaryImage), return it.
+  The rows are stored according to mode, by default
+  according to the global variable ROW_MODE.
+  If the argument already is a bitmap, return it as it is.
+  """
+  if isBitmap(black_cubes): return black_cubes
+  SX, SY, SZ = maxCoordinates(black_cubes, 3)
+  if (mode or ROW_MODE)=="mask":
+    # masks built directly, without the bytearray rows,
+    # in one list with the row (y,z) at index z*(SY+1)+y
+    M = BW_MaskBitmap3D(SX, SY, SZ)
+    masks = [0]*((SY+1)*(SZ+1))
+    if hasattr(black_cubes, "column"):
+      Y, Z = black_cubes.column(1), black_cubes.column(2)
+      keys = [z*(SY+1)+y for y,z in zip(Y, Z)]
+      fillMasks(masks, keys, black_cubes.column(0))
+    else:
+      keys = [z*(SY+1)+y for x,y,z in black_cubes]
+      fillMasks(masks, keys, [x for x,y,z in black_cubes])
+    M.slices = [masks[z*(SY+1):(z+1)*(SY+1)] for z in range(SZ+1)]
+    return M
+  B = BW_Bitmap3D(SX, SY, SZ)
+  fillSlices(B.slices, black_cubes)
+  return B
@@ -2,11 +2,18 @@
 Common functions to all 3D methods.
 """
 
+from coordfile import isBinaryFile, readBinary
+import instrument
+from instrument import measure, methodName
+
 def readCubes(file_name):
   """
   Read from file the coordinates of the full cubes
   and return them in list of ternes.
+  If the file is in binary format (see coordfile.py), return
+  a BinaryImage which can be used in place of the list.
   """
+  if isBinaryFile(file_name): return readBinary(file_name, 3)
   ternes = []
   f = open(file_name,"r")
   for L in f:
@@ -21,10 +28,11 @@ def readCubes(file_name):
 def printMoments(MOME):
   #print("Momenti su quadtree con algoritmo di Wu et al.")
   #print(type(black_cubes))
-  for p in range(4):
-    for q in range(4):
-      for r in range(4):
-        if p+q+r>3: continue
+  top = max([p+q+r for p,q,r in MOME]+[3])
+  for p in range(top+1):
+    for q in range(top+1):
+      for r in range(top+1):
+        if p+q+r>top or (p,q,r) not in MOME: continue
         print("Moment ",p,q,r, " = ", int(MOME[(p,q,r)]))
 
 #Global variable defining the moments to be computed
@@ -33,13 +41,42 @@ orders = orders + [(1,1,0),(1,0,1),(0,1,1),(2,0,0),(0,2,0),(0,0,2)]
 orders = orders + [(0,1,2),(0,2,1),(1,2,0),(1,0,2),(2,0,1),(2,1,0)]
 orders = orders + [(3,0,0),(0,3,0),(0,0,3),(1,1,1)]
 
+def wantedOrders(wanted, high=False):
+  """
+  Return the list of the wanted orders, in the same order of
+  the global list orders (all of them if wanted is None).
+  A wanted order can be given as a triplet, or as a string of
+  three digits, e.g. "200" for (2,0,0).
+  With high=True, for the methods computing the wanted orders
+  with the kernels of kernelgen.py, orders above 3 are accepted
+  too, and follow the others by increasing order.
+  """
+  if wanted is None: return orders
+  wanted = set([tuple([int(c) for c in key]) if type(key) is str else tuple(key) for key in wanted])
+  for key in wanted:
+    if high and len(key)==3 and min(key)>=0: continue
+    assert key in orders, "no moment of order "+str(key)+" (orders above 3 only with the kernels, see kernelgen.py)"
+  higher = sorted([key for key in wanted if key not in orders], key=lambda key: (sum(key), [-c for c in key]))
+  return [key for key in orders if key in wanted] + higher
+
 def main(arg, decomposF, preprocF, momentsF, title):
    """
    Apply the function decompF to build a decomposition of the 3D
    image, and apply the function momentsF to compute the moments
    based on the decomposition.
    Print the string titleF, which describes the method.
+   An argument wanted=ORDERS, with ORDERS a comma separated list
+   of orders (e.g. wanted=000,100,010,001), computes only those moments:
+   the list is passed to preprocF and momentsF (orders above 3
+   only for the methods using the kernels of kernelgen.py).
+   An argument --stats or --stats=FILE records time and memory
+   of each stage (see instrument.py).
    """
+   arg = instrument.statsOption(arg)
+   wanted = None
+   for a in arg[1:]:
+     if a.startswith("wanted="): wanted = wantedOrders(a[7:].split(","), True)
+   arg = [a for a in arg if not a.startswith("wanted=")]
    
    print(title)
    if len(arg)<=1:
@@ -47,9 +84,10 @@ def main(arg, decomposF, preprocF, momentsF, title):
 
    else:
         print("---Read cubes from file "+ arg[1])
-        input_cubes = readCubes(arg[1])
+        instrument.CONTEXT.update({"image":arg[1], "dim":3})
+        input_cubes = measure("read", readCubes, arg[1])
         print("Number of black voxels:", len(input_cubes))
-        elements = decomposF(input_cubes)
+        elements = measure("decompose", decomposF, input_cubes)
         print("Number of black elements:", elements.num_elem())
         if hasattr(elements,"max_triplet"):
            print("Max sides:", elements.max_triplet())
@@ -60,7 +98,19 @@ def main(arg, decomposF, preprocF, momentsF, title):
            if t>1: times_to_repeat = t
         except:
            pass
-        for t in range(times_to_repeat):
-           if preprocF!=None: preprocF(elements)
-           moments = momentsF(elements)
+        if wanted is not None: print("Wanted orders:", wanted)
+        if instrument.ENABLED:
+           # each stage measured on its own
+           args = () if wanted is None else (wanted,)
+           if preprocF!=None:
+              measure("preprocess", lambda E: preprocF(E, *args), elements, times_to_repeat, methodName(preprocF))
+           moments = measure("moments", lambda E: momentsF(E, *args), elements, times_to_repeat, methodName(momentsF))
+        else:
+           for t in range(times_to_repeat):
+              if wanted is None:
+                 if preprocF!=None: preprocF(elements)
+                 moments = momentsF(elements)
+              else:
+                 if preprocF!=None: preprocF(elements, wanted)
+                 moments = momentsF(elements, wanted)
         printMoments(moments)
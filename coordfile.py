@@ -0,0 +1,271 @@
+"""
+Compact binary format for 2D and 3D images.
+
+It stores the same information as the text format (see DATA_FORMAT.TXT),
+that is the coordinates of the black pixels or voxels, but with
+fixed-width records that can be memory-mapped instead of parsed
+line by line.
+
+The file starts with a header of HEADER_SIZE bytes (little endian):
+- magic     4 bytes, equal to MAGIC
+- dim       uint8, 2 or 3
+- width     uint8, bytes per coordinate: 2 (uint16) or 4 (uint32)
+- 2 bytes of padding
+- count     uint64, number of black pixels (voxels)
+- minimum   3 x uint32, minimum coordinates (z=0 in 2D)
+- maximum   3 x uint32, maximum coordinates (z=0 in 2D)
+- padding up to HEADER_SIZE bytes
+Then count records follow, each made of dim coordinates x,y[,z]
+of the given width.
+"""
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b"MCB1"
+HEADER_SIZE = 64
+HEADER_FORMAT = "<4sBBxxQ3I3I"
+# array typecode for each coordinate width
+TYPECODE = {2:"H", 4:"I"}
+
+class BinaryImage:
+  """
+  A 2D or 3D image read from a binary file.
+  The coordinates are not converted into Python objects:
+  they stay in the memory-mapped file and are exposed as one
+  (strided) memoryview per Cartesian axis.
+  Iterating over the image yields the (x,y) or (x,y,z) coordinates
+  of the black pixels, as the list returned by the text readers.
+  """
+  def __init__(self, file_name):
+    self.file_name = file_name
+    f = open(file_name,"rb")
+    head = f.read(HEADER_SIZE)
+    if len(head)<HEADER_SIZE:
+      f.close()
+      raise ValueError(file_name+": truncated header")
+    magic, self.dim, self.width, self.count, \
+      mx, my, mz, Mx, My, Mz = struct.unpack_from(HEADER_FORMAT, head)
+    if magic!=MAGIC:
+      f.close()
+      raise ValueError(file_name+" is not a binary image file")
+    if self.dim not in (2,3) or self.width not in TYPECODE:
+      f.close()
+      raise ValueError(file_name+": bad dimension "+str(self.dim)
+                       +" or coordinate width "+str(self.width))
+    self.min_coords = (mx,my,mz)[0:self.dim]
+    self.max_coords = (Mx,My,Mz)[0:self.dim]
+    self.mapped = None
+    size = HEADER_SIZE + self.count*self.dim*self.width
+    if os.fstat(f.fileno()).st_size<size:
+      f.close()
+      raise ValueError(file_name+": truncated file, the header announces "
+                       +str(self.count)+" records")
+    if self.count==0:
+      values = memoryview(array(TYPECODE[self.width]))
+    elif sys.byteorder=="little":
+      self.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      values = memoryview(self.mapped)[HEADER_SIZE:size].cast(TYPECODE[self.width])
+    else:
+      # records are little endian, a copy is needed on big endian machines
+      values = array(TYPECODE[self.width])
+      f.seek(HEADER_SIZE)
+      values.fromfile(f, self.count*self.dim)
+      values.byteswap()
+      values = memoryview(values)
+    f.close()
+    self.values = values
+    self.columns = [values[axis::self.dim] for axis in range(self.dim)]
+
+  def column(self, axis):
+    """
+    Return the coordinates along the given axis (0=x, 1=y, 2=z)
+    of all black pixels, as a memoryview on the file.
+    """
+    return self.columns[axis]
+
+  def __len__(self):
+    return self.count
+
+  def __iter__(self):
+    return zip(*self.columns)
+
+  def close(self):
+    # all views on the mapped file must be released before closing it
+    for c in self.columns: c.release()
+    self.columns = None
+    self.values.release()
+    if self.mapped is not None:
+      self.mapped.close()
+
+def isBinaryFile(file_name):
+  """
+  Return true iff the file starts with the magic string of
+  the binary image format.
+  """
+  f = open(file_name,"rb")
+  magic = f.read(len(MAGIC))
+  f.close()
+  return magic==MAGIC
+
+def readBinary(file_name, dim):
+  """
+  Open a binary image file and return it as a BinaryImage,
+  checking that it has the given dimension.
+  """
+  img = BinaryImage(file_name)
+  assert img.dim==dim, file_name+" is not a "+str(dim)+"D image"
+  return img
+
+def maxCoordinates(pixels, dim):
+  """
+  Return the tuple of the maximum coordinates of the black
+  pixels (voxels), taken from the header for a BinaryImage
+  (or from the size of a bitmap, see bitmap.py),
+  otherwise computed by scanning the list.
+  For an empty image they are all 0, as in the header of
+  an empty binary file.
+  """
+  if hasattr(pixels, "max_coords"):
+    return pixels.max_coords
+  if len(pixels)==0: return (0,)*dim
+  return tuple(max([c[axis] for c in pixels]) for axis in range(dim))
+
+def countPixels(file_name):
+  """
+  Return the number of black pixels (voxels) of an image file,
+  taken from the header of a binary file, otherwise counting
+  the non-empty lines of the text file, without converting
+  the coordinates.
+  """
+  f = open(file_name,"rb")
+  head = f.read(HEADER_SIZE)
+  if head[0:len(MAGIC)]==MAGIC:
+    f.close()
+    return struct.unpack_from(HEADER_FORMAT, head)[3]
+  f.seek(0)
+  count = 0
+  for L in f:
+    if L.strip(): count += 1
+  f.close()
+  return count
+
+def writeBinary(file_name, coords, dim, width=None):
+  """
+  Write the coordinates (an iterable of pairs or triplets) into
+  a binary image file.
+  If width (2 or 4 bytes per coordinate) is not given, it is the
+  smallest one fitting the maximum coordinate, and this requires
+  to read the whole iterable before writing.
+  Raise ValueError if a coordinate is negative or does not fit
+  the width, or if a record has not dim coordinates.
+  """
+  if width is None:
+    coords = list(coords)
+    top = max([max(c) for c in coords]) if coords else 0
+    width = 2 if top<(1<<16) else 4
+  assert dim in (2,3) and width in TYPECODE
+  limit = 1<<(8*width)
+  count = 0
+  low = [(1<<32)-1]*dim
+  high = [0]*dim
+  f = open(file_name,"wb")
+  f.write(bytes(HEADER_SIZE)) # header rewritten at the end
+  buf = array(TYPECODE[width])
+  for c in coords:
+    if len(c)!=dim or min(c)<0 or max(c)>=limit:
+      f.close()
+      os.remove(file_name)
+      raise ValueError(file_name+": record "+str(count)+" "+str(tuple(c))
+                       +" is not made of "+str(dim)+" coordinates in [0,"
+                       +str(limit)+")")
+    for axis in range(dim):
+      v = c[axis]
+      if v<low[axis]: low[axis] = v
+      if v>high[axis]: high[axis] = v
+    buf.extend(c)
+    count += 1
+    if len(buf)>=(1<<16):
+      if sys.byteorder!="little": buf.byteswap()
+      buf.tofile(f)
+      buf = array(TYPECODE[width])
+  if sys.byteorder!="little": buf.byteswap()
+  buf.tofile(f)
+  if count==0: low = [0]*dim
+  low = low+[0]*(3-dim)
+  high = high+[0]*(3-dim)
+  f.seek(0)
+  f.write(struct.pack(HEADER_FORMAT, MAGIC, dim, width, count, *(low+high)))
+  f.close()
+  return count
+
+def convertText(text_name, binary_name, dim):
+  """
+  Convert an image from the text format to the binary format.
+  """
+  if dim==2:
+    from commons2D import readPixels as readInput
+  else:
+    from commons3D import readCubes as readInput
+  coords = readInput(text_name)
+  return writeBinary(binary_name, coords, dim)
+
+def binaryName(text_name):
+  """
+  Return the name of the binary file associated with a text file,
+  obtained by replacing the extension .txt by .bin.
+  """
+  if text_name.endswith(".txt"):
+    return text_name[0:-4]+".bin"
+  return text_name+".bin"
+
+def readList(file_name):
+  """
+  Return the names of the images in a list file (as the
+  files lista* used in the experiments).
+  """
+  f = open(file_name, "r")
+  images = f.read().split()
+  f.close()
+  return images
+
+def options(arg):
+  """
+  Return the dictionary of the command line arguments name=value.
+  """
+  return dict([a.split("=", 1) for a in arg if "=" in a])
+
+def convertList(list_name, dim):
+  """
+  Convert all images named in the given list file (as the files
+  lista* used in the experiments) and write a new list file
+  with the names of the binary images, that can be given to
+  main_for_tests.py in place of the original list.
+  """
+  names = readList(list_name)
+  out = open(list_name+"_bin","w")
+  for name in names:
+    n = convertText(name, binaryName(name), dim)
+    print("  "+name+" -> "+binaryName(name)+" ("+str(n)+" elements)")
+    out.write(binaryName(name)+"\n")
+  out.close()
+  return list_name+"_bin"
+
+#---------------------MAIN-----------------------
+
+def main(arg):
+    if len(arg)<=2 or arg[1] not in ("2","3") or (arg[2]=="-list" and len(arg)<=3):
+         print("Usage: coordfile.py DIM image.txt [image.bin]")
+         print("       coordfile.py DIM -list list_file")
+    elif arg[2]=="-list":
+         print("Written list "+convertList(arg[3], int(arg[1])))
+    else:
+         out = arg[3] if len(arg)>3 else binaryName(arg[2])
+         n = convertText(arg[2], out, int(arg[1]))
+         print("Written "+str(n)+" elements on "+out)
+
+if __name__ == "__main__":
+   main(sys.argv)
@@ -0,0 +1,289 @@
+"""
+Differential check of the decompositions and of the moment
+methods against the direct computation over the pixels.
+
+For a set of small test images (random blocks, the same blocks
+far from the origin, rows of a single pixel between empty rows,
+a single pixel, pixels at the origin, a full square) and for the
+images given on the command line:
+- extractBlocksNumpy must build the same blocks as extractBlocks,
+  in the same order, from a list of pixels, a binary image file
+  and a bitmap, and also when NumPy is not available (fallback);
+- every moment method must return exactly the moments computed
+  as sums over the pixels (bruteMoments in kernelgen.py): old and
+  new tree and block methods at all optimization levels, tree
+  builders, runs, exact, grouped and vectorized engines (also
+  without NumPy), wanted orders, and the kernels of kernelgen.py
+  up to order KERNEL_ORDER, also asked to the new block and tree
+  engines as wanted orders.
+
+Usage:
+  python3 crosscheck.py DIM [image ...]
+print TUTTO VA BENE if all checks pass, otherwise the differences
+and ERRORE, and exit with status 1.
+"""
+
+import os
+import random
+import sys
+import tempfile
+
+# max order of the moments checked with the kernels of kernelgen.py
+KERNEL_ORDER = 5
+
+# modules whose NumPy paths have a fallback in pure Python
+NUMPY_MODULES = ["bigmatrix", "momentVec", "powersums", "bitmap",
+  "quadtree", "octree", "spiliotis2D", "spiliotis3D",
+  "momentBlockNew2D", "momentBlockNew3D", "momentTreeNew2D",
+  "momentTreeNew3D", "momentRuns2D", "momentRuns3D"]
+
+#---------------------TEST IMAGES-----------------------
+
+def randomBlocks(dim, side, num, seed):
+  """
+  Return the sorted list of the black pixels (voxels) of
+  num random blocks, possibly overlapping, in a cube of the
+  given side.
+  """
+  rnd = random.Random(seed)
+  black = set()
+  for i in range(num):
+    low = [rnd.randrange(side) for a in range(dim)]
+    high = [min(side, c+rnd.randrange(1, side//3+2)) for c in low]
+    ranges = [range(low[a], high[a]) for a in range(dim)]
+    black.update(product(*ranges))
+  return sorted(black)
+
+def testImages(dim):
+  """
+  Return the list of the test images, as pairs (name, pixels).
+  """
+  side = 40 if dim==2 else 14
+  blocks = randomBlocks(dim, side, 12, 1)
+  offset = (101, 57, 33)[0:dim]
+  far = [tuple([c+o for c,o in zip(p, offset)]) for p in blocks]
+  # one pixel every third row, the other rows empty
+  if dim==2:
+    sparse = [((7*y)%23, y) for y in range(0, 30, 3)] + [(30, 27)]
+  else:
+    sparse = [((7*y)%11, y, z) for z in range(0, 9, 2) for y in range(0, 12, 3)]
+  # a full square (cube) of side 16 and one more pixel, since
+  # the pointer trees cannot be made of the root only
+  full = list(product(range(16), repeat=dim)) + [(20,)+(0,)*(dim-1)]
+  return [("blocks", blocks), ("offset", far), ("sparse rows", sparse),
+          ("single pixel", [(5, 9, 2)[0:dim]]), ("origin", [(0,)*dim, (1,)*dim]),
+          ("full", full)]
+
+#---------------------DECOMPOSITIONS-----------------------
+
+def withoutNumpy(function, *args):
+  """
+  Call the function with the NumPy paths of the modules
+  disabled, as if NumPy were not installed.
+  """
+  saved = dict()
+  for name in NUMPY_MODULES:
+    module = sys.modules.get(name)
+    if module is not None and getattr(module, "np", None) is not None:
+      saved[name] = module.np
+      module.np = None
+  try:
+    return function(*args)
+  finally:
+    for name, np in saved.items(): sys.modules[name].np = np
+
+def sameBlocks(first, second):
+  return list(zip(*first.columns()))==list(zip(*second.columns()))
+
+def binaryCopy(pixels, dim):
+  """
+  Write the pixels to a temporary binary file (see coordfile.py)
+  and return it open as a BinaryImage, with the file name.
+  """
+  handle, name = tempfile.mkstemp(suffix=".bin")
+  os.close(handle)
+  writeBinary(name, pixels, dim)
+  return readBinary(name, dim), name
+
+def checkDecomposition(dim, name, pixels):
+  """
+  Check extractBlocksNumpy against extractBlocks, block for block,
+  on the given image as list, binary file and bitmaps,
+  and the fallback without NumPy.
+  Return the number of errors.
+  """
+  if dim==2:
+    from spiliotis2D import extractBlocks, extractBlocksNumpy, np
+    from bitmap import makeBitmap2D as makeBitmap
+  else:
+    from spiliotis3D import extractBlocks, extractBlocksNumpy, np
+    from bitmap import makeBitmap3D as makeBitmap
+  expected = extractBlocks(pixels)
+  inputs = [("list", pixels), ("bytes bitmap", makeBitmap(pixels, "bytes")),
+            ("mask bitmap", makeBitmap(pixels, "mask"))]
+  image, file_name = binaryCopy(pixels, dim)
+  inputs.append(("binary file", image))
+  errors = 0
+  try:
+    for kind, data in inputs:
+      if np is not None and not sameBlocks(expected, extractBlocksNumpy(data)):
+        print("ERRORE:", name, "NumPy blocks from", kind, "are different")
+        errors += 1
+      if not sameBlocks(expected, withoutNumpy(extractBlocksNumpy, data)):
+        print("ERRORE:", name, "blocks without NumPy from", kind, "are different")
+        errors += 1
+  finally:
+    image.close()
+    os.remove(file_name)
+  return errors
+
+#---------------------MOMENTS-----------------------
+
+def blockEngineMoments(dim, level):
+  """
+  Return a function computing the moments of a block
+  decomposition with a new engine of the given level.
+  """
+  if dim==2: from momentBlockNew2D import BW_BlockEngine2D as Engine
+  else: from momentBlockNew3D import BW_BlockEngine3D as Engine
+  def moments(ibr, wanted=None):
+    engine = Engine(level)
+    engine.preprocessing(ibr, wanted)
+    return engine.blockMoments(ibr, wanted)
+  return moments
+
+def withPreprocessing(preprocF, momentsF):
+  def moments(elements, wanted=None):
+    if wanted is None: preprocF(elements)
+    else: preprocF(elements, wanted)
+    return momentsF(elements) if wanted is None else momentsF(elements, wanted)
+  return moments
+
+def methods(dim):
+  """
+  Return the list of the methods to be checked, as triplets
+  (name, decomposition, moments); the moments function takes
+  the decomposition and optionally the wanted orders.
+  """
+  if dim==2:
+    from quadtree import buildQuadtree, buildLinearQuadtree, buildStreamQuadtree, buildSummedQuadtree
+    import spiliotis2D as blocks, momentBlock2D as blockOld, momentBlockNew2D as blockNew
+    import momentTree2D as treeOld, momentTreeNew2D as treeNew, momentRuns2D as runs
+    trees = [("tree", buildQuadtree), ("linear tree", buildLinearQuadtree),
+             ("stream tree", buildStreamQuadtree), ("summed tree", buildSummedQuadtree)]
+    tree_old, tree_new = treeOld.quadtreeMoments, treeNew.quadtreeMoments
+    tree_exact, tree_levels, tree_vec = treeNew.quadtreeMomentsExact, treeNew.quadtreeMomentsLevels, treeNew.quadtreeMomentsVec
+  else:
+    from octree import buildOctree, buildLinearOctree, buildStreamOctree, buildSummedOctree
+    import spiliotis3D as blocks, momentBlock3D as blockOld, momentBlockNew3D as blockNew
+    import momentTree3D as treeOld, momentTreeNew3D as treeNew, momentRuns3D as runs
+    trees = [("tree", buildOctree), ("linear tree", buildLinearOctree),
+             ("stream tree", buildStreamOctree), ("summed tree", buildSummedOctree)]
+    tree_old, tree_new = treeOld.octreeMoments, treeNew.octreeMoments
+    tree_exact, tree_levels, tree_vec = treeNew.octreeMomentsExact, treeNew.octreeMomentsLevels, treeNew.octreeMomentsVec
+  L = []
+  for name, build in trees:
+    L.append((name+" old", build, tree_old))
+    L.append((name+" new", build, withPreprocessing(treeNew.preprocessing, tree_new)))
+    L.append((name+" exact", build, tree_exact))
+    L.append((name+" levels", build, tree_levels))
+    L.append((name+" vec", build, tree_vec))
+  engine = runs.BW_RunEngine2D() if dim==2 else runs.BW_RunEngine3D()
+  L.append(("runs", runs.extractRuns, withPreprocessing(engine.preprocessing, engine.runMoments)))
+  L.append(("runs vec", runs.extractRuns, withPreprocessing(engine.preprocessing, engine.runMomentsVec)))
+  L.append(("runs scan", runs.scanImage, withPreprocessing(engine.preprocessing, engine.scanMoments)))
+  L.append(("block old", blocks.extractBlocks, withPreprocessing(blockOld.preprocessing, blockOld.blockMoments)))
+  for level in range(5):
+    L.append(("block new level "+str(level), blocks.extractBlocks, blockEngineMoments(dim, level)))
+  L.append(("block grouped", blocks.extractBlocks, blockNew.blockMomentsGrouped))
+  L.append(("block exact", blocks.extractBlocks, blockNew.blockMomentsExact))
+  L.append(("block vec", blocks.extractBlocks, blockNew.blockMomentsVec))
+  return L
+
+def compareMoments(title, MM, expected):
+  """
+  Print the moments of MM different from the expected ones,
+  and return their number.
+  """
+  errors = 0
+  for order, value in expected.items():
+    if MM.get(order)!=value:
+      print("ERRORE:", title, "moment", order, "is", MM.get(order), "instead of", value)
+      errors += 1
+  return errors
+
+def checkMoments(dim, name, pixels):
+  """
+  Check all moment methods, with and without NumPy, all orders
+  and only some wanted ones, and the kernels of kernelgen.py,
+  against the direct sums over the pixels.
+  Return the number of errors.
+  """
+  if dim==2:
+    from commons2D import orders
+    from spiliotis2D import extractBlocks
+    from quadtree import buildQuadtree as buildTree
+    import momentTreeNew2D as treeNew
+    treeMoments = treeNew.quadtreeMoments
+    wanted = [(0,0), (2,0), (1,2)]
+  else:
+    from commons3D import orders
+    from spiliotis3D import extractBlocks
+    from octree import buildOctree as buildTree
+    import momentTreeNew3D as treeNew
+    treeMoments = treeNew.octreeMoments
+    wanted = [(0,0,0), (2,0,0), (1,1,1), (0,1,2)]
+  expected = bruteMoments(pixels, orders)
+  some = dict([(order, expected[order]) for order in wanted])
+  errors = 0
+  for title, decompose, moments in methods(dim):
+    title = name+", "+title
+    errors += compareMoments(title, moments(decompose(pixels)), expected)
+    errors += compareMoments(title+" without NumPy", withoutNumpy(lambda: moments(decompose(pixels))), expected)
+    try:
+      MM = moments(decompose(pixels), wanted)
+    except TypeError: # no argument wanted
+      continue
+    errors += compareMoments(title+" wanted", MM, some)
+  high = makeOrders(dim, KERNEL_ORDER)
+  expected = bruteMoments(pixels, high)
+  errors += compareMoments(name+", block kernel", blockMomentsKernel(extractBlocks(pixels), high), expected)
+  errors += compareMoments(name+", tree kernel", treeMomentsKernel(buildTree(pixels), high), expected)
+  # orders above 3 asked to the engines as wanted orders
+  above = [order for order in high if sum(order)>3]
+  errors += compareMoments(name+", block engine above 3", blockEngineMoments(dim, 2)(extractBlocks(pixels), above),
+                           dict([(order, expected[order]) for order in above]))
+  errors += compareMoments(name+", tree engine above 3", withPreprocessing(treeNew.preprocessing, treeMoments)(buildTree(pixels), above),
+                           dict([(order, expected[order]) for order in above]))
+  return errors
+
+def checkImage(dim, name, pixels):
+  print("---Check", name, "("+str(len(pixels)), "pixels)")
+  return checkDecomposition(dim, name, pixels) + checkMoments(dim, name, pixels)
+
+#---------------------MAIN-----------------------
+
+from itertools import product
+from coordfile import writeBinary, readBinary
+from kernelgen import bruteMoments, makeOrders, blockMomentsKernel, treeMomentsKernel
+
+def main(arg):
+  try:
+    dim = int(arg[1])
+    assert dim in (2,3)
+  except:
+    print(__doc__)
+    sys.exit(2)
+  if dim==2: from commons2D import readPixels as readInput
+  else: from commons3D import readCubes as readInput
+  images = testImages(dim) + [(name, list(readInput(name))) for name in arg[2:]]
+  errors = 0
+  for name, pixels in images:
+    errors += checkImage(dim, name, pixels)
+  if errors==0: print("TUTTO VA BENE")
+  else:
+    print("ERRORE:", errors, "differences")
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main(sys.argv)
@@ -0,0 +1,146 @@
+"""
+Instrumentation of the stages of the computation: read,
+decompose, preprocess and moments, for each method.
+
+When enabled (see enable), each stage is executed some times
+for warm-up, then the given number of samples (at least SAMPLES)
+is taken, recording the wall time (time.perf_counter) and the
+CPU time (time.process_time) of each execution, and one more
+execution records the peak of memory allocated (tracemalloc).
+For each stage a record is written as one line of JSON, with
+the median and the interquartile range of the times, e.g.
+  {"stage": "moments", "method": "momentBlockNew2D.blockMoments",
+   "image": "FileMpeg/dog01.txt", "samples": 5, "warmup": 1,
+   "wall_median": 0.0123, "wall_iqr": 0.0004, ...}
+When disabled (default), measure only executes the stage the
+given number of times, as the function ripeti in main_for_tests.py.
+
+Usage from the command line: main_for_tests.py and the programs
+using commons2D.main or commons3D.main accept an argument
+  --stats        write the records on standard output
+  --stats=FILE   append the records to FILE
+"""
+
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+ENABLED = False
+# executions before the samples, not recorded
+WARMUP = 1
+# min number of samples
+SAMPLES = 5
+# file where the records are written
+OUTPUT = None
+# fields added to all records (image, dimension, ...)
+CONTEXT = dict()
+
+def enable(file_name=None, warmup=WARMUP, samples=SAMPLES):
+  """
+  Enable the instrumentation, writing the records to the
+  file (appending), or to standard output if file_name is None.
+  """
+  global ENABLED, WARMUP, SAMPLES, OUTPUT
+  ENABLED = True
+  WARMUP = warmup
+  SAMPLES = samples
+  if file_name is None: OUTPUT = sys.stdout
+  else: OUTPUT = open(file_name, "a")
+
+def disable():
+  global ENABLED, OUTPUT
+  ENABLED = False
+  if OUTPUT is not None and OUTPUT is not sys.stdout: OUTPUT.close()
+  OUTPUT = None
+
+def statsOption(arg):
+  """
+  Enable the instrumentation if an argument --stats or
+  --stats=FILE is in the list arg, and return the list
+  without it.
+  """
+  for a in arg:
+    if a=="--stats": enable()
+    elif a.startswith("--stats="): enable(a[8:])
+  return [a for a in arg if a!="--stats" and not a.startswith("--stats=")]
+
+def methodName(function):
+  """
+  Return module.name of the function (with the name of the
+  program file in place of __main__).
+  """
+  module = getattr(function, "__module__", "?")
+  if module=="__main__": module = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+  return module+"."+getattr(function, "__name__", "?")
+
+def summary(values):
+  """
+  Return the median and the interquartile range of the values.
+  """
+  if len(values)<2: return values[0], 0.0
+  q1, q2, q3 = statistics.quantiles(values, n=4, method="inclusive")
+  return q2, q3-q1
+
+def measure(stage, function, argom, times=1, method=None):
+  """
+  Execute function(argom) times times (when disabled), or
+  measure it (when enabled) and write its record.
+  Return the last result.
+  """
+  if not ENABLED:
+    for t in range(times):
+      risultato = function(argom)
+    return risultato
+  for t in range(WARMUP):
+    function(argom)
+  walls, cpus = [], []
+  for t in range(max(times, SAMPLES)):
+    wall, cpu = time.perf_counter(), time.process_time()
+    risultato = function(argom)
+    cpus.append(time.process_time()-cpu)
+    walls.append(time.perf_counter()-wall)
+  tracing = tracemalloc.is_tracing()
+  if not tracing: tracemalloc.start()
+  tracemalloc.reset_peak()
+  start = tracemalloc.get_traced_memory()[0]
+  function(argom)
+  peak = tracemalloc.get_traced_memory()[1]-start
+  if not tracing: tracemalloc.stop()
+  record = dict(CONTEXT)
+  record["stage"] = stage
+  record["method"] = method or methodName(function)
+  record["samples"] = len(walls)
+  record["warmup"] = WARMUP
+  record["wall_median"], record["wall_iqr"] = summary(walls)
+  record["cpu_median"], record["cpu_iqr"] = summary(cpus)
+  record["peak_bytes"] = peak
+  OUTPUT.write(json.dumps(record)+"\n")
+  OUTPUT.flush()
+  return risultato
+
+#---------------------MAIN-----------------------
+
+def main(arg):
+  """
+  Print the records of a file written with --stats=FILE
+  as a table, grouped by image.
+  """
+  if len(arg)<2:
+    print(__doc__)
+    return
+  f = open(arg[1], "r")
+  records = [json.loads(L) for L in f if L.strip()]
+  f.close()
+  image = None
+  for r in records:
+    if r.get("image")!=image:
+      image = r.get("image")
+      print("---Image", image)
+    print("  %-10s %-40s wall %10.6f s (IQR %.6f)  cpu %10.6f s  peak %10.1f KB" %
+          (r["stage"], r["method"], r["wall_median"], r["wall_iqr"], r["cpu_median"], r["peak_bytes"]/1024))
+
+if __name__ == "__main__":
+  main(sys.argv)
@@ -0,0 +1,265 @@
+"""
+Generator of specialized kernels computing the moments of any
+order of a set of blocks (rectangles or cuboids) or of the leaves
+of a quadtree (octree).
+
+The kernels work with integers only, as the exact engines (see
+blockMomentsExact in momentBlockNew2D.py): for a side of D pixels
+with doubled barycenter X, the sum of (2x)^k over its pixels is
+obtained from the central ones by the binomial expansion
+  T_k = sum for i=0..k of C(k,i) * X^(k-i) * U_i(D)
+where U_i(D) is the sum of (2j-D+1)^i for j=0..D-1, which is
+zero for i odd and U_0(D) = D.
+Then 2^(p+q+r)*m_{p,q,r} is the sum over the blocks of
+Tx_p*Ty_q*Tz_r.
+
+For a given dimension, set of orders and kind of input (blocks
+or tree leaves) the source of a kernel is generated as straight
+line code (powers of X, terms T_k and products of the terms of
+y and z are computed once and shared by all orders), compiled
+with exec and kept in KERNELS for the next calls.
+
+Moments of order above 3 (e.g. up to 8) are computed by calling
+blockMomentsKernel or treeMomentsKernel directly, by the main below,
+or by asking them as wanted orders to the engines of momentBlockNew*
+and momentTreeNew* (e.g. wanted=40,22,04 on the command line of
+those modules), which pass them to these kernels. The other methods
+(old modules, runs, vectorized, grouped) compute at most order 3,
+and wantedOrders in commons2D.py and commons3D.py rejects higher
+orders for them.
+
+Usage:
+  python3 kernelgen.py DIM max_order image [tree]
+print the moments up to max_order of the image, computed on the
+block decomposition (or on the quadtree/octree), check them against
+the direct sum over the pixels, and print the source of the kernel.
+"""
+
+from itertools import product
+from math import comb
+
+# (dim, orders, kind) -> compiled kernel
+KERNELS = dict()
+# (dim, orders, kind) -> source of the kernel
+SOURCES = dict()
+
+AXES = "XYZ"
+
+def makeOrders(dim, max_order):
+  """
+  Return the list of all orders (tuples of dim indices) with
+  sum of the indices not greater than max_order.
+  """
+  return [order for order in product(range(max_order+1), repeat=dim) if sum(order)<=max_order]
+
+def kernelSource(dim, orders, kind="block"):
+  """
+  Return the source of the kernel for the given orders.
+  The kernel of kind "block" has arguments the columns x0,y0[,z0],x1,y1[,z1]
+  and the tables U[i][D] (lists or dictionaries); the kernel of kind "tree" has arguments
+  the leaves (x,y[,z],e) and the tables U[i][e], with U[0][e]=2^e.
+  Both return the list of the sums 2^(p+q+r)*m_{p,q,r}, in the
+  order of orders.
+  """
+  top = [max([order[a] for order in orders]) for a in range(dim)]
+  even = [i for i in range(2, max(top)+1, 2)]
+  S = []
+  S.append("def kernel(elements, U):")
+  for i in even: S.append("  U%d = U[%d]" % (i, i))
+  if kind=="tree": S.append("  U0 = U[0]")
+  for j in range(len(orders)): S.append("  n%d = 0" % j)
+  if kind=="block":
+    lows = ",".join(["%s0" % A.lower() for A in AXES[:dim]])
+    highs = ",".join(["%s1" % A.lower() for A in AXES[:dim]])
+    S.append("  for %s,%s in zip(*elements):" % (lows, highs))
+  else:
+    coords = ",".join([A.lower() for A in AXES[:dim]])
+    S.append("  for %s,e in elements:" % coords)
+    S.append("    D = U0[e]")
+    for i in even: S.append("    u%d = U%d[e]" % (i, i))
+  for a in range(dim):
+    A = AXES[a]
+    a0, a1 = A.lower()+"0", A.lower()+"1"
+    # side and doubled barycenter
+    if kind=="block":
+      D = "D"+A
+      S.append("    %s = %s-%s+1" % (D, a1, a0))
+      S.append("    %s = %s+%s" % (A, a0, a1))
+      for i in even:
+        if i<=top[a]: S.append("    u%d%s = U%d[%s]" % (i, A, i, D))
+      u = lambda i: "u%d%s" % (i, A)
+    else:
+      D = "D"
+      S.append("    %s = 2*%s+D-1" % (A, A.lower()))
+      u = lambda i: "u%d" % i
+    # powers of the barycenter
+    for k in range(2, top[a]+1):
+      S.append("    %s%d = %s*%s" % (A, k, A+(str(k-1) if k>2 else ""), A))
+    power = lambda k: A if k==1 else "%s%d" % (A, k)
+    # terms T_k from the central sums
+    for k in range(1, top[a]+1):
+      terms = []
+      for i in range(0, k+1, 2):
+        coeff = comb(k, i)
+        central = D if i==0 else u(i)
+        factors = ([str(coeff)] if coeff>1 else []) + ([power(k-i)] if k>i else []) + [central]
+        terms.append("*".join(factors))
+      S.append("    T%s%d = %s" % (A, k, " + ".join(terms)))
+  term = lambda a, k: ("D"+AXES[a] if kind=="block" else "D") if k==0 else "T%s%d" % (AXES[a], k)
+  # shared products of the terms of the axes after the first one
+  shared = dict()
+  if dim==3:
+    for order in orders:
+      key = order[1:]
+      if key not in shared:
+        shared[key] = "P%d_%d" % key
+        S.append("    %s = %s*%s" % (shared[key], term(1, key[0]), term(2, key[1])))
+  for j, order in enumerate(orders):
+    if dim==3 and order[1:] in shared:
+      factors = [term(0, order[0]), shared[order[1:]]]
+    else:
+      factors = [term(a, k) for a,k in enumerate(order)]
+    S.append("    n%d += %s" % (j, "*".join(factors)))
+  S.append("  return [%s]" % ", ".join(["n%d" % j for j in range(len(orders))]))
+  return "\n".join(S) + "\n"
+
+def getKernel(dim, orders, kind="block"):
+  """
+  Return the compiled kernel for the given orders,
+  generating it the first time.
+  """
+  key = (dim, tuple(orders), kind)
+  if key not in KERNELS:
+    source = kernelSource(dim, orders, kind)
+    space = dict()
+    exec(compile(source, "<kernel %dD %s>" % (dim, kind), "exec"), space)
+    KERNELS[key] = space["kernel"]
+    SOURCES[key] = source
+  return KERNELS[key]
+
+def centralSums(max_order, sides):
+  """
+  Return the tables U[i][j] = U_i(sides[j]) for i=0..max_order,
+  where U_i(D) = sum of (2j-D+1)^i for j=0..D-1, from the
+  closed forms of the sums of powers (Faulhaber):
+  U_i(D) = sum for m=0..i of C(i,m) * 2^m * (1-D)^(i-m) * S_m(D-1)
+  with S_m(n) = 0^m + 1^m + ... + n^m.
+  """
+  U = [list(sides)]
+  for i in range(1, max_order+1):
+    if i%2==1:
+      U.append([0]*len(sides))
+      continue
+    row = []
+    for D in sides:
+      if D==0:
+        row.append(0)
+        continue
+      total = 0
+      for m in range(i+1):
+        S = faulhaber(m, D-1) + (1 if m==0 else 0)
+        total += comb(i, m) * 2**m * (1-D)**(i-m) * S
+      row.append(total)
+    U.append(row)
+  return U
+
+def blockMomentsKernel(ibr, orders):
+  """
+  Return the moments (a dictionary with key the order) of
+  a set of blocks, with the kernel for the given orders.
+  """
+  columns = ibr.columns()
+  dim = len(columns)//2
+  if ibr.size()==0: return {key:0 for key in orders}
+  # central sums only for the sides of the blocks, as dictionaries
+  sides = set()
+  for a in range(dim): sides.update(map(sub, columns[dim+a], columns[a]))
+  sides = [d+1 for d in sides]
+  max_order = max([max(order) for order in orders])
+  U = [dict(zip(sides, row)) for row in centralSums(max_order, sides)]
+  N = getKernel(dim, orders, "block")(columns, U)
+  return dict([(order, n >> sum(order)) for order, n in zip(orders, N)])
+
+def treeCentralSums(T, orders):
+  """
+  Return the tables U[i][e] of the central sums of the sides 2^e
+  of the leaves of a quadtree or octree, up to the max power in
+  the given orders.
+  """
+  max_order = max([max(order) for order in orders])
+  return centralSums(max_order, [2**e for e in range(T.exponent+1)])
+
+def treeMomentsKernel(T, orders, U=None):
+  """
+  Return the moments (a dictionary with key the order) of the
+  black leaves of a quadtree or octree (also linear), with the
+  kernel for the given orders; U are the tables of treeCentralSums,
+  or None to compute them.
+  """
+  dim = len(orders[0])
+  if U is None: U = treeCentralSums(T, orders)
+  N = getKernel(dim, orders, "tree")(T.black_leaves(), U)
+  return dict([(order, n >> sum(order)) for order, n in zip(orders, N)])
+
+def bruteMoments(black_pixels, orders):
+  """
+  Return the moments computed directly as sums over the pixels.
+  """
+  MM = {key:0 for key in orders}
+  for pixel in black_pixels:
+    for order in orders:
+      m = 1
+      for c,k in zip(pixel, order): m *= c**k
+      MM[order] += m
+  return MM
+
+def checkKernel(black_pixels, MM):
+  """
+  Check the moments MM against the direct sums over the pixels.
+  """
+  ok = True
+  for order, value in bruteMoments(black_pixels, list(MM)).items():
+    if MM[order]!=value:
+      print("ERRORE: moment",order,"is",MM[order],"instead of",value)
+      ok = False
+  if ok: print("TUTTO VA BENE")
+  return ok
+
+#---------------------MAIN-----------------------
+
+from bigmatrix import faulhaber
+from operator import sub
+import sys
+
+def main(arg):
+  try:
+    dim = int(arg[1])
+    assert dim in (2,3)
+    max_order = int(arg[2])
+    image_file = arg[3]
+    use_tree = len(arg)>4 and arg[4]=="tree"
+  except:
+    print(__doc__)
+    return
+  if dim==2:
+    from commons2D import readPixels as readInput
+    from spiliotis2D import extractBlocks
+    from quadtree import buildQuadtree as buildTree
+  else:
+    from commons3D import readCubes as readInput
+    from spiliotis3D import extractBlocks
+    from octree import buildOctree as buildTree
+  black_pixels = list(readInput(image_file))
+  orders = makeOrders(dim, max_order)
+  if use_tree:
+    MM = treeMomentsKernel(buildTree(black_pixels), orders)
+    kind = "tree"
+  else:
+    MM = blockMomentsKernel(extractBlocks(black_pixels), orders)
+    kind = "block"
+  for order in orders: print("Moment ", *order, " = ", MM[order])
+  checkKernel(black_pixels, MM)
+  print(SOURCES[(dim, tuple(orders), kind)])
+
+if __name__ == "__main__":
+  main(sys.argv)
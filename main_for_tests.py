@@ -2,17 +2,37 @@
 
 # ------- GLOBAL VARIABLES
 
-#OPT =  optimization level: 0,1,2
+#OPT =  optimization level: 0,1,2,3,4
+#AUTO = True if the optimization level is chosen by autotune.py
 #DIM =  input image dimension: 2,3
 #UNA = True execute on each image with separated precomputation
 #UNA = False execute on many images with one precomputation
 
+# names of the methods, for the argument --methods
+METHODS = ["tree_old", "tree_new", "tree_exact", "tree_levels", "tree_vec",
+           "runs", "scan",
+           "block_old", "block_new", "block_grouped", "block_exact", "block_vec"]
+# methods executed by default, as in the original experiments
+DEFAULT_METHODS = ["tree_old", "tree_new", "block_old", "block_new"]
+# methods to be executed
+SELECTED = DEFAULT_METHODS
+
 # ------ AUX FUNCTIONS
 
-def ripeti(funzione, argom, times = 1):
-    for t in range(times):
-        risultato = funzione(argom)
-    return risultato  
+def ripeti(funzione, argom, times = 1, stage = "moments"):
+    # with --stats, time and memory of the stage are recorded (see instrument.py)
+    return measure(stage, funzione, argom, times)
+
+def decomponi(funzione, input_pixels, times = 1):
+    # the number of elements is recorded with the next stages (see scaling.py)
+    CONTEXT.pop("elements", None)
+    elements = ripeti(funzione, input_pixels, times, "decompose")
+    CONTEXT["elements"] = elements.num_elem()
+    return elements
+
+def selected(name):
+    # a decomposition ("tree", "block") is needed if any of its methods is selected
+    return any([m==name or m.startswith(name+"_") for m in SELECTED])
         
 def main_one_image(image_file, times_to_repeat=1, always=False):
    """
@@ -21,116 +41,221 @@ def main_one_image(image_file, times_to_repeat=1, always=False):
      must be repeated (to take average of times)
    always = if true, block_mom_new is computed in any case.
      if false only if the decomposition has many blocks
+   Only the methods selected with --methods are executed.
    """
    print("---Read pixels from file "+ image_file)
-   input_pixels = readInput(image_file)
+   for key in ("pixels", "side", "elements"): CONTEXT.pop(key, None)
+   CONTEXT["image"] = image_file
+   input_pixels = ripeti(readInput,image_file,1,"read")
    print("Number of black pixels:", len(input_pixels))
+   max_coords = maxCoordinates(input_pixels, DIM)
    if DIM==2:
-     max_x = max([x for x,y in input_pixels])
-     max_y = max([y for x,y in input_pixels])
+     max_x, max_y = max_coords
    elif DIM==3:
-     max_x = max([x for x,y,z in input_pixels])
-     max_y = max([y for x,y,z in input_pixels])
-     max_z = max([z for x,y,z in input_pixels])
+     max_x, max_y, max_z = max_coords
+   CONTEXT["pixels"] = len(input_pixels)
+   CONTEXT["side"] = max(max_coords)+1
    print("Max x coordinate: ",max_x)
    print("Max y coordinate: ",max_y)
    if DIM==3: print("Max z coordinate: ",max_z)
    print("")
    
-   print("---Tree")
-   elements = ripeti(buildTree,input_pixels,times_to_repeat)
-   print("Number of black leaves:", elements.num_elem())
+   if selected("tree"):
+     print("---Tree")
+     elements = decomponi(buildTree,input_pixels,times_to_repeat)
+     print("Number of black leaves:", elements.num_elem())
    
-   print("---Tree moments (old)")
-   ripeti(tree_mom_old,elements,times_to_repeat)
+   if selected("tree_old"):
+     print("---Tree moments (old)")
+     ripeti(tree_mom_old,elements,times_to_repeat)
    
-   print("---Tree moments (new)")
-   ripeti(tree_pre_new,elements,times_to_repeat)
-   ripeti(tree_mom_new,elements,times_to_repeat)
-   print("")
+   if selected("tree_new"):
+     print("---Tree moments (new)")
+     ripeti(tree_pre_new,elements,times_to_repeat,"preprocess")
+     ripeti(tree_mom_new,elements,times_to_repeat)
+
+   if selected("tree_exact"):
+     print("---Tree moments (new, exact)")
+     ripeti(tree_mom_exact,elements,times_to_repeat)
+
+   if selected("tree_levels"):
+     print("---Tree moments (new, by level)")
+     ripeti(tree_mom_levels,elements,times_to_repeat)
+
+   if selected("tree_vec"):
+     print("---Tree moments (new, vectorized)")
+     ripeti(tree_mom_vec,elements,times_to_repeat)
+   if selected("tree"): print("")
+
+   if selected("runs"):
+     print("---Runs")
+     elements = decomponi(extractRuns,input_pixels,times_to_repeat)
+     print("Number of runs:", elements.num_elem())
+
+     print("---Run moments")
+     ripeti(run_pre,elements,times_to_repeat,"preprocess")
+     ripeti(run_mom,elements,times_to_repeat)
+
+   if selected("scan"):
+     print("---Run moments (fused scan)")
+     elements = decomponi(scanImage,input_pixels,times_to_repeat)
+     ripeti(run_pre,elements,times_to_repeat,"preprocess")
+     ripeti(scan_mom,elements,times_to_repeat)
+   if selected("runs") or selected("scan"): print("")
    
-   print("---Block decomposition")
-   elements = ripeti(extractBlocks,input_pixels,times_to_repeat)
-   block_num = elements.num_elem()
-   print("Number of blocks:", block_num)
-   if DIM==2: print("Max sides:", elements.max_pair()) 
-   elif DIM==3: print("Max sides:", elements.max_triplet())
+   if selected("block"):
+     print("---Block decomposition")
+     elements = decomponi(extractBlocks,input_pixels,times_to_repeat)
+     block_num = elements.num_elem()
+     print("Number of blocks:", block_num)
+     if DIM==2: print("Max sides:", elements.max_pair()) 
+     elif DIM==3: print("Max sides:", elements.max_triplet())
    
-   print("---Block moments (old)")
-   ripeti(block_pre_old,elements,times_to_repeat)
-   ripeti(block_mom_old,elements,times_to_repeat)
-
-   print("---Block moments (new)")
-   setOptimizationLevel(OPT)
-   print("Optimization level: ",OPT);
-   if (always or (block_num>max_x)):
-     ripeti(block_pre_new,elements,times_to_repeat)
-     ripeti(block_mom_new,elements,times_to_repeat)
-     stampaGestione()
-   else:
-     print("Not computed")
+   if selected("block_old"):
+     print("---Block moments (old)")
+     ripeti(block_pre_old,elements,times_to_repeat,"preprocess")
+     ripeti(block_mom_old,elements,times_to_repeat)
+
+   if selected("block_new"):
+     print("---Block moments (new)")
+     if AUTO:
+       # plan stored for the directory of the image, or chosen now
+       plan = tunedPlan(elements, "%s %dD" % (os.path.dirname(image_file) or ".", DIM))
+       applyPlan(plan, DIM)
+       print("Optimization level: ",plan["level"],"(autotuned)");
+     else:
+       setOptimizationLevel(OPT)
+       print("Optimization level: ",OPT);
+     if (always or (block_num>max_x)):
+       ripeti(block_pre_new,elements,times_to_repeat,"preprocess")
+       ripeti(block_mom_new,elements,times_to_repeat)
+       stampaGestione()
+     else:
+       print("Not computed")
+
+   if selected("block_grouped"):
+     print("---Block moments (new, grouped by shape)")
+     ripeti(block_mom_grouped,elements,times_to_repeat)
+
+   if selected("block_exact"):
+     print("---Block moments (new, exact)")
+     ripeti(block_mom_exact,elements,times_to_repeat)
+
+   if selected("block_vec"):
+     print("---Block moments (new, vectorized)")
+     ripeti(block_mom_vec,elements,times_to_repeat)
    print()
    
 def main_many_images(image_list, max_side, times_to_repeat=1, always=False):
-   print("---Block preprocessing (new)")
-   setOptimizationLevel(OPT)
-   print("Optimization level: ",OPT);
-   print("Only once with max_side ",max_side)
-   ripeti(block_pre_once,max_side,times_to_repeat)
+   if selected("block_new"):
+     print("---Block preprocessing (new)")
+     setOptimizationLevel(OPT)
+     print("Optimization level: ",OPT);
+     if OPT==4: print("Only once, cache shared by all images")
+     else: print("Only once with max_side ",max_side)
+     ripeti(block_pre_once,max_side,times_to_repeat,"preprocess")
    
    for image_file in image_list:
      print("---Read pixels from file "+ image_file)
-     input_pixels = readInput(image_file)
+     for key in ("pixels", "side", "elements"): CONTEXT.pop(key, None)
+     CONTEXT["image"] = image_file
+     input_pixels = ripeti(readInput,image_file,1,"read")
      print("Number of black pixels:", len(input_pixels))
-     max_x = max([c[0] for c in input_pixels])
-     max_y = max([c[1] for c in input_pixels])
-     assert max_x<=max_side and max_y<=max_side
+     max_coords = maxCoordinates(input_pixels, DIM)
+     CONTEXT["pixels"] = len(input_pixels)
+     CONTEXT["side"] = max(max_coords)+1
+     max_x, max_y = max_coords[0], max_coords[1]
+     assert OPT==4 or (max_x<=max_side and max_y<=max_side)
      print("Max x coordinate: ",max_x)
      print("Max y coordinate: ",max_y)
      if DIM==3:
-       max_z = max([z for x,y,z in input_pixels])
-       assert max_z<=max_side
+       max_z = max_coords[2]
+       assert OPT==4 or max_z<=max_side
        print("Max z coordinate: ",max_z)
      print("")
      
-     print("---Tree")
-     elements = ripeti(buildTree,input_pixels,times_to_repeat)
-     print("Number of black leaves:", elements.num_elem())
+     if selected("tree"):
+       print("---Tree")
+       elements = decomponi(buildTree,input_pixels,times_to_repeat)
+       print("Number of black leaves:", elements.num_elem())
 
-     print("---Tree moments (old)")
-     ripeti(tree_mom_old,elements,times_to_repeat)
+     if selected("tree_old"):
+       print("---Tree moments (old)")
+       ripeti(tree_mom_old,elements,times_to_repeat)
 
-     print("---Tree moments (new)")
-     ripeti(tree_pre_new,elements,times_to_repeat)
-     ripeti(tree_mom_new,elements,times_to_repeat)
-     print("")
+     if selected("tree_new"):
+       print("---Tree moments (new)")
+       ripeti(tree_pre_new,elements,times_to_repeat,"preprocess")
+       ripeti(tree_mom_new,elements,times_to_repeat)
 
-     print("---Block decomposition")
-     elements = ripeti(extractBlocks,input_pixels,times_to_repeat)
-     block_num = elements.num_elem()
-     print("Number of blocks:", block_num)
-     if DIM==2:
-       print("Max sides:", elements.max_pair()) 
-     else: #DIM==3
-       print("Max sides:", elements.max_triplet())
+     if selected("tree_exact"):
+       print("---Tree moments (new, exact)")
+       ripeti(tree_mom_exact,elements,times_to_repeat)
+
+     if selected("tree_levels"):
+       print("---Tree moments (new, by level)")
+       ripeti(tree_mom_levels,elements,times_to_repeat)
+
+     if selected("tree_vec"):
+       print("---Tree moments (new, vectorized)")
+       ripeti(tree_mom_vec,elements,times_to_repeat)
+     if selected("tree"): print("")
+
+     if selected("runs"):
+       print("---Runs")
+       elements = decomponi(extractRuns,input_pixels,times_to_repeat)
+       print("Number of runs:", elements.num_elem())
+
+       print("---Run moments")
+       ripeti(run_pre,elements,times_to_repeat,"preprocess")
+       ripeti(run_mom,elements,times_to_repeat)
+
+     if selected("scan"):
+       print("---Run moments (fused scan)")
+       elements = decomponi(scanImage,input_pixels,times_to_repeat)
+       ripeti(run_pre,elements,times_to_repeat,"preprocess")
+       ripeti(scan_mom,elements,times_to_repeat)
+     if selected("runs") or selected("scan"): print("")
+
+     if selected("block"):
+       print("---Block decomposition")
+       elements = decomponi(extractBlocks,input_pixels,times_to_repeat)
+       block_num = elements.num_elem()
+       print("Number of blocks:", block_num)
+       if DIM==2:
+         print("Max sides:", elements.max_pair()) 
+       else: #DIM==3
+         print("Max sides:", elements.max_triplet())
      
-     print("---Block moments (old)")
-     ripeti(block_pre_old,elements,times_to_repeat)
-     ripeti(block_mom_old,elements,times_to_repeat)
+     if selected("block_old"):
+       print("---Block moments (old)")
+       ripeti(block_pre_old,elements,times_to_repeat,"preprocess")
+       ripeti(block_mom_old,elements,times_to_repeat)
 
-     print("---Block moments (new)")
-     if (always or (block_num>max_x)):
-       #No: done ripeti(block_pre_new,times_to_repeat)
-       ripeti(block_mom_new,elements,times_to_repeat)
-       stampaGestione()
-     else:
-       print("Not computed");
+     if selected("block_new"):
+       print("---Block moments (new)")
+       if (always or (block_num>max_x)):
+         #No: done ripeti(block_pre_new,times_to_repeat)
+         ripeti(block_mom_new,elements,times_to_repeat)
+         stampaGestione()
+       else:
+         print("Not computed");
+
+     if selected("block_grouped"):
+       print("---Block moments (new, grouped by shape)")
+       ripeti(block_mom_grouped,elements,times_to_repeat)
+
+     if selected("block_exact"):
+       print("---Block moments (new, exact)")
+       ripeti(block_mom_exact,elements,times_to_repeat)
+
+     if selected("block_vec"):
+       print("---Block moments (new, vectorized)")
+       ripeti(block_mom_vec,elements,times_to_repeat)
   
 
 def readImageList(file_name):
-  f = open(file_name,"r")
-  L = f.read().split()
-  f.close()
+  L = readList(file_name)
   print("Immagini:")
   for name in L: print("  "+name)
   print("")
@@ -142,16 +267,34 @@ def readImageList(file_name):
 """
 Arguments on command line are:
 - image dimension: 2 or 3
-- optimization level: 0, 1, 2
-- only for optimization level==2: "once" if one
+- optimization level: 0, 1, 2, 3, 4, or "auto" to choose it
+   with autotune.py (not with "once")
+- only for optimization level>=2: "once" if one
    preprocessing stage for many images
-- input image file name
+- input image file name (text or binary format, see coordfile.py)
 - number of repetitions (opzional, default = 1) 
+- "--stats" or "--stats=FILE" in any position (optional) to
+   record time and memory of each stage as JSON lines
+   (see instrument.py)
+- "--methods=M1,M2,..." in any position (optional) to execute
+   the given methods (see METHODS) instead of DEFAULT_METHODS,
+   e.g. --methods=tree_new,block_exact, or --methods=all
 """
 
 import sys        
+import os
+from coordfile import maxCoordinates, readList
+from autotune import tunedPlan, applyPlan
+import instrument
+from instrument import measure, CONTEXT
 if __name__=="__main__":
   #print(sys.argv)
+  sys.argv = instrument.statsOption(sys.argv)
+  for a in sys.argv:
+    if a.startswith("--methods="):
+      SELECTED = a[10:].split(",")
+      if SELECTED==["all"]: SELECTED = METHODS
+  sys.argv = [a for a in sys.argv if not a.startswith("--methods=")]
   global DIM, OPT, UNA
   ind = 3
   times_to_repeat = 1
@@ -159,18 +302,25 @@ if __name__=="__main__":
   image = None
   UNA = True
   try:
+    for m in SELECTED:
+      if m not in METHODS:
+        print("Unknown method",m,"not in",METHODS)
+        raise ValueError
     DIM = int(sys.argv[1])
     assert DIM in (2,3)
     print("DIM =",DIM)
-    OPT = int(sys.argv[2])
-    assert OPT in (0,1,2)
-    print("OPT =",OPT)
-    if OPT==2 and sys.argv[3]=='once': UNA = False; ind = 4
+    AUTO = sys.argv[2]=="auto"
+    if AUTO: OPT = 0
+    else: OPT = int(sys.argv[2])
+    assert OPT in (0,1,2,3,4)
+    if AUTO: print("OPT = auto")
+    else: print("OPT =",OPT)
+    if OPT>=2 and sys.argv[3]=='once': UNA = False; ind = 4
     if not UNA: print("One preprocessing for many images")
     image = sys.argv[ind]
     print("Image =",image)
     ind += 1
-    if not UNA:
+    if not UNA and OPT!=4:
       max_side = int(sys.argv[ind])
       assert max_side > 2
       print("Max image side =",max_side)
@@ -186,14 +336,18 @@ if __name__=="__main__":
   except:
     print("Error in arguments:")
     print("First argument must be image dimension (2 or 3)")
-    print("Second argument must be optimization level (0, 1 or 2)")
-    print("If optimization=2, third argument may be 'once' (optional)")
+    print("Second argument must be optimization level (0, 1, 2, 3 or 4) or 'auto'")
+    print("If optimization>=2, third argument may be 'once' (optional)")
     print("Next argument must be input file")
     print("  Input file is one image,")
     print("  or a file containing a list of image names if third argument='once'")
     print("If third argument='once', next argument must be max side length")
+    print("  (not with optimization 4, where the cache grows as needed)")
     print("Last argument may be number of repetitions (optional, default 1)")
-    DIM = None # to skip next code
+    print("Argument --stats or --stats=FILE records time and memory of each stage (optional)")
+    print("Argument --methods=M1,M2,... or --methods=all executes other methods (optional,")
+    print("  default "+",".join(DEFAULT_METHODS)+")")
+    sys.exit(1)
     
   if DIM==2:
     from commons2D import readPixels as readInput
@@ -202,12 +356,19 @@ if __name__=="__main__":
     from momentTree2D import quadtreeMoments as tree_mom_old
     from momentTreeNew2D import preprocessing as tree_pre_new
     from momentTreeNew2D import quadtreeMoments as tree_mom_new
+    from momentTreeNew2D import quadtreeMomentsLevels as tree_mom_levels
+    from momentTreeNew2D import quadtreeMomentsExact as tree_mom_exact
+    from momentTreeNew2D import quadtreeMomentsVec as tree_mom_vec
+    from momentRuns2D import extractRuns, scanImage, BW_RunEngine2D as RunEngine
     from spiliotis2D import extractBlocks
     from momentBlock2D import preprocessing as block_pre_old
     from momentBlock2D import blockMoments as block_mom_old
     from momentBlockNew2D import preprocessing as block_pre_new
     from momentBlockNew2D import preprocessing_once as block_pre_once
     from momentBlockNew2D import blockMoments as block_mom_new
+    from momentBlockNew2D import blockMomentsGrouped as block_mom_grouped
+    from momentBlockNew2D import blockMomentsExact as block_mom_exact
+    from momentBlockNew2D import blockMomentsVec as block_mom_vec
     from momentBlockNew2D import setOptimizationLevel, stampaGestione
   elif DIM==3:
     from commons3D import readCubes as readInput
@@ -216,14 +377,25 @@ if __name__=="__main__":
     from momentTree3D import octreeMoments as tree_mom_old
     from momentTreeNew3D import preprocessing as tree_pre_new
     from momentTreeNew3D import octreeMoments as tree_mom_new
+    from momentTreeNew3D import octreeMomentsLevels as tree_mom_levels
+    from momentTreeNew3D import octreeMomentsExact as tree_mom_exact
+    from momentTreeNew3D import octreeMomentsVec as tree_mom_vec
+    from momentRuns3D import extractRuns, scanImage, BW_RunEngine3D as RunEngine
     from spiliotis3D import extractBlocks
     from momentBlock3D import preprocessing as block_pre_old
     from momentBlock3D import blockMoments as block_mom_old
     from momentBlockNew3D import preprocessing as block_pre_new
     from momentBlockNew3D import preprocessing_once as block_pre_once
     from momentBlockNew3D import blockMoments as block_mom_new
+    from momentBlockNew3D import blockMomentsGrouped as block_mom_grouped
+    from momentBlockNew3D import blockMomentsExact as block_mom_exact
+    from momentBlockNew3D import blockMomentsVec as block_mom_vec
     from momentBlockNew3D import setOptimizationLevel, stampaGestione
+  if DIM in (2,3):
+    run_engine = RunEngine()
+    run_pre, run_mom, scan_mom = run_engine.preprocessing, run_engine.runMoments, run_engine.scanMoments
   print("DIM=",DIM,"OPT=",OPT,"UNA=",UNA,"image=",image,"times_to_repeat=",times_to_repeat)
+  CONTEXT.update({"dim":DIM, "opt":"auto" if AUTO else OPT})
   if DIM in (2,3):
     if UNA: 
        main_one_image(image, times_to_repeat, always=True)
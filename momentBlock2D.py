@@ -6,41 +6,45 @@ decomposition by Spiliotis and Mertzios.
 #---------------------MOMENTS-----------------------
 
 from bigmatrix import PowerMatrix
-from commons2D import orders
+from commons2D import orders, wantedOrders
+from powersums import maxPowers
 
 #Matrix storing precomputed sums of powers
 powers = None
 
-def preprocessing(ibr):
+def preprocessing(ibr, wanted=None):
   #assert isinstance(ibr,BW_BlockImage2D)
   global powers
-  powers = PowerMatrix( 3, ibr.origsize )
+  # sums of powers only up to the max power of the wanted orders
+  powers = PowerMatrix( max(maxPowers(wantedOrders(wanted))), ibr.origsize )
 
-def blockMoments(ibr):
+def blockMoments(ibr, wanted=None):
   """
   Compute all moments m_{p,q} for p,q>=0 and p+q<=3
-  of a 2D image given as a set of blocks
+  of a 2D image given as a set of blocks,
+  or only the wanted ones (see wantedOrders in commons2D.py)
   """
   # orders is the global variable imported from commons2D
-  MM = {key:0 for key in orders}
+  wanted = wantedOrders(wanted)
+  MM = {key:0 for key in wanted}
 
-  for p,q in orders:
+  for p,q in wanted:
         #print("calcolo momenti ordine ",p,q)
         # value of moment
         MM[(p,q)] = 0 
         #print("  num blocchi",len(ibr.block))
-        for b in ibr.block: # cycle on blocks
+        for x0,y0,x1,y1 in zip(*ibr.columns()): # cycle on blocks
             #print("Momento ord ",(p,q), " di ",b, " di ",b.pixel_num(), " pixel")
-            if p==0: mx = b.x1-b.x0+1
+            if p==0: mx = x1-x0+1
             else:
-              mx = powers.valueSum(p, b.x1)
-              if b.x0>0:
-                 mx -= powers.valueSum(p, b.x0-1)
-            if q==0: my = b.y1-b.y0+1
+              mx = powers.valueSum(p, x1)
+              if x0>0:
+                 mx -= powers.valueSum(p, x0-1)
+            if q==0: my = y1-y0+1
             else:
-              my = powers.valueSum(q, b.y1)
-              if b.y0>0:
-                 my -= powers.valueSum(q, b.y0-1)
+              my = powers.valueSum(q, y1)
+              if y0>0:
+                 my -= powers.valueSum(q, y0-1)
             #print("Momento ord ",(p,q), " Blocco ",b," contrib= ",(mx,my), mx*my)
                 
             if (mx or my):
@@ -6,60 +6,64 @@ decomposition by Spiliotis and Mertzios.
 #---------------------MOMENTS-----------------------
 
 from bigmatrix import PowerMatrix
-from commons3D import orders
+from commons3D import orders, wantedOrders
+from powersums import maxPowers
 
 #Matrix storing precomputed sums of powers
 powers = None
 
-def preprocessing(ibr):
+def preprocessing(ibr, wanted=None):
   #assert isinstance(ibr,BW_BlockImage2D)
   global powers
-  powers = PowerMatrix( 3, ibr.origsize )
+  # sums of powers only up to the max power of the wanted orders
+  powers = PowerMatrix( max(maxPowers(wantedOrders(wanted))), ibr.origsize )
 
-def blockMoments(ibr):
+def blockMoments(ibr, wanted=None):
   """
   Compute all moments m_{p,q,r} for p,q,r>=0 and p+q+r<=3
-  of a 3D image given as a set of blocks
+  of a 3D image given as a set of blocks,
+  or only the wanted ones (see wantedOrders in commons3D.py)
   """
 
   # orders is the global variable imported from commons3D
-  MM = {key:0 for key in orders}
+  wanted = wantedOrders(wanted)
+  MM = {key:0 for key in wanted}
   
-  for p,q,r in orders:
+  for p,q,r in wanted:
         #print("calcolo momenti ordine ",p,q,r)
         # value of moment
         MM[(p,q,r)] = 0 
         #print("  num blocchi",len(ibr.block))
         #print()
-        for b in ibr.block: # cycle on blocks
+        for x0,y0,z0,x1,y1,z1 in zip(*ibr.columns()): # cycle on blocks
             #print("Momento ord ",(p,q,r), " di ",b, " di ",b.pixel_num(), " pixel")
-            if p==0: mx = b.x1-b.x0+1
+            if p==0: mx = x1-x0+1
             else:
-              mx = powers.valueSum(p, b.x1)
-              if b.x0>0:
-                 mx -= powers.valueSum(p, b.x0-1)
-            if q==0: my = b.y1-b.y0+1
+              mx = powers.valueSum(p, x1)
+              if x0>0:
+                 mx -= powers.valueSum(p, x0-1)
+            if q==0: my = y1-y0+1
             else:
-              my = powers.valueSum(q, b.y1)
-              if b.y0>0:
-                 my -= powers.valueSum(q, b.y0-1)
-            if r==0: mz = b.z1-b.z0+1
+              my = powers.valueSum(q, y1)
+              if y0>0:
+                 my -= powers.valueSum(q, y0-1)
+            if r==0: mz = z1-z0+1
             else:
-              mz = powers.valueSum(r, b.z1)
-              if b.z0>0:
-                 mz -= powers.valueSum(r, b.z0-1)
+              mz = powers.valueSum(r, z1)
+              if z0>0:
+                 mz -= powers.valueSum(r, z0-1)
             #print("   Blocco ",b," ha contributi=",(mx,my,mz), mx*my*mz)
             """
             if (p,q,r)==(0,0,0) and mx*my*mz != b.pixel_num():
-                print(" Su x: dovrei avere ",b.x1-b.x0+1," e ho ",mx)
-                if b.x0>1: print("   = ",powers.valueSum(p, b.x1)," - ",powers.valueSum(p, b.x0-1))
-                else: print("   = ",powers.valueSum(p, b.x1))
-                print(" Su y: dovrei avere ",b.y1-b.y0+1," e ho ",my)
-                if b.y0>1: print("   = ",powers.valueSum(q, b.y1)," - ",powers.valueSum(q, b.y0-1))
-                else: print("   = ",powers.valueSum(q, b.y1))
-                print(" Su z: dovrei avere ",b.z1-b.z0+1," e ho ",mz)
-                if b.z0>1: print("   = ",powers.valueSum(r, b.z1)," - ",powers.valueSum(r, b.z0-1))
-                else: print("   = ",powers.valueSum(r, b.z1))
+                print(" Su x: dovrei avere ",x1-x0+1," e ho ",mx)
+                if x0>1: print("   = ",powers.valueSum(p, x1)," - ",powers.valueSum(p, x0-1))
+                else: print("   = ",powers.valueSum(p, x1))
+                print(" Su y: dovrei avere ",y1-y0+1," e ho ",my)
+                if y0>1: print("   = ",powers.valueSum(q, y1)," - ",powers.valueSum(q, y0-1))
+                else: print("   = ",powers.valueSum(q, y1))
+                print(" Su z: dovrei avere ",z1-z0+1," e ho ",mz)
+                if z0>1: print("   = ",powers.valueSum(r, z1)," - ",powers.valueSum(r, z0-1))
+                else: print("   = ",powers.valueSum(r, z1))
             """    
             if (mx or my or mz):
                  MM[(p,q,r)] += (mx*my*mz)
@@ -1,269 +1,590 @@
-"""
-Computation of moments of a 2D image on the block 
-decomposition by Spiliotis and Mertzios,
-with the new idea that precomputes central moments.
-
-Optimization level 0:
-Compute all central moments of rectangles with
-dimX = 1...max width of a block
-dimY = 1...max height of a block
-and dimX>=dimY
-
-Optimization level 1:
-Compute all central moments of rectangles with
-dimX = 1...max width of a block
-dimY = 1...max height of a block
-(given that max width>=max height, otherwise swap)
-
-Optimization level 2:
-Compute all central moments of rectangles with
-dimX = 1...max width of a block
-dimY = 1...min{8,max height of a block}
-and the moments of larger blocks will be computed in
-the traditional way
-(this requires computing the bigmatrix as well).
- 
-Optimization for a set of images:
-Compute all central moments of rectangles with
-dimX = 1...given value
-dimY = 1...8
-and do it only once for many images;
-the  the moments of larger blocks will be computed in
-the traditional way
-(this requires computing the bigmatrix as well).
-"""
-
-#---------------------MOMENTS-----------------------
-
-from commons2D import orders
-
-from bigmatrix import PowerMatrix         #APRILE
-#Matrix storing precomputed sums of powers#APRILE
-powers = None                             #APRILE
-
-OPT_LEVEL = 2
-LIMIT = 8
-
-def setOptimizationLevel(level):
-  assert level in [0,1,2]
-  global OPT_LEVEL
-  OPT_LEVEL = level
+"""
+Computation of moments of a 2D image on the block 
+decomposition by Spiliotis and Mertzios,
+with the new idea that precomputes central moments.
+
+Optimization level 0:
+Compute all central moments of rectangles with
+dimX = 1...max width of a block
+dimY = 1...max height of a block
+and dimX>=dimY
+
+Optimization level 1:
+Compute all central moments of rectangles with
+dimX = 1...max width of a block
+dimY = 1...max height of a block
+(given that max width>=max height, otherwise swap)
+
+Optimization level 2:
+Compute all central moments of rectangles with
+dimX = 1...max width of a block
+dimY = 1...min{8,max height of a block}
+and the moments of larger blocks will be computed in
+the traditional way
+(this requires computing the bigmatrix as well).
+
+Optimization level 3 (separable):
+The central moments of a rectangle DX x DY are
+mu_00 = DX*DY, mu_20 = DY*c2(DX), mu_02 = DX*c2(DY)
+where c2(D) = (D^3-D)/12 is the central moment of order 2 of
+a segment of D pixels. Only C(D) = 4*c2(D) is computed, for
+D = 1...max side of a block, and all blocks are computed
+in the same way, with no limit on their size.
+
+Optimization level 4 (lazy):
+The central moments of a block are computed from the same
+closed formulas of level 3 the first time its shape DX x DY
+is found, and kept in a cache of bounded size with LRU eviction
+(see shapecache.py), so only the shapes actually used are
+computed. The cache is kept across images, so many images
+can be processed with no max side given in advance.
+ 
+Grouping by shape (blockMomentsGrouped):
+Blocks with the same sides DX x DY are grouped, and for each
+group only sums of powers of the barycenters are computed,
+the central moments are applied once per group (see powersums.py).
+This needs no preprocessing.
+
+Exact integer arithmetic (blockMomentsExact):
+The barycenters are doubled (X = x0+x1) so that all terms
+are integers, and the moments are scaled back by powers of two
+only once at the end; the result is exact for any image size.
+This needs no preprocessing.
+
+Vectorized (blockMomentsVec):
+The same computation of blockMomentsExact with NumPy, on 64 bit
+integers when they cannot overflow (see momentVec.py).
+This needs no preprocessing.
+
+Wanted orders (blockMoments with the argument wanted):
+Only the wanted moments are computed, with integers only as in
+blockMomentsExact, along the columns of the blocks: the sums of
+powers of each axis are computed only up to the max power of the
+axis in the wanted orders (e.g. m30 needs T_3, T_2, T_1 along x),
+so preprocessing builds only the table of C(D) = (D^3-D)/3, and
+only if some wanted order has a power 2 or 3.
+The optimization level is not used.
+
+All levels compute the moments with integers only, with
+doubled barycenters as blockMomentsExact (see below): the
+central moments of order 2 are taken times 4, and the sums
+are scaled back only once at the end.
+
+Optimization for a set of images:
+Compute all central moments of rectangles with
+dimX = 1...given value
+dimY = 1...8
+and do it only once for many images;
+the  the moments of larger blocks will be computed in
+the traditional way
+(this requires computing the bigmatrix as well).
+
+Engines:
+The state of the method (level, limits, tables) is kept in an
+object of class BW_BlockEngine2D; the functions setOptimizationLevel,
+setLimits, preprocessing, preprocessing_once, blockMoments and
+stampaGestione of the module work on its engine ENGINE.
+"""
+
+#---------------------MOMENTS-----------------------
+
+from commons2D import orders, wantedOrders
+
+from bigmatrix import PowerMatrix         #APRILE
+import threading
+
+# default optimization level and limit of level 2 of a new engine
+DEFAULT_LEVEL = 2
+DEFAULT_LIMIT = 8
 
 def setCentralMoments(max_side):
-  """
-  The argument can be a single integer or a pair of integers,
-  which are the max length of a block (rectangle) in the two
+  """
+  The argument can be a single integer or a pair of integers,
+  which are the max length of a block (rectangle) in the two
   Cartesian directions of the plane.
   Compute and store all central moments of rectangles of size DX x DY
-  with DX,DY in [1,max_side], DX>=DY.
+  with DX,DY in [1,max_side], DX>=DY.
   - for DX==DY==1 the only non-zero moment is mu_00 
   - otherwise the only non-zero moments are mu_00 and mu_20, mu_02
-  """
-  #print("Set central moments",max_side)
-  # manage argument
-  if type(max_side) is int:
-    MoreMax,LessMax = max_side, max_side
-  else:
-    MoreMax,LessMax = max_side # already sorted, decreasing
-  
+  """
+  #print("Set central moments",max_side)
+  # manage argument
+  if type(max_side) is int:
+    MoreMax,LessMax = max_side, max_side
+  else:
+    MoreMax,LessMax = max_side # already sorted, decreasing
+  
   #print("***********LATI: ******",MoreMax,LessMax,"**************")  
   CentrMom00 = dict()
-  CentrMom20 = dict()
+  CentrMom20 = dict()
   CentrMom02 = dict()
   # DX==DY==1: only mu_00=1
-  CentrMom00[(1,1)] = 1
-  CentrMom20[(1,1)] = 0
-  CentrMom02[(1,1)] = 0
-  
-  # Compute auxiliary values: 
-  # sum_half = 0.5^2 + 1.5^2 + 2.5^2 + ...
-  # sum_full = 1^2   + 2^2   + 3^2   + ...
-  sum_half=[0,0.25]
-  sum_full=[0]
-  for f in range(2,MoreMax+1):
-    sum_half.append(sum_half[f-1]+((f-0.5)**2))
-  for f in range(1,MoreMax+1):
-    sum_full.append(sum_full[f-1]+(f**2))
-  
-  #print("Somme mezze", sum_half)
-  #print("Somme intere", sum_full)
-    
-  # DY==1 and DX>1
-  #print("x in [1,",MoreMax,"] e y=1")
-  for edgeX in range(1,MoreMax+1):
-     #print("APRILE (a) key ",(edgeX,1))
-     CentrMom00[(edgeX,1)] = edgeX
-     CentrMom02[(edgeX,1)] = 0
-     if edgeX%2==0:
-       CentrMom20[(edgeX,1)] = 2*sum_half[edgeX//2]
-     else:
-       CentrMom20[(edgeX,1)] = 2*sum_full[edgeX//2]
-
-  # DY>1 and DX>=DY
-  #print("y in [2,",LessMax,"] e x in [y,",MoreMax,"]")
-  for edgeY in range(2,LessMax+1):
-      for edgeX in range(edgeY,MoreMax+1):
-         #print("APRILE (b) key",(edgeX,edgeY))
-         CentrMom00[(edgeX,edgeY)] = edgeX*edgeY
-         if edgeX%2==0: sum_x = sum_half
-         else: sum_x = sum_full
-         if edgeY%2==0: sum_y = sum_half
-         else: sum_y  = sum_full
-         CentrMom20[(edgeX,edgeY)] = 2*edgeY*sum_x[edgeX//2]
-         CentrMom02[(edgeX,edgeY)] = 2*edgeX*sum_y[edgeY//2]
-         # check
-         """
-         M20, M02 = 0, 0
-         baric = ((edgeX-1)/2, (edgeY-1)/2)
-         for i in range(edgeX):
-           for j in range(edgeY):
-             xi = i-baric[0]
-             yj = j-baric[1]
-             M20 += (xi*xi)
-             M02 += (yj*yj)
-
-         if CentrMom20[(edgeX,edgeY)] != M20:
-           print("ERRORE!!!!!!!!!!! ",edgeX,edgeY,": mom_2,0 ",CentrMom20[(edgeX,edgeY)], " diverso dal vero ",M20)
-           print("  20: ",2,"*",edgeY,"* sommax[",(edgeX//2),"] che vale ", sum_x[edgeX//2])
-
-         if CentrMom02[(edgeX,edgeY)] != M02:
-           print("ERRORE!!!!!!!!!!! ",edgeX,edgeY,": mom_0,2 ",CentrMom02[(edgeX,edgeY)], " diverso dal vero ",M02)
-           print("  02: ",2,"*",edgeX,"* sommay[",(edgeY//2),"] che vale ", sum_y[edgeY//2]) 
-           #print("  ", 2*edgeX*sum_y[edgeY//2])
-         """
+  CentrMom00[(1,1)] = 1
+  CentrMom20[(1,1)] = 0
+  CentrMom02[(1,1)] = 0
+  
+  # Compute auxiliary values: 
+  # sum_half = 0.5^2 + 1.5^2 + 2.5^2 + ...
+  # sum_full = 1^2   + 2^2   + 3^2   + ...
+  sum_half=[0,0.25]
+  sum_full=[0]
+  for f in range(2,MoreMax+1):
+    sum_half.append(sum_half[f-1]+((f-0.5)**2))
+  for f in range(1,MoreMax+1):
+    sum_full.append(sum_full[f-1]+(f**2))
+  
+  #print("Somme mezze", sum_half)
+  #print("Somme intere", sum_full)
+    
+  # DY==1 and DX>1
+  #print("x in [1,",MoreMax,"] e y=1")
+  for edgeX in range(1,MoreMax+1):
+     #print("APRILE (a) key ",(edgeX,1))
+     CentrMom00[(edgeX,1)] = edgeX
+     CentrMom02[(edgeX,1)] = 0
+     if edgeX%2==0:
+       CentrMom20[(edgeX,1)] = 2*sum_half[edgeX//2]
+     else:
+       CentrMom20[(edgeX,1)] = 2*sum_full[edgeX//2]
+
+  # DY>1 and DX>=DY
+  #print("y in [2,",LessMax,"] e x in [y,",MoreMax,"]")
+  for edgeY in range(2,LessMax+1):
+      for edgeX in range(edgeY,MoreMax+1):
+         #print("APRILE (b) key",(edgeX,edgeY))
+         CentrMom00[(edgeX,edgeY)] = edgeX*edgeY
+         if edgeX%2==0: sum_x = sum_half
+         else: sum_x = sum_full
+         if edgeY%2==0: sum_y = sum_half
+         else: sum_y  = sum_full
+         CentrMom20[(edgeX,edgeY)] = 2*edgeY*sum_x[edgeX//2]
+         CentrMom02[(edgeX,edgeY)] = 2*edgeX*sum_y[edgeY//2]
+         # check
+         """
+         M20, M02 = 0, 0
+         baric = ((edgeX-1)/2, (edgeY-1)/2)
+         for i in range(edgeX):
+           for j in range(edgeY):
+             xi = i-baric[0]
+             yj = j-baric[1]
+             M20 += (xi*xi)
+             M02 += (yj*yj)
+
+         if CentrMom20[(edgeX,edgeY)] != M20:
+           print("ERRORE!!!!!!!!!!! ",edgeX,edgeY,": mom_2,0 ",CentrMom20[(edgeX,edgeY)], " diverso dal vero ",M20)
+           print("  20: ",2,"*",edgeY,"* sommax[",(edgeX//2),"] che vale ", sum_x[edgeX//2])
+
+         if CentrMom02[(edgeX,edgeY)] != M02:
+           print("ERRORE!!!!!!!!!!! ",edgeX,edgeY,": mom_0,2 ",CentrMom02[(edgeX,edgeY)], " diverso dal vero ",M02)
+           print("  02: ",2,"*",edgeX,"* sommay[",(edgeY//2),"] che vale ", sum_y[edgeY//2]) 
+           #print("  ", 2*edgeX*sum_y[edgeY//2])
+         """
   return (CentrMom00, CentrMom20, CentrMom02)
-
-def preprocessing(ibr):
-  #assert isinstance(ibr,BW_BlockImage2D)
-
-  # precompute central moments for new method
-  global CC00, CC20, CC02
-  # precompute matrix for traditional method
-  global powers
-  
-  # manage optimization level
-  if OPT_LEVEL==0:
-    maximum = max(ibr.max_pair())
-    CC00, CC20, CC02 = setCentralMoments(maximum)
-  elif OPT_LEVEL==1:
-    maximum = sorted(ibr.max_pair(),reverse=True)
-    CC00, CC20, CC02 = setCentralMoments(maximum)
-  elif OPT_LEVEL==2:
-    maximum = sorted(ibr.max_pair(),reverse=True)
-    maximum[1] = min(maximum[1],LIMIT)
-    CC00, CC20, CC02 = setCentralMoments(maximum)  
-    powers = PowerMatrix( 3, ibr.origsize )
-  
-
-def preprocessing_once(max_side):
-  # precompute matrix for traditional method
-  global powers
-  powers = PowerMatrix( 3, max_side )
-
-  # precompute central moments for new method
-  global CC00, CC20, CC02
-  if OPT_LEVEL==0:
-    CC00, CC20, CC02 = setCentralMoments(max_side)
-  else: # 1,2
-    CC00, CC20, CC02 = setCentralMoments((max_side,LIMIT))
-
-def blockMoments(ibr):
-  """
-  Compute all moments m_{p,q} for p,q>=0 and p+q<=3
-  of a 2D image given as a set of blocks
-  """
-
-  # orders is the global variable imported from commons3D
-  # initialize moments to be computed
-  MM = {key:0 for key in orders}
-  
-  for p,q in orders:
-        MM[(p,q)] = 0 
-  #print("  num blocchi",len(ibr.block))
-
-  global NUOVO
-  global VECCHIO 
-  NUOVO,VECCHIO = 0,0 #APRILE
-
-  for b in ibr.block: # cycle on blocks
-
-     if OPT_LEVEL>1:
-       dimens = (b.x1-b.x0+1, b.y1-b.y0+1) #APRILE
-       if min(dimens)>LIMIT: #APRILE faccio al modo vecchio
-         #print("VECCHIO MODO",dimens,ordered)
-         for p,q in orders:
-           if p==0: mx = dimens[0]
-           else:
-             mx = powers.valueSum(p, b.x1)
-             if b.x0>0:
-                mx -= powers.valueSum(p, b.x0-1)
-           if q==0: my = dimens[1]
-           else:
-             my = powers.valueSum(q, b.y1)
-             if b.y0>0:
-                my -= powers.valueSum(q, b.y0-1)
-           if (mx or my): MM[(p,q)] += (mx*my)
-         VECCHIO += 1
-         continue
-     #FINE APRILE   
-
-     #print("NUOVO MODO",dimens,ordered)
-     NUOVO += 1
-
-     #print("Momento di ",b, " di ",b.pixel_num(), " pixel")
-     # barycenter
-     xx = 0.5*(b.x1+b.x0)
-     yy = 0.5*(b.y1+b.y0)
-     # retrieve central moments of block
-     if (b.x1-b.x0)>=(b.y1-b.y0):
-        key = (b.x1-b.x0+1, b.y1-b.y0+1)
-        central00 = CC00[key]
-        central20 = CC20[key]
-        central02 = CC02[key]
-     else:
-        key = (b.y1-b.y0+1,b.x1-b.x0+1)
-        central00 = CC00[key]
-        central20 = CC02[key]
-        central02 = CC20[key]
-     #print(' chiave ',key)
-     #print(" mom centr 00 20 02: ",central00,central20,central02)
-     # compute moments from central ones
-     m00 = central00
-     m10 = xx*central00
-     m01 = yy*central00
-     m11 = yy*m10
-     m20 = central20 + xx*m10
-     m02 = central02 + yy*m01
-     m30 = 3*xx*m20 -2*xx*xx*m10
-     m03 = 3*yy*m02 -2*yy*yy*m01
-     m21 = yy*m20
-     m12 = xx*m02
-     #print(" mom blocco 00 20 02: ",m00,m20,m02)
-     # update image moments
-     MM[(0,0)] += m00
-     MM[(1,0)] += int(m10)
-     MM[(0,1)] += int(m01)
-     MM[(1,1)] += int(m11)
-     MM[(2,0)] += int(m20)
-     MM[(0,2)] += int(m02)
-     MM[(3,0)] += int(m30)
-     MM[(0,3)] += int(m03)
-     MM[(2,1)] += int(m21)
-     MM[(1,2)] += int(m12)
-      
-  return MM
-   
-# da chiamare subito dopo blockMoments
-def stampaGestione():
-   print("N. Blocks processed with new and with traditional way",NUOVO,VECCHIO)
-   #print("Blocchi gestiti col nuovo e col vecchio",NUOVO,VECCHIO)
-
-#---------------------MAIN-----------------------
-
-from spiliotis2D import extractBlocks
-from commons2D import main
+
+def setCentralMomentsInt(max_side):
+  """
+  Return the list of C(D) = (D^3-D)/3 = 4*c2(D) for D in
+  [0,max_side], which are integers; c2(D) is the central
+  moment of order 2 of a segment of D pixels:
+  c2(D) = sum of (i-(D-1)/2)^2 for i=0..D-1 = (D^3-D)/12.
+  """
+  return [(D*D*D-D)//3 for D in range(max_side+1)]
+
+def maxOrder(wanted):
+  """
+  Return the max order p+q of the wanted orders.
+  """
+  return max([sum(key) for key in wanted])
+
+def scaleDoubled(MM, N):
+  """
+  Add to the moments MM the doubled moments N, given in the
+  order of orders, scaled back: m_{p,q} = n_{p,q}/2^(p+q).
+  """
+  for key, n in zip(orders, N):
+    MM[key] += n >> (key[0]+key[1])
+  return MM
+
+def doubledMoments(blocks, central):
+  """
+  Return the doubled moments n_{p,q} = 2^(p+q)*m_{p,q} of the
+  blocks (x0,y0,x1,y1), in the order of orders, computed
+  from the doubled barycenter (X,Y) = (x0+x1,y0+y1) and from
+  central((DX,DY)), which returns the central moments mu_00,
+  4*mu_20, 4*mu_02 of a block of DX x DY pixels.
+  All values are integers, so the result is exact.
+  """
+  n00 = n10 = n01 = n11 = n20 = n02 = n30 = n03 = n21 = n12 = 0
+  for x0,y0,x1,y1 in blocks:
+     # doubled barycenter
+     X = x1+x0
+     Y = y1+y0
+     central00, central20, central02 = central((x1-x0+1, y1-y0+1))
+     # compute doubled moments from central ones
+     t10 = X*central00
+     t20 = X*t10 + central20
+     t02 = Y*Y*central00 + central02
+     # update doubled image moments
+     n00 += central00
+     n10 += t10
+     n01 += Y*central00
+     n11 += Y*t10
+     n20 += t20
+     n02 += t02
+     n30 += X*(t20 + 2*central20)
+     n03 += Y*(t02 + 2*central02)
+     n21 += Y*t20
+     n12 += X*t02
+  return (n00, n10, n01, n11, n20, n02, n30, n03, n21, n12)
+
+class BW_BlockEngine2D:
+  """
+  The new block method with its own state: optimization level
+  and limit, precomputed tables, plan chosen by the autotuner and
+  counters of the blocks processed in the new and traditional way.
+  Engines with different configurations can be used at the same
+  time. The tables are written only by preprocessing (or
+  preprocessing_once) and then only read by blockMoments, so after
+  preprocessing one engine can be shared by many threads (see
+  batch.py): the counters are kept per thread, the cache of
+  level 4 is locked after share(), and after share() the matrix
+  of level 2 does not grow, so an image larger than the one given
+  to preprocessing raises RuntimeError instead of changing the
+  rows read by the other threads.
+  """
+  def __init__(self, level=DEFAULT_LEVEL, limit=DEFAULT_LIMIT):
+    self.setOptimizationLevel(level)
+    self.limit = limit
+    # central moments of rectangles (levels 0, 1, 2)
+    self.CC00 = self.CC20 = self.CC02 = None
+    # matrix storing precomputed sums of powers (level 2)
+    self.powers = None
+    # central moments of segments, times 4 (level 3)
+    self.CC2 = None
+    # cache of central moments by shape (level 4)
+    self.cache = None
+    # table of C(D) for the wanted orders, if needed
+    self.CCW = None
+    # description of the plan chosen by the autotuner, if any (see autotune.py)
+    self.tuned = None
+    self.local = threading.local()
+
+  def setOptimizationLevel(self, level):
+    assert level in [0,1,2,3,4]
+    self.level = level
+
+  def setLimits(self, limit):
+    self.limit = limit
+
+  def share(self):
+    """
+    Prepare the engine to be used by many threads at once.
+    """
+    if self.cache is not None: self.cache.share()
+    if self.powers is not None: self.powers.share()
+
+  def setCounters(self, nuovo, vecchio):
+    self.local.counters = (nuovo, vecchio)
+
+  def counters(self):
+    """
+    Return the number of blocks processed with the new and with
+    the traditional way by the last blockMoments of this thread.
+    """
+    return getattr(self.local, "counters", (0,0))
+
+  def preprocessing(self, ibr, wanted=None):
+    #assert isinstance(ibr,BW_BlockImage2D)
+    if wanted is not None:
+      wanted = wantedOrders(wanted, True)
+      # only the table for the powers 2 and 3, if needed
+      # (orders above 3 go to the kernel, which makes its own)
+      if maxOrder(wanted)<=3 and max(maxPowers(wanted))>=2:
+        self.CCW = setCentralMomentsInt(max(ibr.max_pair()))
+      else:
+        self.CCW = None
+      return
+
+    # manage optimization level
+    if self.level==0:
+      maximum = max(ibr.max_pair())
+      self.CC00, self.CC20, self.CC02 = setCentralMoments(maximum)
+    elif self.level==1:
+      maximum = sorted(ibr.max_pair(),reverse=True)
+      self.CC00, self.CC20, self.CC02 = setCentralMoments(maximum)
+    elif self.level==2:
+      maximum = sorted(ibr.max_pair(),reverse=True)
+      maximum[1] = min(maximum[1],self.limit)
+      self.CC00, self.CC20, self.CC02 = setCentralMoments(maximum)
+      self.powers = PowerMatrix( 3, ibr.origsize )
+    elif self.level==3:
+      self.CC2 = setCentralMomentsInt(max(ibr.max_pair()))
+    elif self.level==4:
+      # keep the cache of the previous images, if any
+      if self.cache is None: self.cache = ShapeCache()
+
+  def preprocessing_once(self, max_side=None):
+    if self.level==4:
+      # new cache for the set of images, max_side is not needed
+      self.cache = ShapeCache()
+      return
+    if self.level==3:
+      self.CC2 = setCentralMomentsInt(max_side)
+      return
+    # precompute matrix for traditional method
+    self.powers = PowerMatrix( 3, max_side )
+    # precompute central moments for new method
+    if self.level==0:
+      self.CC00, self.CC20, self.CC02 = setCentralMoments(max_side)
+    else: # 1,2
+      self.CC00, self.CC20, self.CC02 = setCentralMoments((max_side,self.limit))
+
+  def blockMoments(self, ibr, wanted=None):
+    """
+    Compute all moments m_{p,q} for p,q>=0 and p+q<=3
+    of a 2D image given as a set of blocks,
+    or only the wanted ones (see wantedMoments), also of
+    order above 3 (with blockMomentsKernel of kernelgen.py)
+    """
+    if wanted is not None:
+      self.setCounters(ibr.size(), 0)
+      wanted = wantedOrders(wanted, True)
+      if maxOrder(wanted)>3: return blockMomentsKernel(ibr, wanted)
+      return wantedMoments(ibr, wanted, self.CCW)
+    if self.level==3: return self.separableMoments(ibr)
+    if self.level==4: return self.lazyMoments(ibr)
+
+    # orders is the global variable imported from commons3D
+    # initialize moments to be computed
+    MM = {key:0 for key in orders}
+  
+    for p,q in orders:
+          MM[(p,q)] = 0 
+    #print("  num blocchi",len(ibr.block))
+
+    NUOVO,VECCHIO = 0,0 #APRILE
+    # tables and limits of the engine
+    powers, LIMIT, OPT_LEVEL = self.powers, self.limit, self.level
+
+    blocks = zip(*ibr.columns())
+    if OPT_LEVEL>1:
+      small = [] # blocks processed in the new way
+      for x0,y0,x1,y1 in blocks: # cycle on blocks
+         dimens = (x1-x0+1, y1-y0+1) #APRILE
+         if min(dimens)>LIMIT: #APRILE faccio al modo vecchio
+           #print("VECCHIO MODO",dimens,ordered)
+           for p,q in orders:
+             if p==0: mx = dimens[0]
+             else:
+               mx = powers.valueSum(p, x1)
+               if x0>0:
+                  mx -= powers.valueSum(p, x0-1)
+             if q==0: my = dimens[1]
+             else:
+               my = powers.valueSum(q, y1)
+               if y0>0:
+                  my -= powers.valueSum(q, y0-1)
+             if (mx or my): MM[(p,q)] += (mx*my)
+           VECCHIO += 1
+         else:
+           small.append((x0,y0,x1,y1))
+      blocks = small
+      #FINE APRILE
+    NUOVO = ibr.size()-VECCHIO
+
+    # add the doubled moments of the blocks processed in the new way
+    scaleDoubled(MM, doubledMoments(blocks, self.tableCentral))
+    self.setCounters(NUOVO, VECCHIO)
+    return MM
+
+  def tableCentral(self, shape):
+    """
+    Return the central moments mu_00, 4*mu_20, 4*mu_02 of a
+    block of DX x DY pixels, from the tables of levels 0, 1, 2
+    (which store only DX>=DY).
+    """
+    DX, DY = shape
+    if DX>=DY:
+      key = (DX, DY)
+      return self.CC00[key], int(4*self.CC20[key]), int(4*self.CC02[key])
+    key = (DY, DX)
+    return self.CC00[key], int(4*self.CC02[key]), int(4*self.CC20[key])
+
+  def segmentCentral(self, shape):
+    """
+    Return the central moments mu_00, 4*mu_20, 4*mu_02 of a
+    block of DX x DY pixels, from the central moments of
+    segments (level 3).
+    """
+    DX, DY = shape
+    return DX*DY, DY*self.CC2[DX], DX*self.CC2[DY]
+
+  def separableMoments(self, ibr):
+    """
+    Compute all moments m_{p,q} for p,q>=0 and p+q<=3
+    of a 2D image given as a set of blocks, with the
+    central moments of segments (optimization level 3).
+    """
+    self.setCounters(ibr.size(), 0)
+    N = doubledMoments(zip(*ibr.columns()), self.segmentCentral)
+    return scaleDoubled({key:0 for key in orders}, N)
+
+  def lazyMoments(self, ibr):
+    """
+    Compute all moments m_{p,q} for p,q>=0 and p+q<=3
+    of a 2D image given as a set of blocks, with the
+    central moments taken from the cache (optimization level 4).
+    """
+    self.setCounters(ibr.size(), 0)
+    N = doubledMoments(zip(*ibr.columns()), self.cache.get)
+    return scaleDoubled({key:0 for key in orders}, N)
+
+  # da chiamare subito dopo blockMoments
+  def stampaGestione(self):
+    print("N. Blocks processed with new and with traditional way",*self.counters())
+    if self.level==4: self.cache.statistiche()
+    if self.tuned: print("Autotuned plan:",self.tuned)
+
+# engine used by the functions of the module
+ENGINE = BW_BlockEngine2D()
+
+def setOptimizationLevel(level):
+  ENGINE.setOptimizationLevel(level)
+
+def setLimits(limit):
+  ENGINE.setLimits(limit)
+
+def preprocessing(ibr, wanted=None):
+  ENGINE.preprocessing(ibr, wanted)
+
+def preprocessing_once(max_side=None):
+  ENGINE.preprocessing_once(max_side)
+
+def blockMoments(ibr, wanted=None):
+  """
+  Compute all moments m_{p,q} for p,q>=0 and p+q<=3
+  of a 2D image given as a set of blocks,
+  or only the wanted ones (see wantedMoments), also of
+  order above 3, with the engine of the module.
+  """
+  return ENGINE.blockMoments(ibr, wanted)
+
+def wantedMoments(ibr, wanted, table=None):
+  """
+  Compute the wanted moments (see wantedOrders in commons2D.py)
+  of a 2D image given as a set of blocks, with integers only,
+  along the columns of the blocks, computing only the sums of
+  powers needed by the wanted orders (see sideTerms in powersums.py).
+  table is the list of C(D) (see setCentralMomentsInt), or None
+  to compute them.
+  """
+  wanted = wantedOrders(wanted)
+  x0, y0, x1, y1 = ibr.columns()
+  terms = []
+  for (c0,c1),top in zip(((x0,x1),(y0,y1)), maxPowers(wanted)):
+     D = [dc+1 for dc in map(sub, c1, c0)]
+     X = list(map(add, c0, c1)) if top>0 else None
+     terms.append(sideTerms(D, X, top, table))
+  return wantedSums(terms, wanted)
+
+def blockMomentsGrouped(ibr, wanted=None):
+  """
+  Compute all moments m_{p,q} for p,q>=0 and p+q<=3
+  of a 2D image given as a set of blocks, grouping
+  blocks with the same shape
+  (only the wanted orders, if given).
+  """
+  # for each shape, doubled barycenters of the blocks
+  groups = dict()
+  x0, y0, x1, y1 = ibr.columns()
+  for key, X, Y in zip(zip(map(sub, x1, x0), map(sub, y1, y0)), map(add, x0, x1), map(add, y0, y1)):
+     G = groups.get(key)
+     if G is None:
+        G = groups[key] = ([],[])
+     G[0].append(X)
+     G[1].append(Y)
+  # shape is the number of pixels along x and y
+  return shapeMoments(dict([((dx+1,dy+1),G) for (dx,dy),G in groups.items()]), wantedOrders(wanted))
+
+def blockMomentsExact(ibr, wanted=None):
+  """
+  Compute all moments m_{p,q} for p,q>=0 and p+q<=3
+  of a 2D image given as a set of blocks, with integers only.
+  For a side of D pixels with doubled barycenter X, the sum
+  of (2x)^k over its pixels is
+    T_0 = D, T_1 = D*X, T_2 = D*X^2+C, T_3 = D*X^3+3*C*X
+  where C = (D^3-D)/3 = 4*c2(D) is an integer, so the sum of
+  Tx_p*Ty_q over the blocks is 2^(p+q)*m_{p,q}.
+  Only the wanted orders are computed, if given (see wantedMoments).
+  """
+  if wanted is not None: return wantedMoments(ibr, wanted)
+  n00 = n10 = n01 = n11 = n20 = n02 = n30 = n03 = n21 = n12 = 0
+  for x0,y0,x1,y1 in zip(*ibr.columns()): # cycle on blocks
+     # x side
+     D = x1-x0+1
+     X = x0+x1
+     C = (D*D*D-D)//3
+     tx1 = D*X
+     tx2 = tx1*X + C
+     tx3 = X*(tx2 + 2*C)
+     # y side
+     E = y1-y0+1
+     Y = y0+y1
+     C = (E*E*E-E)//3
+     ty1 = E*Y
+     ty2 = ty1*Y + C
+     ty3 = Y*(ty2 + 2*C)
+     # update doubled image moments
+     n00 += D*E
+     n10 += tx1*E
+     n01 += D*ty1
+     n11 += tx1*ty1
+     n20 += tx2*E
+     n02 += D*ty2
+     n30 += tx3*E
+     n03 += D*ty3
+     n21 += tx2*ty1
+     n12 += tx1*ty2
+  # scale back: m_{p,q} = n_{p,q}/2^(p+q)
+  return {(0,0):n00, (1,0):n10>>1, (0,1):n01>>1, (1,1):n11>>2,
+          (2,0):n20>>2, (0,2):n02>>2, (3,0):n30>>3, (0,3):n03>>3,
+          (2,1):n21>>3, (1,2):n12>>3}
+
+def blockMomentsVec(ibr, wanted=None):
+  """
+  Compute all moments m_{p,q} for p,q>=0 and p+q<=3
+  of a 2D image given as a set of blocks, with NumPy
+  (with blockMomentsExact if NumPy is not available),
+  or only the wanted ones.
+  """
+  if np is None: return blockMomentsExact(ibr, wanted)
+  x0, y0, x1, y1 = [col.astype(np.int64) for col in ibr.arrays()]
+  return vectorMoments([x1-x0+1, y1-y0+1], [x0+x1, y0+y1], wantedOrders(wanted))
+
+# da chiamare subito dopo blockMoments
+def stampaGestione():
+   ENGINE.stampaGestione()
+   #print("Blocchi gestiti col nuovo e col vecchio",NUOVO,VECCHIO)
+
+#---------------------MAIN-----------------------
+
+from powersums import shapeMoments, maxPowers, sideTerms, wantedSums
+from kernelgen import blockMomentsKernel
+from shapecache import ShapeCache
+from momentVec import vectorMoments, printModes, np
+from operator import add, sub
+from spiliotis2D import extractBlocks
+from commons2D import main
 import sys
-
-if __name__ == "__main__":
-   main(sys.argv, extractBlocks, preprocessing, blockMoments, "====2D Blocks, new method.")
-   print("Blocchi gestiti col nuovo e col vecchio",NUOVO,VECCHIO)
+
+if __name__ == "__main__":
+   if sys.argv[-1]=="vec":
+     main(sys.argv[0:-1], extractBlocks, None, blockMomentsVec, "====2D Blocks, new method vectorized.")
+     printModes()
+   elif sys.argv[-1]=="exact":
+     main(sys.argv[0:-1], extractBlocks, None, blockMomentsExact, "====2D Blocks, new method exact.")
+   elif sys.argv[-1]=="grouped":
+     main(sys.argv[0:-1], extractBlocks, None, blockMomentsGrouped, "====2D Blocks, new method grouped by shape.")
+   else:
+     main(sys.argv, extractBlocks, preprocessing, blockMoments, "====2D Blocks, new method.")
+     print("Blocchi gestiti col nuovo e col vecchio",*ENGINE.counters())
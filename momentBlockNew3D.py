@@ -1,338 +1,671 @@
-"""
-Computation of moments of a 3D image on the block 
-decomposition by Spiliotis and Mertzios,
-with the new idea that precomputes central moments.
-
-Optimization level 0:
-Compute all central moments of cuboids with
-dimX = 1...max width of a block
-dimY = 1...max height of a block
-dimZ = 1...max length of a block
-and dimX>=dimY>=DimZ
-
-Optimization level 1:
-Compute all central moments of rectangles with
-dimX = 1...max width of a block
-dimY = 1...max height of a block
-dimZ = 1...max length of a block
-(given that max width>=max height>=max length, otherwise swap)
-
-Optimization level 2:
-Compute all central moments of rectangles with
-dimX = 1...max width of a block
-dimY = 1...min{8,max height of a block}
-dimZ = 1...min{2,max length of a block}
-and the moments of larger blocks will be computed in
-the traditional way
-(this requires computing the bigmatrix as well).
-
-Optimization for a set of images:
-Compute all central moments of rectangles with
-dimX = 1...given value
-dimY = 1...8
-dimZ = 1...2
-and do it only once for many images;
-the  the moments of larger blocks will be computed in
-the traditional way
-(this requires computing the bigmatrix as well).
-"""
-
-#---------------------MOMENTS-----------------------
-
-from commons3D import orders
-
-from bigmatrix import PowerMatrix         #APRILE
-#Matrix storing precomputed sums of powers#APRILE
-powers = None                             #APRILE
-
-OPT_LEVEL = 2
-LIMIT_Y, LIMIT_Z = 8,2
-
-def setOptimizationLevel(level):
-  assert level in [0,1,2]
-  global OPT_LEVEL
-  OPT_LEVEL = level
+"""
+Computation of moments of a 3D image on the block 
+decomposition by Spiliotis and Mertzios,
+with the new idea that precomputes central moments.
+
+Optimization level 0:
+Compute all central moments of cuboids with
+dimX = 1...max width of a block
+dimY = 1...max height of a block
+dimZ = 1...max length of a block
+and dimX>=dimY>=DimZ
+
+Optimization level 1:
+Compute all central moments of rectangles with
+dimX = 1...max width of a block
+dimY = 1...max height of a block
+dimZ = 1...max length of a block
+(given that max width>=max height>=max length, otherwise swap)
+
+Optimization level 2:
+Compute all central moments of rectangles with
+dimX = 1...max width of a block
+dimY = 1...min{8,max height of a block}
+dimZ = 1...min{2,max length of a block}
+and the moments of larger blocks will be computed in
+the traditional way
+(this requires computing the bigmatrix as well).
+
+Optimization level 3 (separable):
+The central moments of a cuboid DX x DY x DZ are
+mu_000 = DX*DY*DZ, mu_200 = DY*DZ*c2(DX),
+mu_020 = DX*DZ*c2(DY), mu_002 = DX*DY*c2(DZ)
+where c2(D) = (D^3-D)/12 is the central moment of order 2 of
+a segment of D voxels. Only C(D) = 4*c2(D) is computed, for
+D = 1...max side of a block, and all blocks are computed
+in the same way, with no limit on their size and no
+permutation of the sides.
+
+Optimization level 4 (lazy):
+The central moments of a block are computed from the same
+closed formulas of level 3 the first time its shape DX x DY x DZ
+is found, and kept in a cache of bounded size with LRU eviction
+(see shapecache.py), so only the shapes actually used are
+computed. The cache is kept across images, so many images
+can be processed with no max side given in advance.
+
+Grouping by shape (blockMomentsGrouped):
+Blocks with the same sides DX x DY x DZ are grouped, and for each
+group only sums of powers of the barycenters are computed,
+the central moments are applied once per group (see powersums.py).
+This needs no preprocessing.
+
+Exact integer arithmetic (blockMomentsExact):
+The barycenters are doubled (X = x0+x1) so that all terms
+are integers, and the moments are scaled back by powers of two
+only once at the end; the result is exact for any image size.
+This needs no preprocessing.
+
+Vectorized (blockMomentsVec):
+The same computation of blockMomentsExact with NumPy, on 64 bit
+integers when they cannot overflow (see momentVec.py).
+This needs no preprocessing.
+
+Wanted orders (blockMoments with the argument wanted):
+Only the wanted moments are computed, with integers only as in
+blockMomentsExact, along the columns of the blocks: the sums of
+powers of each axis are computed only up to the max power of the
+axis in the wanted orders (e.g. m30 needs T_3, T_2, T_1 along x),
+so preprocessing builds only the table of C(D) = (D^3-D)/3, and
+only if some wanted order has a power 2 or 3.
+The optimization level is not used.
+
+All levels compute the moments with integers only, with
+doubled barycenters as blockMomentsExact (see below): the
+central moments of order 2 are taken times 4, and the sums
+are scaled back only once at the end.
+
+Optimization for a set of images:
+Compute all central moments of rectangles with
+dimX = 1...given value
+dimY = 1...8
+dimZ = 1...2
+and do it only once for many images;
+the  the moments of larger blocks will be computed in
+the traditional way
+(this requires computing the bigmatrix as well).
+
+Engines:
+The state of the method (level, limits, tables) is kept in an
+object of class BW_BlockEngine3D; the functions setOptimizationLevel,
+setLimits, preprocessing, preprocessing_once, blockMoments and
+stampaGestione of the module work on its engine ENGINE.
+"""
+
+#---------------------MOMENTS-----------------------
+
+from commons3D import orders, wantedOrders
+
+from bigmatrix import PowerMatrix         #APRILE
+import threading
+
+# default optimization level and limits of level 2 of a new engine
+DEFAULT_LEVEL = 2
+DEFAULT_LIMIT_Y, DEFAULT_LIMIT_Z = 8,2
 
 def setCentralMoments(max_side):
-  """
-  The argument can be a single integer or a terne of integers,
-  which are the max length of a block (rectangle) in the three
+  """
+  The argument can be a single integer or a terne of integers,
+  which are the max length of a block (rectangle) in the three
   Cartesian directions of the space.
   Compute and store all central moments of rectangles of size DX x DY x DZ
-  with DX,DY,DZ in [1,max_side], DX>=DY>=DZ..
+  with DX,DY,DZ in [1,max_side], DX>=DY>=DZ..
   - for DX==DY==DZ==1 the only non-zero moment is mu_000 
   - otherwise the only non-zero moments are mu_000 and mu_200, mu_020, mu_002
-  """
-  
-  # manage argument
-  if type(max_side) is int:
-    MoreMax,MidMax,LessMax = max_side, max_side, max_side
-  else:
-    MoreMax,MidMax,LessMax = max_side # already sorted, decreasing
+  """
+  
+  # manage argument
+  if type(max_side) is int:
+    MoreMax,MidMax,LessMax = max_side, max_side, max_side
+  else:
+    MoreMax,MidMax,LessMax = max_side # already sorted, decreasing
   
   CentrMom000 = dict()
-  CentrMom200 = dict()
-  CentrMom020 = dict()
-  CentrMom002 = dict()
-
-  #DX==DY==DZ==1
-  CentrMom000[(1,1,1)] = 1
-  CentrMom200[(1,1,1)] = 0
-  CentrMom020[(1,1,1)] = 0
-  CentrMom002[(1,1,1)] = 0
-  
-  # Compute auxiliary values: 
-  # sum_half = 0.5^2 + 1.5^2 + 2.5^2 + ...
-  # sum_full = 1^2   + 2^2   + 3^2   + ...
-  sum_half=[0,0.25]
-  sum_full=[0]
-  for f in range(2,MoreMax+1):
-    sum_half.append(sum_half[f-1]+((f-0.5)**2))
-  for f in range(1,MoreMax+1):
-    sum_full.append(sum_full[f-1]+(f**2))
-
-  # DX>=1 and DY==DZ==1
-  for edgeX in range(1,MoreMax+1):
-     CentrMom000[(edgeX,1,1)] = edgeX
-     CentrMom020[(edgeX,1,1)] = 0
-     CentrMom002[(edgeX,1,1)] = 0
-     if edgeX%2==0:
-       CentrMom200[(edgeX,1,1)] = 2*sum_half[edgeX//2]
-     else:
-       CentrMom200[(edgeX,1,1)] = 2*sum_full[edgeX//2]
-     #print("a) set ",(edgeX,1,1))
-
-  # DZ==1 and DX>=DY>1
-  for edgeY in range(2,MidMax+1):
-    for edgeX in range(edgeY,MoreMax+1):
-      CentrMom000[(edgeX,edgeY,1)] = edgeX*edgeY
-      CentrMom002[(edgeX,edgeY,1)] = 0
-      if edgeX%2==0: sum_x = sum_half
-      else: sum_x = sum_full
-      if edgeY%2==0: sum_y = sum_half
-      else: sum_y = sum_full
-      CentrMom200[(edgeX,edgeY,1)] = 2*edgeY*sum_x[edgeX//2]
-      CentrMom020[(edgeX,edgeY,1)] = 2*edgeX*sum_y[edgeY//2]
-      #print("b) set ",(edgeX,edgeY,1))
-
-  # DX>=DY>=DZ>1
-  for edgeZ in range(2,LessMax+1):
-    for edgeY in range(edgeZ,MidMax+1):
-      for edgeX in range(edgeY,MoreMax+1):
-        CentrMom000[(edgeX,edgeY,edgeZ)] = edgeX*edgeY*edgeZ
-        if edgeX%2==0: sum_x = sum_half
-        else: sum_x = sum_full
-        if edgeY%2==0: sum_y = sum_half
-        else: sum_y = sum_full
-        if edgeZ%2==0: sum_z = sum_half
-        else: sum_z = sum_full
-        CentrMom200[(edgeX,edgeY,edgeZ)] = 2*edgeY*edgeZ*sum_x[edgeX//2]
-        CentrMom020[(edgeX,edgeY,edgeZ)] = 2*edgeX*edgeZ*sum_y[edgeY//2]
-        CentrMom002[(edgeX,edgeY,edgeZ)] = 2*edgeX*edgeY*sum_z[edgeZ//2]
-        #print("c) set ",(edgeX,edgeY,edgeZ))
-
+  CentrMom200 = dict()
+  CentrMom020 = dict()
+  CentrMom002 = dict()
+
+  #DX==DY==DZ==1
+  CentrMom000[(1,1,1)] = 1
+  CentrMom200[(1,1,1)] = 0
+  CentrMom020[(1,1,1)] = 0
+  CentrMom002[(1,1,1)] = 0
+  
+  # Compute auxiliary values: 
+  # sum_half = 0.5^2 + 1.5^2 + 2.5^2 + ...
+  # sum_full = 1^2   + 2^2   + 3^2   + ...
+  sum_half=[0,0.25]
+  sum_full=[0]
+  for f in range(2,MoreMax+1):
+    sum_half.append(sum_half[f-1]+((f-0.5)**2))
+  for f in range(1,MoreMax+1):
+    sum_full.append(sum_full[f-1]+(f**2))
+
+  # DX>=1 and DY==DZ==1
+  for edgeX in range(1,MoreMax+1):
+     CentrMom000[(edgeX,1,1)] = edgeX
+     CentrMom020[(edgeX,1,1)] = 0
+     CentrMom002[(edgeX,1,1)] = 0
+     if edgeX%2==0:
+       CentrMom200[(edgeX,1,1)] = 2*sum_half[edgeX//2]
+     else:
+       CentrMom200[(edgeX,1,1)] = 2*sum_full[edgeX//2]
+     #print("a) set ",(edgeX,1,1))
+
+  # DZ==1 and DX>=DY>1
+  for edgeY in range(2,MidMax+1):
+    for edgeX in range(edgeY,MoreMax+1):
+      CentrMom000[(edgeX,edgeY,1)] = edgeX*edgeY
+      CentrMom002[(edgeX,edgeY,1)] = 0
+      if edgeX%2==0: sum_x = sum_half
+      else: sum_x = sum_full
+      if edgeY%2==0: sum_y = sum_half
+      else: sum_y = sum_full
+      CentrMom200[(edgeX,edgeY,1)] = 2*edgeY*sum_x[edgeX//2]
+      CentrMom020[(edgeX,edgeY,1)] = 2*edgeX*sum_y[edgeY//2]
+      #print("b) set ",(edgeX,edgeY,1))
+
+  # DX>=DY>=DZ>1
+  for edgeZ in range(2,LessMax+1):
+    for edgeY in range(edgeZ,MidMax+1):
+      for edgeX in range(edgeY,MoreMax+1):
+        CentrMom000[(edgeX,edgeY,edgeZ)] = edgeX*edgeY*edgeZ
+        if edgeX%2==0: sum_x = sum_half
+        else: sum_x = sum_full
+        if edgeY%2==0: sum_y = sum_half
+        else: sum_y = sum_full
+        if edgeZ%2==0: sum_z = sum_half
+        else: sum_z = sum_full
+        CentrMom200[(edgeX,edgeY,edgeZ)] = 2*edgeY*edgeZ*sum_x[edgeX//2]
+        CentrMom020[(edgeX,edgeY,edgeZ)] = 2*edgeX*edgeZ*sum_y[edgeY//2]
+        CentrMom002[(edgeX,edgeY,edgeZ)] = 2*edgeX*edgeY*sum_z[edgeZ//2]
+        #print("c) set ",(edgeX,edgeY,edgeZ))
+
   return (CentrMom000, CentrMom200, CentrMom020, CentrMom002)
-
-def preprocessing(ibr):
-  #assert isinstance(ibr,BW_BlockImage3D)
-
-  # precompute central moments for new method
-  global CC000, CC200, CC020, CC002
-  # precompute matrix for traditional method
-  global powers
-  
-  # manage optimization level
-  if OPT_LEVEL==0:
-    maximum = max(ibr.max_triplet())
-    CC000, CC200, CC020, CC002 = setCentralMoments(maximum)
-  elif OPT_LEVEL==1:
-    maximum = sorted(ibr.max_triplet(),reverse=True)
-    CC000, CC200, CC020, CC002 = setCentralMoments(maximum)
-  elif OPT_LEVEL==2:
-    maximum = sorted(ibr.max_triplet(),reverse=True)
-    maximum[1] = min(maximum[1],LIMIT_Y)
-    maximum[2] = min(maximum[2],LIMIT_Z)
-    CC000, CC200, CC020, CC002 = setCentralMoments(maximum)  
-    powers = PowerMatrix( 3, ibr.origsize )
-
-def preprocessing_once(max_side):
-  # precompute matrix for traditional method
-  global powers
-  powers = PowerMatrix( 3, max_side )
-  
-  # precompute central moments for new method
-  global CC000, CC200, CC020, CC002
-  if OPT_LEVEL==0:
-    CC000, CC200, CC020, CC002 = setCentralMoments(max_side)
-  else: # 1,2
-    CC000, CC200, CC020, CC002 = setCentralMoments((max_side,LIMIT_Y,LIMIT_Z))
-  
-def blockMoments(ibr):
-  """
-  Compute all moments m_{p,q,r} for p,q,r>=0 and p+q+r<=3
-  of a 3D image given as a set of blocks
-  """
-  #assert isinstance(ibr,BW_BlockImage3D)
-
-  # orders is the global variable imported from commons3D
-  # initialize moments to be computed
-  MM = {key:0 for key in orders}
-  
-  #print()
-  for p,q,r in orders:
-     MM[(p,q,r)] = 0 
-  
-  global NUOVO
-  global VECCHIO 
-  NUOVO,VECCHIO = 0,0 #APRILE
-  
-  for b in ibr.block: # cycle on blocks
-
-     if OPT_LEVEL>1:
-       dimens = (b.x1-b.x0+1, b.y1-b.y0+1, b.z1-b.z0+1) #APRILE
-       ordered = sorted(dimens)
-       if (ordered[1]>LIMIT_Y) or (ordered[0]>LIMIT_Z): #APRILE faccio al modo vecchio
-         #print("VECCHIO MODO",dimens,ordered)
-         for p,q,r in orders:
-           if p==0: mx = dimens[0]
-           else:
-             mx = powers.valueSum(p, b.x1)
-             if b.x0>0:
-                mx -= powers.valueSum(p, b.x0-1)
-           if q==0: my = dimens[1]
-           else:
-             my = powers.valueSum(q, b.y1)
-             if b.y0>0:
-                my -= powers.valueSum(q, b.y0-1)
-           if r==0: mz = dimens[2]
-           else:
-             mz = powers.valueSum(r, b.z1)
-             if b.z0>0:
-                mz -= powers.valueSum(r, b.z0-1)
-           if (mx or my or mz): MM[(p,q,r)] += (mx*my*mz)
-         VECCHIO += 1
-         continue
-     #FINE APRILE   
-     
-     #print("NUOVO MODO",dimens,ordered)
-     NUOVO += 1
-     # barycenter
-     xx = 0.5*(b.x1+b.x0)
-     yy = 0.5*(b.y1+b.y0)
-     zz = 0.5*(b.z1+b.z0)
-     #print("Momenti di ",b, " di ",b.pixel_num(), " pixel, baricentro ",(xx,yy,zz))
-
-     # retrieve central moments of block
-     if (b.x1-b.x0)>=(b.y1-b.y0) and (b.y1-b.y0)>=(b.z1-b.z0):
-               #print("  key xyz")
-               key = (b.x1-b.x0+1, b.y1-b.y0+1, b.z1-b.z0+1)
-               central000 = CC000[key]
-               central200 = CC200[key]
-               central020 = CC020[key]
-               central002 = CC002[key]
-     elif (b.x1-b.x0)>=(b.z1-b.z0) and (b.z1-b.z0)>=(b.y1-b.y0):
-               #print("  key xzy,  020:=002 e 022:=020 ")
-               key = (b.x1-b.x0+1, b.z1-b.z0+1, b.y1-b.y0+1)
-               central000 = CC000[key]
-               central200 = CC200[key]
-               central020 = CC002[key]
-               central002 = CC020[key]
-     elif (b.y1-b.y0)>=(b.x1-b.x0) and (b.x1-b.x0)>=(b.z1-b.z0):
-               #print("  key yxz,  200:=020 e 020:=200 ")
-               key = (b.y1-b.y0+1, b.x1-b.x0+1, b.z1-b.z0+1)
-               central000 = CC000[key]
-               central200 = CC020[key]
-               central020 = CC200[key]
-               central002 = CC002[key]
-     elif (b.y1-b.y0)>=(b.z1-b.z0) and (b.z1-b.z0)>=(b.x1-b.x0):
-               #print("  key yzx,  200:=002 e 020:=200 e 002:=020")
-               key = (b.y1-b.y0+1, b.z1-b.z0+1, b.x1-b.x0+1)
-               central000 = CC000[key]
-               central200 = CC002[key]
-               central020 = CC200[key]
-               central002 = CC020[key]
-     elif (b.z1-b.z0)>=(b.x1-b.x0) and (b.x1-b.x0)>=(b.y1-b.y0):
-               #print("  key zxy,  200:=020 e 020:=002 e 002:=200")
-               key = (b.z1-b.z0+1, b.x1-b.x0+1, b.y1-b.y0+1)
-               central000 = CC000[key]
-               central200 = CC020[key]
-               central020 = CC002[key]
-               central002 = CC200[key]
-     else: # (b.z1-b.z0)>=(b.y1-b.y0) and (b.y1-b.y0)>=(b.x1-b.x0)
-               #print("  key zyx,  200:=002 e 002:=200")
-               key = (b.z1-b.z0+1, b.y1-b.y0+1, b.x1-b.x0+1)
-               central000 = CC000[key]
-               central200 = CC002[key]
-               central020 = CC020[key]
-               central002 = CC200[key]
-     ##print("Blocco",b,"chiave",key)
-     # compute moments from central ones
-     m000 = central000
-     m100 = xx*central000
-     m010 = yy*central000
-     m001 = zz*central000 
-     #print("\t m000=",m000,"\t m100=",m100,"\t m010=",m010,"\t m001=",m001)
-     
-     m011 = zz*m010
-     m101 = xx*m001
-     m110 = yy*m100
-     #print("\t m011=",m011,"\t m0101=",m0101,"\t m110=",m110)
-          
-     m200 = central200 + xx*m100
-     m020 = central020 + yy*m010
-     m002 = central002 + zz*m001
-     #print("\t m200=",m200,"\t m020=",m020,"\t m002=",m002)
-
-     m021 = zz*m020
-     m210 = yy*m200
-     m120 = xx*m020
-     m102 = xx*m002
-     m012 = yy*m002
-     m201 = zz*m200
-
-     m300 = 3*xx*m200 -2*xx*xx*m100
-     m030 = 3*yy*m020 -2*yy*yy*m010
-     m003 = 3*zz*m002 -2*zz*zz*m001
-
-     m111 = xx*m011
-
-     MM[(0,0,0)] += m000
-     MM[(1,0,0)] += int(m100)
-     MM[(0,1,0)] += int(m010)
-     MM[(1,1,0)] += int(m110)
-     MM[(2,0,0)] += int(m200)
-     MM[(0,2,0)] += int(m020)
-     MM[(2,1,0)] += int(m210)
-     MM[(1,2,0)] += int(m120)
-     MM[(3,0,0)] += int(m300)
-     MM[(0,3,0)] += int(m030)
-     MM[(0,0,3)] += int(m003)
-
-     MM[(0,0,1)] += int(m001)
-     MM[(1,0,1)] += int(m101)
-     MM[(0,1,1)] += int(m011)
-     MM[(1,1,1)] += int(m111)
-     MM[(2,0,1)] += int(m201)
-     MM[(0,2,1)] += int(m021)
-    
-     MM[(0,0,2)] += int(m002)
-     MM[(1,0,2)] += int(m102)
-     MM[(0,1,2)] += int(m012)
-
-  return MM
-   
-# da chiamare subito dopo blockMoments
-def stampaGestione():
-   print("N. Blocks processed with new and with traditional way",NUOVO,VECCHIO)
-   #print("Blocchi gestiti col nuovo e col vecchio",NUOVO,VECCHIO)
-
-#---------------------MAIN-----------------------
-
-from spiliotis3D import extractBlocks, checkBlocks
-from commons3D import main
+
+def setCentralMomentsInt(max_side):
+  """
+  Return the list of C(D) = (D^3-D)/3 = 4*c2(D) for D in
+  [0,max_side], which are integers; c2(D) is the central
+  moment of order 2 of a segment of D voxels:
+  c2(D) = sum of (i-(D-1)/2)^2 for i=0..D-1 = (D^3-D)/12.
+  """
+  return [(D*D*D-D)//3 for D in range(max_side+1)]
+
+def maxOrder(wanted):
+  """
+  Return the max order p+q+r of the wanted orders.
+  """
+  return max([sum(key) for key in wanted])
+
+def scaleDoubled(MM, N):
+  """
+  Add to the moments MM the doubled moments N, given in the
+  order of EXACT_KEYS, scaled back: m_{p,q,r} = n_{p,q,r}/2^(p+q+r).
+  """
+  for key, n in zip(EXACT_KEYS, N):
+    MM[key] += n >> sum(key)
+  return MM
+
+def doubledMoments(blocks, central):
+  """
+  Return the doubled moments n_{p,q,r} = 2^(p+q+r)*m_{p,q,r} of
+  the blocks (x0,y0,z0,x1,y1,z1), in the order of EXACT_KEYS,
+  computed from the doubled barycenter (X,Y,Z) = (x0+x1,y0+y1,z0+z1)
+  and from central((DX,DY,DZ)), which returns the central moments
+  mu_000, 4*mu_200, 4*mu_020, 4*mu_002 of a block of DX x DY x DZ
+  voxels. All values are integers, so the result is exact.
+  """
+  N = [0]*20
+  for x0,y0,z0,x1,y1,z1 in blocks:
+     # doubled barycenter
+     X = x1+x0
+     Y = y1+y0
+     Z = z1+z0
+     central000, central200, central020, central002 = central((x1-x0+1, y1-y0+1, z1-z0+1))
+     # compute doubled moments from central ones
+     t100 = X*central000
+     t010 = Y*central000
+     t001 = Z*central000
+     t200 = X*t100 + central200
+     t020 = Y*t010 + central020
+     t002 = Z*t001 + central002
+     # update doubled image moments, in the order of EXACT_KEYS
+     N[0] += central000
+     N[1] += t100
+     N[2] += t010
+     N[3] += t001
+     N[4] += Y*t100
+     N[5] += Z*t100
+     N[6] += Z*t010
+     N[7] += Z*Y*t100
+     N[8] += t200
+     N[9] += t020
+     N[10] += t002
+     N[11] += Y*t200
+     N[12] += Z*t200
+     N[13] += X*t020
+     N[14] += Z*t020
+     N[15] += X*t002
+     N[16] += Y*t002
+     N[17] += X*(t200 + 2*central200)
+     N[18] += Y*(t020 + 2*central020)
+     N[19] += Z*(t002 + 2*central002)
+  return N
+
+class BW_BlockEngine3D:
+  """
+  The new block method with its own state, as BW_BlockEngine2D
+  (see momentBlockNew2D.py), with the limits of level 2 along
+  the two shorter sides of a block.
+  """
+  def __init__(self, level=DEFAULT_LEVEL, limit_y=DEFAULT_LIMIT_Y, limit_z=DEFAULT_LIMIT_Z):
+    self.setOptimizationLevel(level)
+    self.setLimits(limit_y, limit_z)
+    # central moments of cuboids (levels 0, 1, 2)
+    self.CC000 = self.CC200 = self.CC020 = self.CC002 = None
+    # matrix storing precomputed sums of powers (level 2)
+    self.powers = None
+    # central moments of segments, times 4 (level 3)
+    self.CC2 = None
+    # cache of central moments by shape (level 4)
+    self.cache = None
+    # table of C(D) for the wanted orders, if needed
+    self.CCW = None
+    # description of the plan chosen by the autotuner, if any (see autotune.py)
+    self.tuned = None
+    self.local = threading.local()
+
+  def setOptimizationLevel(self, level):
+    assert level in [0,1,2,3,4]
+    self.level = level
+
+  def setLimits(self, limit_y, limit_z):
+    self.limit_y, self.limit_z = limit_y, limit_z
+
+  def share(self):
+    """
+    Prepare the engine to be used by many threads at once.
+    """
+    if self.cache is not None: self.cache.share()
+    if self.powers is not None: self.powers.share()
+
+  def setCounters(self, nuovo, vecchio):
+    self.local.counters = (nuovo, vecchio)
+
+  def counters(self):
+    """
+    Return the number of blocks processed with the new and with
+    the traditional way by the last blockMoments of this thread.
+    """
+    return getattr(self.local, "counters", (0,0))
+
+  def preprocessing(self, ibr, wanted=None):
+    #assert isinstance(ibr,BW_BlockImage3D)
+    if wanted is not None:
+      wanted = wantedOrders(wanted, True)
+      # only the table for the powers 2 and 3, if needed
+      # (orders above 3 go to the kernel, which makes its own)
+      if maxOrder(wanted)<=3 and max(maxPowers(wanted))>=2:
+        self.CCW = setCentralMomentsInt(max(ibr.max_triplet()))
+      else:
+        self.CCW = None
+      return
+
+    # manage optimization level
+    if self.level==0:
+      maximum = max(ibr.max_triplet())
+      self.CC000, self.CC200, self.CC020, self.CC002 = setCentralMoments(maximum)
+    elif self.level==1:
+      maximum = sorted(ibr.max_triplet(),reverse=True)
+      self.CC000, self.CC200, self.CC020, self.CC002 = setCentralMoments(maximum)
+    elif self.level==2:
+      maximum = sorted(ibr.max_triplet(),reverse=True)
+      maximum[1] = min(maximum[1],self.limit_y)
+      maximum[2] = min(maximum[2],self.limit_z)
+      self.CC000, self.CC200, self.CC020, self.CC002 = setCentralMoments(maximum)
+      self.powers = PowerMatrix( 3, ibr.origsize )
+    elif self.level==3:
+      self.CC2 = setCentralMomentsInt(max(ibr.max_triplet()))
+    elif self.level==4:
+      # keep the cache of the previous images, if any
+      if self.cache is None: self.cache = ShapeCache()
+
+  def preprocessing_once(self, max_side=None):
+    if self.level==4:
+      # new cache for the set of images, max_side is not needed
+      self.cache = ShapeCache()
+      return
+    if self.level==3:
+      self.CC2 = setCentralMomentsInt(max_side)
+      return
+    # precompute matrix for traditional method
+    self.powers = PowerMatrix( 3, max_side )
+    # precompute central moments for new method
+    if self.level==0:
+      self.CC000, self.CC200, self.CC020, self.CC002 = setCentralMoments(max_side)
+    else: # 1,2
+      self.CC000, self.CC200, self.CC020, self.CC002 = setCentralMoments((max_side,self.limit_y,self.limit_z))
+
+  def blockMoments(self, ibr, wanted=None):
+    """
+    Compute all moments m_{p,q,r} for p,q,r>=0 and p+q+r<=3
+    of a 3D image given as a set of blocks,
+    or only the wanted ones (see wantedMoments), also of
+    order above 3 (with blockMomentsKernel of kernelgen.py)
+    """
+    if wanted is not None:
+      self.setCounters(ibr.size(), 0)
+      wanted = wantedOrders(wanted, True)
+      if maxOrder(wanted)>3: return blockMomentsKernel(ibr, wanted)
+      return wantedMoments(ibr, wanted, self.CCW)
+    #assert isinstance(ibr,BW_BlockImage3D)
+    if self.level==3: return self.separableMoments(ibr)
+    if self.level==4: return self.lazyMoments(ibr)
+
+    # orders is the global variable imported from commons3D
+    # initialize moments to be computed
+    MM = {key:0 for key in orders}
+  
+    #print()
+    for p,q,r in orders:
+       MM[(p,q,r)] = 0 
+  
+    NUOVO,VECCHIO = 0,0 #APRILE
+    # tables and limits of the engine
+    powers, LIMIT_Y, LIMIT_Z, OPT_LEVEL = self.powers, self.limit_y, self.limit_z, self.level
+
+    blocks = zip(*ibr.columns())
+    if OPT_LEVEL>1:
+      small = [] # blocks processed in the new way
+      for x0,y0,z0,x1,y1,z1 in blocks: # cycle on blocks
+         dimens = (x1-x0+1, y1-y0+1, z1-z0+1) #APRILE
+         ordered = sorted(dimens)
+         if (ordered[1]>LIMIT_Y) or (ordered[0]>LIMIT_Z): #APRILE faccio al modo vecchio
+           #print("VECCHIO MODO",dimens,ordered)
+           for p,q,r in orders:
+             if p==0: mx = dimens[0]
+             else:
+               mx = powers.valueSum(p, x1)
+               if x0>0:
+                  mx -= powers.valueSum(p, x0-1)
+             if q==0: my = dimens[1]
+             else:
+               my = powers.valueSum(q, y1)
+               if y0>0:
+                  my -= powers.valueSum(q, y0-1)
+             if r==0: mz = dimens[2]
+             else:
+               mz = powers.valueSum(r, z1)
+               if z0>0:
+                  mz -= powers.valueSum(r, z0-1)
+             if (mx or my or mz): MM[(p,q,r)] += (mx*my*mz)
+           VECCHIO += 1
+         else:
+           small.append((x0,y0,z0,x1,y1,z1))
+      blocks = small
+      #FINE APRILE
+    NUOVO = ibr.size()-VECCHIO
+
+    # add the doubled moments of the blocks processed in the new way
+    scaleDoubled(MM, doubledMoments(blocks, self.tableCentral))
+    self.setCounters(NUOVO, VECCHIO)
+    return MM
+
+  def tableCentral(self, shape):
+    """
+    Return the central moments mu_000, 4*mu_200, 4*mu_020, 4*mu_002
+    of a block of DX x DY x DZ voxels, from the tables of levels
+    0, 1, 2 (which store only DX>=DY>=DZ).
+    """
+    DX, DY, DZ = shape
+    if DX>=DY and DY>=DZ:
+      #print("  key xyz")
+      key = (DX, DY, DZ)
+      central000 = self.CC000[key]
+      central200 = int(4*self.CC200[key])
+      central020 = int(4*self.CC020[key])
+      central002 = int(4*self.CC002[key])
+    elif DX>=DZ and DZ>=DY:
+      #print("  key xzy,  020:=002 e 022:=020 ")
+      key = (DX, DZ, DY)
+      central000 = self.CC000[key]
+      central200 = int(4*self.CC200[key])
+      central020 = int(4*self.CC002[key])
+      central002 = int(4*self.CC020[key])
+    elif DY>=DX and DX>=DZ:
+      #print("  key yxz,  200:=020 e 020:=200 ")
+      key = (DY, DX, DZ)
+      central000 = self.CC000[key]
+      central200 = int(4*self.CC020[key])
+      central020 = int(4*self.CC200[key])
+      central002 = int(4*self.CC002[key])
+    elif DY>=DZ and DZ>=DX:
+      #print("  key yzx,  200:=002 e 020:=200 e 002:=020")
+      key = (DY, DZ, DX)
+      central000 = self.CC000[key]
+      central200 = int(4*self.CC002[key])
+      central020 = int(4*self.CC200[key])
+      central002 = int(4*self.CC020[key])
+    elif DZ>=DX and DX>=DY:
+      #print("  key zxy,  200:=020 e 020:=002 e 002:=200")
+      key = (DZ, DX, DY)
+      central000 = self.CC000[key]
+      central200 = int(4*self.CC020[key])
+      central020 = int(4*self.CC002[key])
+      central002 = int(4*self.CC200[key])
+    else: # DZ>=DY and DY>=DX
+      #print("  key zyx,  200:=002 e 002:=200")
+      key = (DZ, DY, DX)
+      central000 = self.CC000[key]
+      central200 = int(4*self.CC002[key])
+      central020 = int(4*self.CC020[key])
+      central002 = int(4*self.CC200[key])
+    return central000, central200, central020, central002
+
+  def segmentCentral(self, shape):
+    """
+    Return the central moments mu_000, 4*mu_200, 4*mu_020, 4*mu_002
+    of a block of DX x DY x DZ voxels, from the central moments
+    of segments (level 3).
+    """
+    DX, DY, DZ = shape
+    CC2 = self.CC2
+    return DX*DY*DZ, DY*DZ*CC2[DX], DX*DZ*CC2[DY], DX*DY*CC2[DZ]
+
+  def separableMoments(self, ibr):
+    """
+    Compute all moments m_{p,q,r} for p,q,r>=0 and p+q+r<=3
+    of a 3D image given as a set of blocks, with the
+    central moments of segments (optimization level 3).
+    """
+    self.setCounters(ibr.size(), 0)
+    N = doubledMoments(zip(*ibr.columns()), self.segmentCentral)
+    return scaleDoubled({key:0 for key in orders}, N)
+
+  def lazyMoments(self, ibr):
+    """
+    Compute all moments m_{p,q,r} for p,q,r>=0 and p+q+r<=3
+    of a 3D image given as a set of blocks, with the
+    central moments taken from the cache (optimization level 4).
+    """
+    self.setCounters(ibr.size(), 0)
+    N = doubledMoments(zip(*ibr.columns()), self.cache.get)
+    return scaleDoubled({key:0 for key in orders}, N)
+
+  # da chiamare subito dopo blockMoments
+  def stampaGestione(self):
+    print("N. Blocks processed with new and with traditional way",*self.counters())
+    if self.level==4: self.cache.statistiche()
+    if self.tuned: print("Autotuned plan:",self.tuned)
+
+# engine used by the functions of the module
+ENGINE = BW_BlockEngine3D()
+
+def setOptimizationLevel(level):
+  ENGINE.setOptimizationLevel(level)
+
+def setLimits(limit_y, limit_z):
+  ENGINE.setLimits(limit_y, limit_z)
+
+def preprocessing(ibr, wanted=None):
+  ENGINE.preprocessing(ibr, wanted)
+
+def preprocessing_once(max_side=None):
+  ENGINE.preprocessing_once(max_side)
+
+def blockMoments(ibr, wanted=None):
+  """
+  Compute all moments m_{p,q,r} for p,q,r>=0 and p+q+r<=3
+  of a 3D image given as a set of blocks,
+  or only the wanted ones (see wantedMoments), also of
+  order above 3, with the engine of the module.
+  """
+  return ENGINE.blockMoments(ibr, wanted)
+
+def wantedMoments(ibr, wanted, table=None):
+  """
+  Compute the wanted moments (see wantedOrders in commons3D.py)
+  of a 3D image given as a set of blocks, with integers only,
+  along the columns of the blocks, computing only the sums of
+  powers needed by the wanted orders (see sideTerms in powersums.py).
+  table is the list of C(D) (see setCentralMomentsInt), or None
+  to compute them.
+  """
+  wanted = wantedOrders(wanted)
+  x0, y0, z0, x1, y1, z1 = ibr.columns()
+  terms = []
+  for (c0,c1),top in zip(((x0,x1),(y0,y1),(z0,z1)), maxPowers(wanted)):
+     D = [dc+1 for dc in map(sub, c1, c0)]
+     X = list(map(add, c0, c1)) if top>0 else None
+     terms.append(sideTerms(D, X, top, table))
+  return wantedSums(terms, wanted)
+
+def blockMomentsGrouped(ibr, wanted=None):
+  """
+  Compute all moments m_{p,q,r} for p,q,r>=0 and p+q+r<=3
+  of a 3D image given as a set of blocks, grouping
+  blocks with the same shape
+  (only the wanted orders, if given).
+  """
+  # for each shape, doubled barycenters of the blocks
+  groups = dict()
+  x0, y0, z0, x1, y1, z1 = ibr.columns()
+  keys = zip(map(sub, x1, x0), map(sub, y1, y0), map(sub, z1, z0))
+  for key, X, Y, Z in zip(keys, map(add, x0, x1), map(add, y0, y1), map(add, z0, z1)):
+     G = groups.get(key)
+     if G is None:
+        G = groups[key] = ([],[],[])
+     G[0].append(X)
+     G[1].append(Y)
+     G[2].append(Z)
+  # shape is the number of voxels along x, y and z
+  return shapeMoments(dict([((dx+1,dy+1,dz+1),G) for (dx,dy,dz),G in groups.items()]), wantedOrders(wanted))
+
+def blockMomentsExact(ibr, wanted=None):
+  """
+  Compute all moments m_{p,q,r} for p,q,r>=0 and p+q+r<=3
+  of a 3D image given as a set of blocks, with integers only.
+  For a side of D voxels with doubled barycenter X, the sum
+  of (2x)^k over its voxels is
+    T_0 = D, T_1 = D*X, T_2 = D*X^2+C, T_3 = D*X^3+3*C*X
+  where C = (D^3-D)/3 = 4*c2(D) is an integer, so the sum of
+  Tx_p*Ty_q*Tz_r over the blocks is 2^(p+q+r)*m_{p,q,r}.
+  Only the wanted orders are computed, if given (see wantedMoments).
+  """
+  if wanted is not None: return wantedMoments(ibr, wanted)
+  N = [0]*20
+  for x0,y0,z0,x1,y1,z1 in zip(*ibr.columns()): # cycle on blocks
+     # x side
+     D = x1-x0+1
+     X = x0+x1
+     C = (D*D*D-D)//3
+     tx1 = D*X
+     tx2 = tx1*X + C
+     tx3 = X*(tx2 + 2*C)
+     # y side
+     E = y1-y0+1
+     Y = y0+y1
+     C = (E*E*E-E)//3
+     ty1 = E*Y
+     ty2 = ty1*Y + C
+     ty3 = Y*(ty2 + 2*C)
+     # z side
+     F = z1-z0+1
+     Z = z0+z1
+     C = (F*F*F-F)//3
+     tz1 = F*Z
+     tz2 = tz1*Z + C
+     tz3 = Z*(tz2 + 2*C)
+     # products of y and z sides
+     t00 = E*F
+     t10 = ty1*F
+     t01 = E*tz1
+     # update doubled image moments, in the order of EXACT_KEYS
+     N[0] += D*t00
+     N[1] += tx1*t00
+     N[2] += D*t10
+     N[3] += D*t01
+     N[4] += tx1*t10
+     N[5] += tx1*t01
+     N[6] += D*ty1*tz1
+     N[7] += tx1*ty1*tz1
+     N[8] += tx2*t00
+     N[9] += D*ty2*F
+     N[10] += D*E*tz2
+     N[11] += tx2*t10
+     N[12] += tx2*t01
+     N[13] += tx1*ty2*F
+     N[14] += D*ty2*tz1
+     N[15] += tx1*E*tz2
+     N[16] += D*ty1*tz2
+     N[17] += tx3*t00
+     N[18] += D*ty3*F
+     N[19] += D*E*tz3
+  # scale back: m_{p,q,r} = n_{p,q,r}/2^(p+q+r)
+  return dict([(key, n>>sum(key)) for key, n in zip(EXACT_KEYS, N)])
+
+# orders of the moments accumulated by blockMomentsExact
+EXACT_KEYS = [(0,0,0), (1,0,0), (0,1,0), (0,0,1), (1,1,0), (1,0,1), (0,1,1),
+  (1,1,1), (2,0,0), (0,2,0), (0,0,2), (2,1,0), (2,0,1), (1,2,0), (0,2,1),
+  (1,0,2), (0,1,2), (3,0,0), (0,3,0), (0,0,3)]
+
+def blockMomentsVec(ibr, wanted=None):
+  """
+  Compute all moments m_{p,q,r} for p,q,r>=0 and p+q+r<=3
+  of a 3D image given as a set of blocks, with NumPy
+  (with blockMomentsExact if NumPy is not available),
+  or only the wanted ones.
+  """
+  if np is None: return blockMomentsExact(ibr, wanted)
+  x0, y0, z0, x1, y1, z1 = [col.astype(np.int64) for col in ibr.arrays()]
+  return vectorMoments([x1-x0+1, y1-y0+1, z1-z0+1], [x0+x1, y0+y1, z0+z1], wantedOrders(wanted))
+
+# da chiamare subito dopo blockMoments
+def stampaGestione():
+   ENGINE.stampaGestione()
+   #print("Blocchi gestiti col nuovo e col vecchio",NUOVO,VECCHIO)
+
+#---------------------MAIN-----------------------
+
+from powersums import shapeMoments, maxPowers, sideTerms, wantedSums
+from kernelgen import blockMomentsKernel
+from shapecache import ShapeCache
+from momentVec import vectorMoments, printModes, np
+from operator import add, sub
+from spiliotis3D import extractBlocks, checkBlocks
+from commons3D import main
 import sys
-
-if __name__ == "__main__":
-   main(sys.argv, extractBlocks, preprocessing, blockMoments, "====3D Blocks, new method.")
-   print("Blocchi gestiti col nuovo e col vecchio",NUOVO,VECCHIO)
+
+if __name__ == "__main__":
+   if sys.argv[-1]=="vec":
+     main(sys.argv[0:-1], extractBlocks, None, blockMomentsVec, "====3D Blocks, new method vectorized.")
+     printModes()
+   elif sys.argv[-1]=="exact":
+     main(sys.argv[0:-1], extractBlocks, None, blockMomentsExact, "====3D Blocks, new method exact.")
+   elif sys.argv[-1]=="grouped":
+     main(sys.argv[0:-1], extractBlocks, None, blockMomentsGrouped, "====3D Blocks, new method grouped by shape.")
+   else:
+     main(sys.argv, extractBlocks, preprocessing, blockMoments, "====3D Blocks, new method.")
+     print("Blocchi gestiti col nuovo e col vecchio",*ENGINE.counters())
    
\ No newline at end of file
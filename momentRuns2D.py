@@ -0,0 +1,203 @@
+"""
+Computation of moments of a 2D image directly on the runs
+of black pixels of its rows, without merging runs into blocks.
+
+The moment m_{p,q} of a run [x0,x1] in row y is
+  (S_p(x1)-S_p(x0-1)) * y^q
+where S_p(n) = 1^p+2^p+...+n^p are the sums of powers stored
+in the PowerMatrix (see bigmatrix.py).
+For each row y, the sums A_p(y) of S_p(x1)-S_p(x0-1) over all
+runs of the row are accumulated for p=0..3, then
+  m_{p,q} = sum over y of A_p(y) * y^q.
+
+Three modes:
+- runs: the runs are extracted and stored (extractRuns),
+  then the moments are computed on them (runMoments)
+- fused: the rows of the bitmap are scanned and the sums A_p
+  are accumulated while finding the runs (scanMoments),
+  the runs are never stored
+- vectorized: as runs, with NumPy on the arrays of the runs,
+  taking S_p(x1) and S_p(x0-1) in bulk from the PowerMatrix
+  (runMomentsVec)
+The moments functions are methods of an object of class
+BW_RunEngine2D, which keeps the PowerMatrix built by its
+preprocessing for the image.
+"""
+
+from array import array
+
+#---------------------RUNS-----------------------
+
+class BW_RunImage2D:
+  """
+  The image is represented as the list of runs of black pixels
+  of its rows, stored column-wise: the i-th run is the segment
+  [x0[i],x1[i]] in row y[i], and runs are sorted by y, then by x.
+  """
+  def __init__(self):
+    self.y = array("i")
+    self.x0 = array("i")
+    self.x1 = array("i")
+    self.origsize = 0
+
+  def columns(self):
+    """
+    Return the arrays y,x0,x1 (not a copy).
+    """
+    return (self.y, self.x0, self.x1)
+
+  def size(self):
+    return len(self.y)
+
+  def num_elem(self):
+    return len(self.y)
+
+def extractRuns(black_pixels):
+  """
+  Build the representation by runs of a 2D image given as
+  a list of black pixels (or as a bitmap), and return it.
+  """
+  IMG = makeBitmap2D(black_pixels)
+  SX, SY = IMG.max_coords
+  R = BW_RunImage2D()
+  R.origsize = max([SX,SY])
+  for y in range(SY+1):
+    found = IMG.runs(y)
+    R.y.extend([y]*len(found))
+    for x0,x1 in found:
+      R.x0.append(x0)
+      R.x1.append(x1)
+  return R
+
+#---------------------MOMENTS-----------------------
+
+def rowMoments(A0, A1, A2, A3):
+  """
+  Return the moments m_{p,q} from the sums A_p(y) of
+  the rows, given as four lists indexed by y.
+  """
+  # powers y^q of the row coordinates
+  Y1 = range(len(A0))
+  Y2 = [y*y for y in Y1]
+  Y3 = [y*y*y for y in Y1]
+  MM = {key:0 for key in orders}
+  for p, A in enumerate((A0, A1, A2, A3)):
+    MM[(p,0)] = sum(A)
+    if p<=2: MM[(p,1)] = sum(map(mul, A, Y1))
+    if p<=1: MM[(p,2)] = sum(map(mul, A, Y2))
+    if p==0: MM[(p,3)] = sum(map(mul, A, Y3))
+  return MM
+
+def rowSums(rows, starts, values, NR):
+  """
+  Return the list of NR sums A(r), where the values (NumPy array)
+  are grouped in consecutive runs of the same row: rows[i] is
+  the row of the group starting at starts[i].
+  """
+  A = np.zeros(NR, dtype=values.dtype)
+  A[rows] = np.add.reduceat(values, starts)
+  return A.tolist()
+
+def scanImage(black_pixels):
+  """
+  Return the bitmap of the image, which is the only
+  representation needed by scanMoments.
+  """
+  return makeBitmap2D(black_pixels)
+
+class BW_RunEngine2D:
+  """
+  The run methods with their own matrix of the sums of powers:
+  preprocessing builds it for an image, then runMoments,
+  runMomentsVec and scanMoments read it.
+  """
+  def __init__(self):
+    # matrix storing precomputed sums of powers
+    self.powers = None
+
+  def preprocessing(self, image):
+    """
+    Precompute the sums of powers for an image given as
+    runs or as a bitmap.
+    """
+    if hasattr(image, "origsize"): side = image.origsize
+    else: side = max(image.max_coords)
+    self.powers = PowerMatrix( 3, side )
+
+  def runMoments(self, R):
+    """
+    Compute all moments m_{p,q} for p,q>=0 and p+q<=3
+    of a 2D image given as a set of runs.
+    """
+    S1, S2, S3 = self.powers.matrix[1:4]
+    NY = R.y[-1]+1 if R.size()>0 else 0
+    A0, A1, A2, A3 = [0]*NY, [0]*NY, [0]*NY, [0]*NY
+    for y, x0, x1 in zip(*R.columns()):
+      A0[y] += x1-x0+1
+      # S_p(x0-1)=0 if x0==0 (index -1 would give the last element)
+      if x0>0:
+        A1[y] += S1[x1]-S1[x0-1]
+        A2[y] += S2[x1]-S2[x0-1]
+        A3[y] += S3[x1]-S3[x0-1]
+      else:
+        A1[y] += S1[x1]
+        A2[y] += S2[x1]
+        A3[y] += S3[x1]
+    return rowMoments(A0, A1, A2, A3)
+
+  def runMomentsVec(self, R):
+    """
+    Compute all moments m_{p,q} for p,q>=0 and p+q<=3
+    of a 2D image given as a set of runs, with NumPy
+    (with runMoments if NumPy is not available).
+    """
+    if np is None or R.size()==0: return self.runMoments(R)
+    y, x0, x1 = [np.frombuffer(c, dtype=np.intc).astype(np.int64) for c in R.columns()]
+    # first run of each row
+    starts = np.flatnonzero(np.diff(y, prepend=-1))
+    rows = y[starts]
+    NY = int(y[-1])+1
+    A = [rowSums(rows, starts, x1-x0+1, NY)]
+    for p in (1,2,3):
+      A.append(rowSums(rows, starts, self.powers.valueSums(p, x1)-self.powers.valueSums(p, x0-1), NY))
+    return rowMoments(*A)
+
+  def scanMoments(self, IMG):
+    """
+    Compute all moments m_{p,q} for p,q>=0 and p+q<=3
+    of a 2D image given as a bitmap, scanning its rows
+    without storing the runs.
+    """
+    S1, S2, S3 = self.powers.matrix[1:4]
+    SX, SY = IMG.max_coords
+    A0, A1, A2, A3 = [0]*(SY+1), [0]*(SY+1), [0]*(SY+1), [0]*(SY+1)
+    for y in range(SY+1):
+      a0, a1, a2, a3 = 0, 0, 0, 0
+      for x0, x1 in IMG.runs(y):
+        a0 += x1-x0+1
+        a1 += S1[x1]
+        a2 += S2[x1]
+        a3 += S3[x1]
+        if x0>0:
+          a1 -= S1[x0-1]
+          a2 -= S2[x0-1]
+          a3 -= S3[x0-1]
+      A0[y], A1[y], A2[y], A3[y] = a0, a1, a2, a3
+    return rowMoments(A0, A1, A2, A3)
+
+#---------------------MAIN-----------------------
+
+from bigmatrix import PowerMatrix, np
+from bitmap import makeBitmap2D
+from commons2D import main, orders
+from operator import mul
+import sys
+
+if __name__ == "__main__":
+   engine = BW_RunEngine2D()
+   if sys.argv[-1]=="vec":
+     main(sys.argv[0:-1], extractRuns, engine.preprocessing, engine.runMomentsVec, "====2D Runs, vectorized.")
+   elif sys.argv[-1]=="fused":
+     main(sys.argv[0:-1], scanImage, engine.preprocessing, engine.scanMoments, "====2D Runs, fused scan.")
+   else:
+     main(sys.argv, extractRuns, engine.preprocessing, engine.runMoments, "====2D Runs.")
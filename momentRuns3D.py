@@ -0,0 +1,218 @@
+"""
+Computation of moments of a 3D image directly on the runs
+of black voxels of its rows, without merging runs into blocks.
+
+The moment m_{p,q,r} of a run [x0,x1] in row y of slice z is
+  (S_p(x1)-S_p(x0-1)) * y^q * z^r
+where S_p(n) = 1^p+2^p+...+n^p are the sums of powers stored
+in the PowerMatrix (see bigmatrix.py).
+For each row (y,z), the sums A_p(y,z) of S_p(x1)-S_p(x0-1) over
+all runs of the row are accumulated for p=0..3, then
+  m_{p,q,r} = sum over y,z of A_p(y,z) * y^q * z^r.
+
+Three modes:
+- runs: the runs are extracted and stored (extractRuns),
+  then the moments are computed on them (runMoments)
+- fused: the rows of the bitmap are scanned and the sums A_p
+  are accumulated while finding the runs (scanMoments),
+  the runs are never stored
+- vectorized: as runs, with NumPy on the arrays of the runs,
+  taking S_p(x1) and S_p(x0-1) in bulk from the PowerMatrix
+  (runMomentsVec)
+The moments functions are methods of an object of class
+BW_RunEngine3D, which keeps the PowerMatrix built by its
+preprocessing for the image.
+"""
+
+from array import array
+
+#---------------------RUNS-----------------------
+
+class BW_RunImage3D:
+  """
+  The image is represented as the list of runs of black voxels
+  of its rows, stored column-wise: the i-th run is the segment
+  [x0[i],x1[i]] in row y[i] of slice z[i], and runs are sorted
+  by z, then by y, then by x.
+  """
+  def __init__(self):
+    self.z = array("i")
+    self.y = array("i")
+    self.x0 = array("i")
+    self.x1 = array("i")
+    self.origsize = 0
+    # number of rows in each slice
+    self.rows = 0
+
+  def columns(self):
+    """
+    Return the arrays z,y,x0,x1 (not a copy).
+    """
+    return (self.z, self.y, self.x0, self.x1)
+
+  def size(self):
+    return len(self.y)
+
+  def num_elem(self):
+    return len(self.y)
+
+def extractRuns(black_cubes):
+  """
+  Build the representation by runs of a 3D image given as
+  a list of black voxels (or as a bitmap), and return it.
+  """
+  IMG = makeBitmap3D(black_cubes)
+  SX, SY, SZ = IMG.max_coords
+  R = BW_RunImage3D()
+  R.origsize = max([SX,SY,SZ])
+  R.rows = SY+1
+  for z in range(SZ+1):
+    for y in range(SY+1):
+      found = IMG.runs(y,z)
+      R.z.extend([z]*len(found))
+      R.y.extend([y]*len(found))
+      for x0,x1 in found:
+        R.x0.append(x0)
+        R.x1.append(x1)
+  return R
+
+#---------------------MOMENTS-----------------------
+
+def rowMoments(A, NY):
+  """
+  Return the moments m_{p,q,r} from the sums A_p(y,z) of the
+  rows, given as four lists A[p] indexed by z*NY+y.
+  """
+  NR = len(A[0])
+  # powers y^q z^r of the row coordinates
+  Y = [[y**q for z in range(NR//NY) for y in range(NY)] for q in range(4)]
+  Z = [[z**r for z in range(NR//NY) for y in range(NY)] for r in range(4)]
+  MM = {key:0 for key in orders}
+  for p,q,r in orders:
+    if q==0 and r==0: MM[(p,q,r)] = sum(A[p])
+    elif r==0: MM[(p,q,r)] = sum(map(mul, A[p], Y[q]))
+    elif q==0: MM[(p,q,r)] = sum(map(mul, A[p], Z[r]))
+    else: MM[(p,q,r)] = sum(map(mul, map(mul, A[p], Y[q]), Z[r]))
+  return MM
+
+def rowSums(rows, starts, values, NR):
+  """
+  Return the list of NR sums A(i), where the values (NumPy array)
+  are grouped in consecutive runs of the same row: rows[j] is
+  the index z*NY+y of the row of the group starting at starts[j].
+  """
+  A = np.zeros(NR, dtype=values.dtype)
+  A[rows] = np.add.reduceat(values, starts)
+  return A.tolist()
+
+def scanImage(black_cubes):
+  """
+  Return the bitmap of the image, which is the only
+  representation needed by scanMoments.
+  """
+  return makeBitmap3D(black_cubes)
+
+class BW_RunEngine3D:
+  """
+  The run methods with their own matrix of the sums of powers:
+  preprocessing builds it for an image, then runMoments,
+  runMomentsVec and scanMoments read it.
+  """
+  def __init__(self):
+    # matrix storing precomputed sums of powers
+    self.powers = None
+
+  def preprocessing(self, image):
+    """
+    Precompute the sums of powers for an image given as
+    runs or as a bitmap.
+    """
+    if hasattr(image, "origsize"): side = image.origsize
+    else: side = max(image.max_coords)
+    self.powers = PowerMatrix( 3, side )
+
+  def runMoments(self, R):
+    """
+    Compute all moments m_{p,q,r} for p,q,r>=0 and p+q+r<=3
+    of a 3D image given as a set of runs.
+    """
+    S1, S2, S3 = self.powers.matrix[1:4]
+    NY = R.rows
+    NR = (R.z[-1]+1)*NY if R.size()>0 else 0
+    A0, A1, A2, A3 = [0]*NR, [0]*NR, [0]*NR, [0]*NR
+    for z, y, x0, x1 in zip(*R.columns()):
+      i = z*NY+y
+      A0[i] += x1-x0+1
+      # S_p(x0-1)=0 if x0==0 (index -1 would give the last element)
+      if x0>0:
+        A1[i] += S1[x1]-S1[x0-1]
+        A2[i] += S2[x1]-S2[x0-1]
+        A3[i] += S3[x1]-S3[x0-1]
+      else:
+        A1[i] += S1[x1]
+        A2[i] += S2[x1]
+        A3[i] += S3[x1]
+    return rowMoments((A0, A1, A2, A3), max(NY,1))
+
+  def runMomentsVec(self, R):
+    """
+    Compute all moments m_{p,q,r} for p,q,r>=0 and p+q+r<=3
+    of a 3D image given as a set of runs, with NumPy
+    (with runMoments if NumPy is not available).
+    """
+    if np is None or R.size()==0: return self.runMoments(R)
+    z, y, x0, x1 = [np.frombuffer(c, dtype=np.intc).astype(np.int64) for c in R.columns()]
+    NY = R.rows
+    # index of the row of each run, and first run of each row
+    index = z*NY+y
+    starts = np.flatnonzero(np.diff(index, prepend=-1))
+    rows = index[starts]
+    NR = (int(z[-1])+1)*NY
+    A = [rowSums(rows, starts, x1-x0+1, NR)]
+    for p in (1,2,3):
+      A.append(rowSums(rows, starts, self.powers.valueSums(p, x1)-self.powers.valueSums(p, x0-1), NR))
+    return rowMoments(A, max(NY,1))
+
+  def scanMoments(self, IMG):
+    """
+    Compute all moments m_{p,q,r} for p,q,r>=0 and p+q+r<=3
+    of a 3D image given as a bitmap, scanning its rows
+    without storing the runs.
+    """
+    S1, S2, S3 = self.powers.matrix[1:4]
+    SX, SY, SZ = IMG.max_coords
+    NR = (SY+1)*(SZ+1)
+    A0, A1, A2, A3 = [0]*NR, [0]*NR, [0]*NR, [0]*NR
+    i = 0
+    for z in range(SZ+1):
+      for y in range(SY+1):
+        a0, a1, a2, a3 = 0, 0, 0, 0
+        for x0, x1 in IMG.runs(y,z):
+          a0 += x1-x0+1
+          a1 += S1[x1]
+          a2 += S2[x1]
+          a3 += S3[x1]
+          if x0>0:
+            a1 -= S1[x0-1]
+            a2 -= S2[x0-1]
+            a3 -= S3[x0-1]
+        A0[i], A1[i], A2[i], A3[i] = a0, a1, a2, a3
+        i += 1
+    return rowMoments((A0, A1, A2, A3), SY+1)
+
+#---------------------MAIN-----------------------
+
+from bigmatrix import PowerMatrix, np
+from bitmap import makeBitmap3D
+from commons3D import main, orders
+from operator import mul
+import sys
+
+if __name__ == "__main__":
+   engine = BW_RunEngine3D()
+   if sys.argv[-1]=="vec":
+     main(sys.argv[0:-1], extractRuns, engine.preprocessing, engine.runMomentsVec, "====3D Runs, vectorized.")
+   elif sys.argv[-1]=="fused":
+     main(sys.argv[0:-1], scanImage, engine.preprocessing, engine.scanMoments, "====3D Runs, fused scan.")
+   else:
+     main(sys.argv, extractRuns, engine.preprocessing, engine.runMoments, "====3D Runs.")
@@ -1,4 +1,4 @@
-from commons2D import orders
+from commons2D import orders, wantedOrders
 from quadtree import QTR_Tree
 
 def factorG(order, coord, side):
@@ -28,31 +28,33 @@ def prova(xx,yy,lato):
       print("Momento ",p,q,"   = ", mom)
   
 
-def quadtreeMoments(QT):
+def quadtreeMoments(QT, wanted=None):
   """
   Compute moments of order up to 3 from the image,
   that is encoded in the quadtree QT.
+  Only the wanted orders are computed, if given.
   Return a dictionary where key is the pair
   (p,q) and value is the moment m_{p,q}
   """
   # orders is the global variable imported from commons2D
-  MM = {key:0 for key in orders}
-  for node in QT.leaves:
-    node = QT.leaves[node] 
-    if node.color==0: continue
-    x,y = node.xmin, node.ymin
-    L = node.side()
-    for p,q in orders:
+  wanted = wantedOrders(wanted)
+  MM = {key:0 for key in wanted}
+  for x,y,e in QT.black_leaves():
+    L = 2**e
+    for p,q in wanted:
        MM[(p,q)] += int( factorG(p, x, L)*factorG(q, y, L) )
   return MM
 
 
 #-------------------MAIN-------------------
 
-from quadtree import QTR_Tree, buildQuadtree
+from quadtree import QTR_Tree, buildQuadtree, buildLinearQuadtree
 from commons2D import main
 import sys
 
 if __name__ == "__main__":
    #provaPrecalcoli()
-   main(sys.argv, buildQuadtree, None, quadtreeMoments, "====2D Quadtree, old method.")
+   if sys.argv[-1]=="linear":
+     main(sys.argv[0:-1], buildLinearQuadtree, None, quadtreeMoments, "====2D linear quadtree, old method.")
+   else:
+     main(sys.argv, buildQuadtree, None, quadtreeMoments, "====2D Quadtree, old method.")
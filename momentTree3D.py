@@ -1,4 +1,4 @@
-from commons3D import orders
+from commons3D import orders, wantedOrders
 from octree import OCT_Tree
 
 def factorG(order, coord, side):
@@ -29,30 +29,32 @@ def prova(xx,yy,zz,lato):
         print("Momento ",p,q,"   = ", mom)
   
   
-def octreeMoments(OT):
+def octreeMoments(OT, wanted=None):
   """
   Compute moments of order up to 3 from the image,
   that is encoded in the octree OT.
+  Only the wanted orders are computed, if given.
   Return a dictionary where key is the triplet
   (p,q,r) and value is the moment m_{p,q,r}
   """
   # orders is the global variable imported from commons3D
-  MM = {key:0 for key in orders}
-  for node in OT.leaves:
-    node = OT.leaves[node] 
-    if node.color==0: continue
-    x,y,z = node.xmin, node.ymin, node.zmin
-    L = node.side()
-    for p,q,r in orders:
+  wanted = wantedOrders(wanted)
+  MM = {key:0 for key in wanted}
+  for x,y,z,e in OT.black_leaves():
+    L = 2**e
+    for p,q,r in wanted:
        MM[(p,q,r)] += ( factorG(p, x, L)*factorG(q, y, L)*factorG(r, z, L) )
   return MM
 
 
 #-------------------MAIN-------------------
 
-from octree import OCT_Tree, buildOctree
+from octree import OCT_Tree, buildOctree, buildLinearOctree
 from commons3D import main
 import sys
 
 if __name__ == "__main__":
-   main(sys.argv, buildOctree, None, octreeMoments, "====3D Octree, old method.")
+   if sys.argv[-1]=="linear":
+     main(sys.argv[0:-1], buildLinearOctree, None, octreeMoments, "====3D linear octree, old method.")
+   else:
+     main(sys.argv, buildOctree, None, octreeMoments, "====3D Octree, old method.")
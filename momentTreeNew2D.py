@@ -1,4 +1,4 @@
-from commons2D import orders
+from commons2D import orders, wantedOrders
 from quadtree import QTR_Tree
 
 def setCentralMoments(max_side):
@@ -33,68 +33,236 @@ def setCentralMoments(max_side):
     edge *= 2
   return (CentrMom0, CentrMom2)
 
-def preprocessing(QT):
-  global stored0, stored2 
-  stored0, stored2 = setCentralMoments(QT.side)
+class QTR_MomentEngine:
+  """
+  The new quadtree method with its own precomputed tables: central
+  moments of the squares with side a power of two (stored0, stored2)
+  and, for the wanted orders, central sums of the sides (storedU).
+  The tables are written only by preprocessing (or preprocessing_once)
+  and then only read by quadtreeMoments, so one engine can be shared
+  by many threads (see batch.py).
+  """
+  def __init__(self):
+    self.stored0 = self.stored2 = None
+    # central sums of the sides of the leaves, for the wanted orders
+    self.storedU = None
+
+  def preprocessing(self, QT, wanted=None):
+    if wanted is not None:
+      # central sums only up to the max power of the wanted orders
+      self.storedU = treeCentralSums(QT, wantedOrders(wanted, True))
+      return
+    self.stored0, self.stored2 = setCentralMoments(QT.side)
+
+  def preprocessing_once(self, max_side, wanted=None):
+    """
+    Compute the tables for all trees with side up to max_side
+    (rounded up to a power of two).
+    """
+    exponent = 0
+    while 2**exponent<max_side: exponent += 1
+    if wanted is not None:
+      max_order = max([max(order) for order in wantedOrders(wanted, True)])
+      self.storedU = centralSums(max_order, [2**e for e in range(exponent+1)])
+      return
+    self.stored0, self.stored2 = setCentralMoments(2**exponent)
+
+  def quadtreeMoments(self, QT, wanted=None):
+    """
+    [NEW] Compute moments of order up to 3 from the 2D image,
+    that has been encoded in the quadtree QT, exploiting 
+    precomputed central moments.
+    Only the wanted orders are computed, if given (see quadtreeMomentsWanted),
+    also of order above 3.
+    Return a dictionary where key is the pair
+    (p,q) and value is the moment m_{p,q}
+    """
+    if wanted is not None: return quadtreeMomentsWanted(QT, wanted, self.storedU)
+    stored0, stored2 = self.stored0, self.stored2
+    MM = {key:0 for key in orders}
+    for x,y,e in QT.black_leaves():
+      # barycenter, as xcen,ycen in QTR_Node
+      if e>0:
+        delta = 2**(e-1)-0.5
+        x,y = x+delta, y+delta
+      #print("Nodo con baricentro ",x,y, " indice",e)
+      m00 = stored0[e]
+      #assert type(m00) is int #**************
+      m10 = x*m00
+      #assert int(m10)==10
+      m01 = y*m00
+      #assert int(m01)==m01
+      #
+      m11 = y*m10 #x*m01
+      #assert int(m11)==m11
+      m20 = stored2[e] + x*m10
+      #assert int(m20)==m20
+      m02 = stored2[e] + y*m01
+      #assert int(m02)==m02
+      #    
+      m12 = x*m02
+      #assert int(m12)==12
+      m21 = y*m20
+      #assert int(m21)==m21
+      #
+      m30 = 3*x*m20 -2*x*x*m10
+      #assert int(m30)==m30
+      m03 = 3*y*m02 -2*y*y*m01
+      #assert int(m03)==m03
+
+      MM[(0,0)] += m00
+      MM[(1,0)] += int(m10)
+      MM[(0,1)] += int(m01)
+      MM[(1,1)] += int(m11)
+      MM[(2,0)] += int(m20)
+      MM[(0,2)] += int(m02)
+      MM[(1,2)] += int(m12)
+      MM[(2,1)] += int(m21)
+      MM[(3,0)] += int(m30)
+      MM[(0,3)] += int(m03)
+      
+    return MM
 
-    
-def quadtreeMoments(QT):
+# engine used by the functions of the module
+ENGINE = QTR_MomentEngine()
+
+def preprocessing(QT, wanted=None):
+  ENGINE.preprocessing(QT, wanted)
+
+def preprocessing_once(max_side, wanted=None):
+  ENGINE.preprocessing_once(max_side, wanted)
+
+def quadtreeMoments(QT, wanted=None):
+  return ENGINE.quadtreeMoments(QT, wanted)
+
+def quadtreeMomentsWanted(QT, wanted, U=None):
   """
-  [NEW] Compute moments of order up to 3 from the 2D image,
-  that has been encoded in the quadtree QT, exploiting 
-  precomputed central moments.
+  Compute the wanted moments (see wantedOrders in commons2D.py),
+  also of order above 3,
+  from the 2D image, that has been encoded in the quadtree QT (also
+  linear), with integers only, with the kernel generated for the
+  wanted orders (see kernelgen.py), which computes only the terms
+  they need. U are the central sums of the sides of the leaves
+  (see treeCentralSums in kernelgen.py), or None to compute them.
   Return a dictionary where key is the pair
   (p,q) and value is the moment m_{p,q}
   """
-  MM = {key:0 for key in orders}
-  for node in QT.leaves:
-    node = QT.leaves[node] 
-    if node.color==0: continue
-    x,y = node.xcen, node.ycen
-    #s = node.side()
-    #print("Nodo con baricentro ",x,y, " indice",node.exponent)
-    m00 = stored0[node.exponent]
-    #assert type(m00) is int #**************
-    m10 = x*m00
-    #assert int(m10)==10
-    m01 = y*m00
-    #assert int(m01)==m01
-    #
-    m11 = y*m10 #x*m01
-    #assert int(m11)==m11
-    m20 = stored2[node.exponent] + x*m10
-    #assert int(m20)==m20
-    m02 = stored2[node.exponent] + y*m01
-    #assert int(m02)==m02
-    #    
-    m12 = x*m02
-    #assert int(m12)==12
-    m21 = y*m20
-    #assert int(m21)==m21
-    #
-    m30 = 3*x*m20 -2*x*x*m10
-    #assert int(m30)==m30
-    m03 = 3*y*m02 -2*y*y*m01
-    #assert int(m03)==m03
-
-    MM[(0,0)] += m00
-    MM[(1,0)] += int(m10)
-    MM[(0,1)] += int(m01)
-    MM[(1,1)] += int(m11)
-    MM[(2,0)] += int(m20)
-    MM[(0,2)] += int(m02)
-    MM[(1,2)] += int(m12)
-    MM[(2,1)] += int(m21)
-    MM[(3,0)] += int(m30)
-    MM[(0,3)] += int(m03)
-      
-  return MM
+  return treeMomentsKernel(QT, wantedOrders(wanted, True), U)
+
+def quadtreeMomentsExact(QT, wanted=None):
+  """
+  Compute moments of order up to 3 from the 2D image,
+  that has been encoded in the quadtree QT, with integers only.
+  The centers are doubled: X = 2*xmin+L-1 for a leaf of side L,
+  and the sum of (2x)^k over a side is
+    T_0 = L, T_1 = L*X, T_2 = L*X^2+C, T_3 = L*X^3+3*C*X
+  with C = (L^3-L)/3, so the sum of Tx_p*Ty_q over the leaves
+  is 2^(p+q)*m_{p,q}, scaled back once at the end.
+  Only the wanted orders are computed, if given (see quadtreeMomentsWanted).
+  Return a dictionary where key is the pair
+  (p,q) and value is the moment m_{p,q}
+  """
+  if wanted is not None: return quadtreeMomentsWanted(QT, wanted)
+  # side and C of the leaves of each level
+  sides = [(2**e, (8**e-2**e)//3) for e in range(QT.exponent+1)]
+  n00 = n10 = n01 = n11 = n20 = n02 = n30 = n03 = n21 = n12 = 0
+  for x,y,e in QT.black_leaves():
+    L, C = sides[e]
+    X = 2*x+L-1
+    Y = 2*y+L-1
+    tx1 = L*X
+    tx2 = tx1*X + C
+    tx3 = X*(tx2 + 2*C)
+    ty1 = L*Y
+    ty2 = ty1*Y + C
+    ty3 = Y*(ty2 + 2*C)
+    n00 += L*L
+    n10 += tx1*L
+    n01 += L*ty1
+    n11 += tx1*ty1
+    n20 += tx2*L
+    n02 += L*ty2
+    n30 += tx3*L
+    n03 += L*ty3
+    n21 += tx2*ty1
+    n12 += tx1*ty2
+  # scale back: m_{p,q} = n_{p,q}/2^(p+q)
+  return {(0,0):n00, (1,0):n10>>1, (0,1):n01>>1, (1,1):n11>>2,
+          (2,0):n20>>2, (0,2):n02>>2, (3,0):n30>>3, (0,3):n03>>3,
+          (2,1):n21>>3, (1,2):n12>>3}
+
+def quadtreeMomentsVec(QT, wanted=None):
+  """
+  Compute moments of order up to 3 from the 2D image,
+  that has been encoded in the quadtree QT (also linear),
+  with NumPy on the arrays of the sides and doubled centers
+  of the leaves (see momentVec.py), or with quadtreeMomentsExact
+  if NumPy is not available.
+  Only the wanted orders are computed, if given.
+  Return a dictionary where key is the pair
+  (p,q) and value is the moment m_{p,q}
+  """
+  if np is None: return quadtreeMomentsExact(QT, wanted)
+  if hasattr(QT, "levels"): # linear quadtree, leaves already by level
+    levels = [[np.asarray(c, dtype=np.int64) for c in level[1:]] for level in QT.levels]
+    sides = np.concatenate([np.full(len(level[0]), 2**e, dtype=np.int64) for e, level in enumerate(levels)])
+    mins = [np.concatenate([level[a] for level in levels]) for a in range(2)]
+  else:
+    leaves = np.fromiter(chain.from_iterable(QT.black_leaves()), dtype=np.int64).reshape(-1,3)
+    sides = np.left_shift(1, leaves[:,2])
+    mins = [leaves[:,a] for a in range(2)]
+  return vectorMoments([sides]*2, [2*m+sides-1 for m in mins], wantedOrders(wanted))
+
+def quadtreeMomentsLevels(QT, wanted=None):
+  """
+  Compute moments of order up to 3 from the 2D image,
+  that has been encoded in the quadtree QT (also linear),
+  grouping the leaves by level: all leaves with side 2^e
+  have the same central moments, so only the sums of powers
+  of their centers are needed for each level (see powersums.py).
+  The centers are doubled to be integers: 2*xmin+2^e-1.
+  Only the wanted orders are computed, if given.
+  Return a dictionary where key is the pair
+  (p,q) and value is the moment m_{p,q}
+  """
+  groups = dict()
+  if hasattr(QT, "levels"): # linear quadtree, leaves already by level
+    for e in range(len(QT.levels)):
+      codes, xs, ys = QT.levels[e]
+      L = 2**e
+      if np is not None and isinstance(xs, np.ndarray):
+        groups[(L,L)] = (2*xs+(L-1), 2*ys+(L-1))
+      else:
+        groups[(L,L)] = ([2*x+L-1 for x in xs], [2*y+L-1 for y in ys])
+  else:
+    for x,y,e in QT.black_leaves():
+      L = 2**e
+      G = groups.get((L,L))
+      if G is None:
+        G = groups[(L,L)] = ([],[])
+      G[0].append(2*x+L-1)
+      G[1].append(2*y+L-1)
+  return shapeMoments(groups, wantedOrders(wanted))
 
 #-------------------MAIN-------------------
 
-from quadtree import QTR_Tree, buildQuadtree
+from quadtree import QTR_Tree, buildQuadtree, buildLinearQuadtree, np
+from powersums import shapeMoments
+from kernelgen import treeMomentsKernel, treeCentralSums, centralSums
+from momentVec import vectorMoments, printModes
+from itertools import chain
 from commons2D import main
 import sys
 
 if __name__ == "__main__":
-   main(sys.argv, buildQuadtree, preprocessing, quadtreeMoments, "====2D Quadtree, new method.")
+   if sys.argv[-1]=="vec":
+     main(sys.argv[0:-1], buildLinearQuadtree, None, quadtreeMomentsVec, "====2D linear quadtree, vectorized.")
+     printModes()
+   elif sys.argv[-1]=="exact":
+     main(sys.argv[0:-1], buildQuadtree, None, quadtreeMomentsExact, "====2D Quadtree, new method exact.")
+   elif sys.argv[-1]=="levels":
+     main(sys.argv[0:-1], buildLinearQuadtree, preprocessing, quadtreeMomentsLevels, "====2D linear quadtree, by level.")
+   elif sys.argv[-1]=="linear":
+     main(sys.argv[0:-1], buildLinearQuadtree, preprocessing, quadtreeMoments, "====2D linear quadtree, new method.")
+   else:
+     main(sys.argv, buildQuadtree, preprocessing, quadtreeMoments, "====2D Quadtree, new method.")
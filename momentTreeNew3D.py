@@ -1,4 +1,4 @@
-from commons3D import orders
+from commons3D import orders, wantedOrders
 from octree import OCT_Tree
 
 def setCentralMoments(max_side):
@@ -32,83 +32,266 @@ def setCentralMoments(max_side):
       edge *= 2
   return (CentrMom0, CentrMom2)
 
-def preprocessing(QT):
-  global stored0, stored2
-  stored0, stored2 = setCentralMoments(QT.side)
-      
-def octreeMoments(OT):
+class OCT_MomentEngine:
   """
-  Compute moments of order up to 3 from the 3D image,
-  that has been encoded in the octree OT, exploiting
-  precomputed central moments.
-  Return a dictionary where key is the triplet
-  (p,q,r) and value is the moment m_{p,q,r}
+  The new octree method with its own precomputed tables: central
+  moments of the cubes with side a power of two (stored0, stored2)
+  and, for the wanted orders, central sums of the sides (storedU).
+  The tables are written only by preprocessing (or preprocessing_once)
+  and then only read by octreeMoments, so one engine can be shared
+  by many threads (see batch.py).
   """
-  stored0, stored2 = setCentralMoments(OT.side)
-  MM = {key:0 for key in orders}
-  for node in OT.leaves:
-    node = OT.leaves[node] 
-    if node.color==0: continue
-    x,y,z = node.xcen, node.ycen, node.zcen
-    #s = node.side()
-    #print("Nodo con baricentro ",x,y, " indice",node.exponent)
-    m000 = stored0[node.exponent]
-    #
-    m100 = x*m000
-    m010 = y*m000
-    m001 = z*m000
-    #
-    m011 = z*m010
-    m101 = x*m001
-    m110 = y*m100
-
-    m200 = stored2[node.exponent] + x*m100
-    m020 = stored2[node.exponent] + y*m010
-    m002 = stored2[node.exponent] + z*m001
+  def __init__(self):
+    self.stored0 = self.stored2 = None
+    # central sums of the sides of the leaves, for the wanted orders
+    self.storedU = None
+
+  def preprocessing(self, OT, wanted=None):
+    if wanted is not None:
+      # central sums only up to the max power of the wanted orders
+      self.storedU = treeCentralSums(OT, wantedOrders(wanted, True))
+      return
+    self.stored0, self.stored2 = setCentralMoments(OT.side)
+
+  def preprocessing_once(self, max_side, wanted=None):
+    """
+    Compute the tables for all trees with side up to max_side
+    (rounded up to a power of two).
+    """
+    exponent = 0
+    while 2**exponent<max_side: exponent += 1
+    if wanted is not None:
+      max_order = max([max(order) for order in wantedOrders(wanted, True)])
+      self.storedU = centralSums(max_order, [2**e for e in range(exponent+1)])
+      return
+    self.stored0, self.stored2 = setCentralMoments(2**exponent)
+
+  def octreeMoments(self, OT, wanted=None):
+    """
+    Compute moments of order up to 3 from the 3D image,
+    that has been encoded in the octree OT, exploiting
+    precomputed central moments.
+    Only the wanted orders are computed, if given (see octreeMomentsWanted),
+    also of order above 3.
+    Return a dictionary where key is the triplet
+    (p,q,r) and value is the moment m_{p,q,r}
+    """
+    if wanted is not None: return octreeMomentsWanted(OT, wanted, self.storedU)
+    stored0, stored2 = self.stored0, self.stored2
+    if stored0 is None or len(stored0)<=OT.exponent:
+      # not preprocessed for this side
+      stored0, stored2 = setCentralMoments(OT.side)
+    MM = {key:0 for key in orders}
+    for x,y,z,e in OT.black_leaves():
+      # barycenter, as xcen,ycen,zcen in OCT_Node
+      if e>0:
+        delta = 2**(e-1)-0.5
+        x,y,z = x+delta, y+delta, z+delta
+      #print("Nodo con baricentro ",x,y,z, " indice",e)
+      m000 = stored0[e]
+      #
+      m100 = x*m000
+      m010 = y*m000
+      m001 = z*m000
+      #
+      m011 = z*m010
+      m101 = x*m001
+      m110 = y*m100
+
+      m200 = stored2[e] + x*m100
+      m020 = stored2[e] + y*m010
+      m002 = stored2[e] + z*m001
     
-    m021 = z*m020
-    m210 = y*m200
-    m120 = x*m020
-    m102 = x*m002
-    m012 = y*m002
-    m201 = z*m200
-
-    m300 = 3*x*m200 -2*x*x*m100
-    m030 = 3*y*m020 -2*y*y*m010
-    m003 = 3*z*m002 -2*z*z*m001
-
-    m111 = x*m011
-
-    MM[(0,0,0)] += m000
-    MM[(1,0,0)] += m100
-    MM[(0,1,0)] += m010
-    MM[(1,1,0)] += m110
-    MM[(2,0,0)] += m200
-    MM[(0,2,0)] += m020
-    MM[(2,1,0)] += m210
-    MM[(1,2,0)] += m120
-    MM[(3,0,0)] += m300
-    MM[(0,3,0)] += m030
-    MM[(0,0,3)] += m003
+      m021 = z*m020
+      m210 = y*m200
+      m120 = x*m020
+      m102 = x*m002
+      m012 = y*m002
+      m201 = z*m200
+
+      m300 = 3*x*m200 -2*x*x*m100
+      m030 = 3*y*m020 -2*y*y*m010
+      m003 = 3*z*m002 -2*z*z*m001
+
+      m111 = x*m011
+
+      MM[(0,0,0)] += m000
+      MM[(1,0,0)] += m100
+      MM[(0,1,0)] += m010
+      MM[(1,1,0)] += m110
+      MM[(2,0,0)] += m200
+      MM[(0,2,0)] += m020
+      MM[(2,1,0)] += m210
+      MM[(1,2,0)] += m120
+      MM[(3,0,0)] += m300
+      MM[(0,3,0)] += m030
+      MM[(0,0,3)] += m003
     
-    MM[(0,0,1)] += m001
-    MM[(1,0,1)] += m101
-    MM[(0,1,1)] += m011
-    MM[(1,1,1)] += m111
-    MM[(2,0,1)] += m201
-    MM[(0,2,1)] += m021
+      MM[(0,0,1)] += m001
+      MM[(1,0,1)] += m101
+      MM[(0,1,1)] += m011
+      MM[(1,1,1)] += m111
+      MM[(2,0,1)] += m201
+      MM[(0,2,1)] += m021
     
-    MM[(0,0,2)] += m002
-    MM[(1,0,2)] += m102
-    MM[(0,1,2)] += m012
+      MM[(0,0,2)] += m002
+      MM[(1,0,2)] += m102
+      MM[(0,1,2)] += m012
 
-  return MM
+    return MM
+
+# engine used by the functions of the module
+ENGINE = OCT_MomentEngine()
+
+def preprocessing(OT, wanted=None):
+  ENGINE.preprocessing(OT, wanted)
+
+def preprocessing_once(max_side, wanted=None):
+  ENGINE.preprocessing_once(max_side, wanted)
+
+def octreeMoments(OT, wanted=None):
+  return ENGINE.octreeMoments(OT, wanted)
+
+def octreeMomentsWanted(OT, wanted, U=None):
+  """
+  Compute the wanted moments (see wantedOrders in commons3D.py),
+  also of order above 3,
+  from the 3D image, that has been encoded in the octree OT (also
+  linear), with integers only, with the kernel generated for the
+  wanted orders (see kernelgen.py), which computes only the terms
+  they need. U are the central sums of the sides of the leaves
+  (see treeCentralSums in kernelgen.py), or None to compute them.
+  Return a dictionary where key is the triplet
+  (p,q,r) and value is the moment m_{p,q,r}
+  """
+  return treeMomentsKernel(OT, wantedOrders(wanted, True), U)
+
+def octreeMomentsExact(OT, wanted=None):
+  """
+  Compute moments of order up to 3 from the 3D image,
+  that has been encoded in the octree OT, with integers only.
+  The centers are doubled: X = 2*xmin+L-1 for a leaf of side L,
+  and the sum of (2x)^k over a side is
+    T_0 = L, T_1 = L*X, T_2 = L*X^2+C, T_3 = L*X^3+3*C*X
+  with C = (L^3-L)/3, so the sum of Tx_p*Ty_q*Tz_r over the
+  leaves is 2^(p+q+r)*m_{p,q,r}, scaled back once at the end.
+  Only the wanted orders are computed, if given (see octreeMomentsWanted).
+  Return a dictionary where key is the triplet
+  (p,q,r) and value is the moment m_{p,q,r}
+  """
+  if wanted is not None: return octreeMomentsWanted(OT, wanted)
+  # side, side^2 and C of the leaves of each level
+  sides = [(2**e, 4**e, (8**e-2**e)//3) for e in range(OT.exponent+1)]
+  N = [0]*20
+  for x,y,z,e in OT.black_leaves():
+    L, L2, C = sides[e]
+    X = 2*x+L-1
+    Y = 2*y+L-1
+    Z = 2*z+L-1
+    tx1 = L*X
+    tx2 = tx1*X + C
+    ty1 = L*Y
+    ty2 = ty1*Y + C
+    tz1 = L*Z
+    tz2 = tz1*Z + C
+    # update doubled image moments, in the order of EXACT_KEYS
+    N[0] += L*L2
+    N[1] += tx1*L2
+    N[2] += ty1*L2
+    N[3] += tz1*L2
+    N[4] += tx1*ty1*L
+    N[5] += tx1*tz1*L
+    N[6] += ty1*tz1*L
+    N[7] += tx1*ty1*tz1
+    N[8] += tx2*L2
+    N[9] += ty2*L2
+    N[10] += tz2*L2
+    N[11] += tx2*ty1*L
+    N[12] += tx2*tz1*L
+    N[13] += tx1*ty2*L
+    N[14] += ty2*tz1*L
+    N[15] += tx1*tz2*L
+    N[16] += ty1*tz2*L
+    N[17] += X*(tx2 + 2*C)*L2
+    N[18] += Y*(ty2 + 2*C)*L2
+    N[19] += Z*(tz2 + 2*C)*L2
+  # scale back: m_{p,q,r} = n_{p,q,r}/2^(p+q+r)
+  return dict([(key, n>>sum(key)) for key, n in zip(EXACT_KEYS, N)])
+
+def octreeMomentsVec(OT, wanted=None):
+  """
+  Compute moments of order up to 3 from the 3D image,
+  that has been encoded in the octree OT (also linear),
+  with NumPy on the arrays of the sides and doubled centers
+  of the leaves (see momentVec.py), or with octreeMomentsExact
+  if NumPy is not available.
+  Only the wanted orders are computed, if given.
+  Return a dictionary where key is the triplet
+  (p,q,r) and value is the moment m_{p,q,r}
+  """
+  if np is None: return octreeMomentsExact(OT, wanted)
+  if hasattr(OT, "levels"): # linear octree, leaves already by level
+    levels = [[np.asarray(c, dtype=np.int64) for c in level[1:]] for level in OT.levels]
+    sides = np.concatenate([np.full(len(level[0]), 2**e, dtype=np.int64) for e, level in enumerate(levels)])
+    mins = [np.concatenate([level[a] for level in levels]) for a in range(3)]
+  else:
+    leaves = np.fromiter(chain.from_iterable(OT.black_leaves()), dtype=np.int64).reshape(-1,4)
+    sides = np.left_shift(1, leaves[:,3])
+    mins = [leaves[:,a] for a in range(3)]
+  return vectorMoments([sides]*3, [2*m+sides-1 for m in mins], wantedOrders(wanted))
+
+def octreeMomentsLevels(OT, wanted=None):
+  """
+  Compute moments of order up to 3 from the 3D image,
+  that has been encoded in the octree OT (also linear),
+  grouping the leaves by level: all leaves with side 2^e
+  have the same central moments, so only the sums of powers
+  of their centers are needed for each level (see powersums.py).
+  The centers are doubled to be integers: 2*xmin+2^e-1.
+  Only the wanted orders are computed, if given.
+  Return a dictionary where key is the triplet
+  (p,q,r) and value is the moment m_{p,q,r}
+  """
+  groups = dict()
+  if hasattr(OT, "levels"): # linear octree, leaves already by level
+    for e in range(len(OT.levels)):
+      codes, xs, ys, zs = OT.levels[e]
+      L = 2**e
+      if np is not None and isinstance(xs, np.ndarray):
+        groups[(L,L,L)] = (2*xs+(L-1), 2*ys+(L-1), 2*zs+(L-1))
+      else:
+        groups[(L,L,L)] = ([2*x+L-1 for x in xs], [2*y+L-1 for y in ys], [2*z+L-1 for z in zs])
+  else:
+    for x,y,z,e in OT.black_leaves():
+      L = 2**e
+      G = groups.get((L,L,L))
+      if G is None:
+        G = groups[(L,L,L)] = ([],[],[])
+      G[0].append(2*x+L-1)
+      G[1].append(2*y+L-1)
+      G[2].append(2*z+L-1)
+  return shapeMoments(groups, wantedOrders(wanted))
 
 #-------------------MAIN-------------------
 
-from octree import OCT_Tree, buildOctree
+from octree import OCT_Tree, buildOctree, buildLinearOctree, np
+from powersums import shapeMoments
+from kernelgen import treeMomentsKernel, treeCentralSums, centralSums
+from momentVec import vectorMoments, printModes
+from itertools import chain
+from momentBlockNew3D import EXACT_KEYS
 from commons3D import main
 import sys
 
 if __name__ == "__main__":
-   main(sys.argv, buildOctree, preprocessing, octreeMoments, "====3D Octree, new method.")
+   if sys.argv[-1]=="vec":
+     main(sys.argv[0:-1], buildLinearOctree, None, octreeMomentsVec, "====3D linear octree, vectorized.")
+     printModes()
+   elif sys.argv[-1]=="exact":
+     main(sys.argv[0:-1], buildOctree, None, octreeMomentsExact, "====3D Octree, new method exact.")
+   elif sys.argv[-1]=="levels":
+     main(sys.argv[0:-1], buildLinearOctree, preprocessing, octreeMomentsLevels, "====3D linear octree, by level.")
+   elif sys.argv[-1]=="linear":
+     main(sys.argv[0:-1], buildLinearOctree, preprocessing, octreeMoments, "====3D linear octree, new method.")
+   else:
+     main(sys.argv, buildOctree, preprocessing, octreeMoments, "====3D Octree, new method.")
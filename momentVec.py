@@ -0,0 +1,167 @@
+"""
+Vectorized computation of moments with NumPy, for blocks
+(rectangles or cuboids) and for the leaves of quadtrees and
+octrees, which are given as arrays of sides and doubled
+barycenters along each axis.
+
+As in the exact engines (see blockMomentsExact in
+momentBlockNew2D.py), for a side of D pixels with doubled
+barycenter X the sum of (2x)^k over its pixels is
+  T_0 = D, T_1 = D*X, T_2 = D*X^2+C, T_3 = D*X^3+3*C*X
+with C = (D^3-D)/3, and 2^(p+q+r)*m_{p,q,r} is the sum over the
+blocks of Tx_p*Ty_q*Tz_r.
+
+Moments of order 3 of large images overflow 64 bit integers,
+so for each order the magnitude of the sum is bounded first,
+from the bounding box of the blocks and their total number of
+pixels, after translating the bounding box to the origin,
+and the sum is computed:
+- int64: with 64 bit integers, if the sum cannot overflow
+- split: with 64 bit integers, if the terms of the single blocks
+  cannot overflow, splitting each term in its high and low
+  32 bits, which are summed separately
+- object: with Python integers
+The mode chosen for each order of the last computation is
+stored in LAST_MODES (with all the lower orders, which are needed
+to translate the moments back).
+"""
+
+from itertools import product
+from math import comb
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+# bound on the magnitudes computed with 64 bit integers,
+# leaving some room for the intermediate values
+LIMIT = 2**60
+# max number of blocks for the split mode: the sums of the
+# high and low 32 bits of the terms must not overflow
+SPLIT_MAX = 2**30
+LOW_MASK = 2**32-1
+
+# order -> mode used in the last call to vectorMoments
+LAST_MODES = dict()
+
+def sideSums(D, X, top=3):
+  """
+  Return the list of the arrays T_0..T_top for the sides D
+  and doubled barycenters X (arrays of the same type).
+  """
+  if top==0: return [D]
+  T1 = D*X
+  if top==1: return [D, T1]
+  C = (D*D*D-D)//3
+  T2 = T1*X + C
+  if top==2: return [D, T1, T2]
+  T3 = X*(T2 + 2*C)
+  return [D, T1, T2, T3]
+
+def splitSum(terms):
+  """
+  Return the sum of an array of int64 as a Python integer,
+  summing separately the high and the low 32 bits of the terms.
+  """
+  high = int((terms >> 32).sum())
+  low = int((terms & LOW_MASK).sum())
+  return (high << 32) + low
+
+def lowerOrders(orders):
+  """
+  Return the sorted list of all orders (i,j,...) with each
+  index not greater than the one of some of the given orders.
+  """
+  result = set()
+  for order in orders:
+    result.update(product(*[range(k+1) for k in order]))
+  return sorted(result)
+
+def translatedSums(sides, centers, orders):
+  """
+  Return a dictionary with key the order and value the sum
+  over the blocks of the products of T_k, computed with 64 bit
+  integers as long as they cannot overflow, and record the
+  mode used for each order in LAST_MODES.
+  """
+  # bound of |2x| (plus one) over all pixels along each axis
+  R = [int(abs(X).max()) + int(D.max()) for D,X in zip(sides, centers)]
+  volumes = sides[0]
+  for D in sides[1:]: volumes = volumes*D
+  total = int(volumes.sum())
+  largest = int(volumes.max())
+  # sums T_k along each axis with 64 bit integers, for the
+  # orders k that fit (T_3 has an intermediate value up to 2*D*R^3)
+  # and are needed
+  needed = [max([order[a] for order in orders]) for a in range(len(sides))]
+  sums64 = []
+  for D,X,r,k in zip(sides, centers, R, needed):
+    top = 0
+    while top<k and 2*int(D.max())*r**(top+1) < LIMIT: top += 1
+    sums64.append(sideSums(D, X, top))
+  sumsObj = [None]*len(sides)
+  N = dict()
+  for order in orders:
+    bound = 2
+    for k,r in zip(order, R): bound *= r**k
+    fits = all([k<len(T) for k,T in zip(order, sums64)])
+    if fits and bound*total < LIMIT:
+      mode = "int64"
+    elif fits and bound*largest < LIMIT and len(volumes)<=SPLIT_MAX:
+      mode = "split"
+    else:
+      mode = "object"
+    if mode=="object":
+      for a in range(len(sides)):
+        if sumsObj[a] is None:
+          sumsObj[a] = sideSums(sides[a].astype(object), centers[a].astype(object), needed[a])
+      factors = [sumsObj[a][k] for a,k in enumerate(order)]
+    else:
+      factors = [sums64[a][k] for a,k in enumerate(order)]
+    terms = factors[0]
+    for F in factors[1:]: terms = terms*F
+    if mode=="split": N[order] = splitSum(terms)
+    else: N[order] = int(terms.sum())
+    LAST_MODES[order] = mode
+  return N
+
+def vectorMoments(sides, centers, orders):
+  """
+  Return the moments (a dictionary with key the order)
+  of the blocks whose sides and doubled barycenters along
+  each axis are the arrays in the lists sides and centers.
+  The blocks are translated so that the bounding box starts
+  at the origin, and the moments are translated back at the end
+  with Python integers, so that a large offset of the coordinates
+  does not increase the magnitudes computed with NumPy.
+  """
+  LAST_MODES.clear()
+  if len(sides[0])==0:
+    return {key:0 for key in orders}
+  sides = [D.astype(np.int64) for D in sides]
+  centers = [X.astype(np.int64) for X in centers]
+  # doubled min corner of the bounding box
+  shifts = [int((X-D).min())+1 for D,X in zip(sides, centers)]
+  centers = [X-s for X,s in zip(centers, shifts)]
+  N = translatedSums(sides, centers, lowerOrders(orders))
+  MM = dict()
+  for order in orders:
+    # binomial expansion of the sums of (2x'+s)^k
+    n = 0
+    for lower in product(*[range(k+1) for k in order]):
+      coeff = N[lower]
+      for k,i,s in zip(order, lower, shifts):
+        coeff *= comb(k,i) * s**(k-i)
+      n += coeff
+    MM[order] = n >> sum(order)
+  return MM
+
+def printModes():
+  """
+  Print the orders computed in each mode by the last call
+  to vectorMoments.
+  """
+  for mode in ("int64", "split", "object"):
+    keys = [key for key in sorted(LAST_MODES) if LAST_MODES[key]==mode]
+    print("  %-6s %d orders %s" % (mode, len(keys), keys))
@@ -191,6 +191,15 @@ class OCT_Tree:
     black_leaves = [C for C in self.leaves if self.leaves[C].color==1]
     return len(black_leaves)
 
+  def black_leaves(self):
+    """
+    Iterate on the black leaves of this octree, as
+    quadruples (xmin,ymin,zmin,exponent) where (xmin,ymin,zmin)
+    is the voxel of minimum coordinates and 2^exponent is the side.
+    """
+    for node in self.leaves.values():
+      if node.color==1: yield (node.xmin, node.ymin, node.zmin, node.exponent)
+
 def stampa(Q):
   print("Dimensioni ",Q.x_side, Q.y_side,Q.z_side)
   print("Esponente ",Q.exponent)
@@ -330,16 +339,412 @@ def Funziona_ma_lento_octreeBuild(SX,SY,SZ, black_pixels=[]):
       if C[-1]==0: candid.append(parent(C))
   return Q
 
+from coordfile import maxCoordinates
 
 def buildOctree(black_cubes):
   """
   Build and return the octree for the 3D image 
   given as list of black cubes.
   """
-  maxX = 1+max([c[0] for c in black_cubes])
-  maxY = 1+max([c[1] for c in black_cubes])
-  maxZ = 1+max([c[2] for c in black_cubes])
-  return octreeBuild(maxX, maxY, maxZ, black_cubes)
+  maxX, maxY, maxZ = maxCoordinates(black_cubes, 3)
+  return octreeBuild(maxX+1, maxY+1, maxZ+1, black_cubes)
+
+#---------------------LINEAR OCTREE-----------------------
+
+"""
+In a linear octree the leaves are stored as integers: the Morton
+code of a voxel (x,y,z) is obtained by interleaving the bits of
+x, y and z, bit i of z going to bit 3i+2, bit i of x to bit 3i+1
+and bit i of y to bit 3i. Its digits in base 8 are the digits of
+the location code of the voxel (as in code_for_pixel).
+A node with side 2^e is identified by its level e and by the Morton
+code of its voxel of minimum coordinates, whose lowest 3e bits are 0.
+The eight children of a node have consecutive Morton codes,
+therefore they can be found and merged level by level on the
+sorted array of codes.
+"""
+
+# NumPy is optional: without it, codes are computed with
+# a lookup table and levels are merged with a Python loop
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+# SPREAD[b] = the 8 bits of b moved to the positions 0,3,...,21
+SPREAD = [sum([((b>>i)&1)<<(3*i) for i in range(8)]) for b in range(256)]
+
+def mortonCode(x, y, z):
+  """
+  Return the Morton code of the voxel (x,y,z).
+  """
+  code = 0
+  shift = 0
+  while x or y or z:
+    code |= ((SPREAD[z&255]<<2)|(SPREAD[x&255]<<1)|SPREAD[y&255])<<shift
+    x >>= 8
+    y >>= 8
+    z >>= 8
+    shift += 24
+  return code
+
+def spreadBits(v):
+  """
+  Move the bits of the integers in the NumPy array v
+  (less than 2^21) to the positions multiple of 3.
+  """
+  v = v.astype(np.uint64)
+  v = (v | (v<<32)) & 0x001F00000000FFFF
+  v = (v | (v<<16)) & 0x001F0000FF0000FF
+  v = (v | (v<<8)) & 0x100F00F00F00F00F
+  v = (v | (v<<4)) & 0x10C30C30C30C30C3
+  v = (v | (v<<2)) & 0x1249249249249249
+  return v
+
+def mortonArrays(black_cubes):
+  """
+  Return four NumPy arrays with the Morton codes and the
+  x,y,z coordinates of the black voxels (a list of triplets,
+  a bitmap or a BinaryImage), sorted by Morton code,
+  without repetitions.
+  """
+  if hasattr(black_cubes, "column"):
+    xs = np.asarray(black_cubes.column(0), dtype=np.int64)
+    ys = np.asarray(black_cubes.column(1), dtype=np.int64)
+    zs = np.asarray(black_cubes.column(2), dtype=np.int64)
+  else:
+    coords = np.fromiter(chain.from_iterable(black_cubes), dtype=np.int64).reshape(-1,3)
+    xs, ys, zs = coords[:,0], coords[:,1], coords[:,2]
+  codes = (spreadBits(zs)<<2) | (spreadBits(xs)<<1) | spreadBits(ys)
+  codes, first = np.unique(codes, return_index=True)
+  return codes, xs[first], ys[first], zs[first]
+
+def mortonLists(black_cubes):
+  """
+  Return four lists with the Morton codes and the x,y,z
+  coordinates of the black voxels, sorted by Morton code,
+  without repetitions (version without NumPy).
+  """
+  found = sorted(set([(mortonCode(x,y,z),x,y,z) for x,y,z in black_cubes]))
+  if len(found)==0: return [],[],[],[]
+  return [list(col) for col in zip(*found)]
+
+class OCT_LinearTree:
+  """
+  An object of this class is a linear octree representing
+  an image: only the black leaves are stored.
+  It stores the same information as OCT_Tree about the sides
+  of the image and of the octree domain, and
+  - levels: list indexed by the exponent e, levels[e] is the
+    quadruple (codes,xs,ys,zs) of the Morton codes and of the
+    minimum coordinates of the black leaves with side 2^e,
+    sorted by Morton code (lists, or NumPy arrays).
+  """
+  def __init__(self, SX = 1, SY = 1, SZ = 1):
+    self.x_side = SX
+    self.y_side = SY
+    self.z_side = SZ
+    self.exponent = power_of_two(self.x_side, self.y_side, self.z_side)
+    self.side = 2**self.exponent
+    self.levels = [([],[],[],[]) for e in range(self.exponent+1)]
+
+  def location_code(self, code, e):
+    """
+    Return the location code (as in OCT_Tree) of the node with
+    given Morton code at level e.
+    """
+    return tuple([(code>>(3*i))&7 for i in range(self.exponent-1,e-1,-1)])
+
+  def num_elem(self):
+    """
+    Return the number of black leaves of this octree.
+    """
+    return sum([len(level[0]) for level in self.levels])
+
+  def black_leaves(self):
+    """
+    Iterate on the black leaves of this octree, as
+    quadruples (xmin,ymin,zmin,exponent), level by level.
+    """
+    for e in range(len(self.levels)):
+      codes, xs, ys, zs = self.levels[e]
+      if np is not None and isinstance(xs, np.ndarray):
+        xs, ys, zs = xs.tolist(), ys.tolist(), zs.tolist()
+      for x,y,z in zip(xs,ys,zs):
+        yield (x,y,z,e)
+
+def mergeLevelArrays(codes, xs, ys, zs, shift):
+  """
+  Find the groups of eight sibling leaves in the sorted NumPy
+  array of Morton codes, where siblings have equal codes after
+  removing the lowest shift bits.
+  Return the arrays of the leaves which are not merged, and the
+  arrays of the merged parents.
+  """
+  parents = codes>>shift
+  # eight distinct codes with the same parent are all its children
+  first = np.nonzero(parents[:-7]==parents[7:])[0]
+  merged = np.zeros(len(codes), dtype=bool)
+  for i in range(8): merged[first+i] = True
+  kept = ~merged
+  return (codes[kept], xs[kept], ys[kept], zs[kept]), \
+         (codes[first], xs[first], ys[first], zs[first])
+
+def mergeLevelLists(codes, xs, ys, zs, shift):
+  """
+  Same as mergeLevelArrays, on lists (version without NumPy).
+  """
+  kept = ([],[],[],[])
+  up = ([],[],[],[])
+  i, n = 0, len(codes)
+  while i<n:
+    c = codes[i]
+    if i+7<n and (codes[i+7]>>shift)==(c>>shift):
+      target = up
+      step = 8
+    else:
+      target = kept
+      step = 1
+    target[0].append(c)
+    target[1].append(xs[i])
+    target[2].append(ys[i])
+    target[3].append(zs[i])
+    i += step
+  return kept, up
+
+def linearOctreeBuild(SX, SY, SZ, black_cubes=[]):
+  """
+  Build the linear octree for the given 3D image which covers
+  the cube [0,SX-1] x [0,SY-1] x [0,SZ-1] and whose black voxels
+  are contained in black_cubes, the other voxels are white.
+  The Morton codes of all voxels are computed at once and sorted,
+  then sibling leaves are merged level by level, from the voxels
+  up to the root.
+  """
+  Q = OCT_LinearTree(SX, SY, SZ)
+  if np is not None:
+    current = mortonArrays(black_cubes)
+    mergeLevel = mergeLevelArrays
+  else:
+    current = mortonLists(black_cubes)
+    mergeLevel = mergeLevelLists
+  for e in range(Q.exponent):
+    if len(current[0])<8:
+      Q.levels[e] = current
+      return Q
+    Q.levels[e], current = mergeLevel(*current, 3*(e+1))
+  Q.levels[Q.exponent] = current
+  return Q
+
+def buildLinearOctree(black_cubes):
+  """
+  Build and return the linear octree for the 3D image 
+  given as list of black cubes.
+  """
+  maxX, maxY, maxZ = maxCoordinates(black_cubes, 3)
+  return linearOctreeBuild(maxX+1, maxY+1, maxZ+1, black_cubes)
+
+def checkLinear(QT, black_cubes, buildF=None):
+  """
+  Check that the linear octree of the image, built by
+  buildF (by default buildLinearOctree), has the
+  same black leaves as the octree QT.
+  """
+  LT = (buildF or buildLinearOctree)(black_cubes)
+  first = set([C for C in QT.leaves if QT.leaves[C].color==1])
+  second = set()
+  for e in range(len(LT.levels)):
+    second.update([LT.location_code(c,e) for c in LT.levels[e][0]])
+  if first==second and sorted(QT.black_leaves())==sorted(LT.black_leaves()):
+    print("TUTTO VA BENE")
+  else:
+    print("ERRORE: the linear octree is different")
+    sys.exit(1)
+
+#---------------------STREAMING LINEAR OCTREE-----------------------
+
+def mortonSort(black_cubes):
+  """
+  Return the list of the black voxels sorted in Morton order,
+  to be given to streamOctreeBuild.
+  """
+  if np is not None:
+    codes, xs, ys, zs = mortonArrays(black_cubes)
+    return list(zip(xs.tolist(), ys.tolist(), zs.tolist()))
+  return sorted(black_cubes, key=lambda c: mortonCode(*c))
+
+def streamLeaves(ordered_cubes, E):
+  """
+  Consume the black voxels of an image, given in Morton order,
+  and yield the black leaves of its octree with side 2^E,
+  as quintuples (code,xmin,ymin,zmin,exponent).
+  In one pass, keep for each level e a list pending[e] of at most
+  seven nodes which are children of the same parent: an eighth one
+  completes the parent, which is passed to the next level;
+  a node with a different parent makes them final leaves.
+  """
+  pending = [[] for e in range(E+1)]
+  last = -1
+  for x,y,z in ordered_cubes:
+    c = mortonCode(x,y,z)
+    if c==last: continue # repeated voxel
+    assert c>last, "voxels are not in Morton order"
+    last = c
+    # the nodes waiting for a parent different from the one of c
+    # cannot be completed any more; if the parent at level e is
+    # the same, it is the same at all higher levels too
+    for e in range(E):
+      P = pending[e]
+      if len(P)==0: continue
+      if (P[0][0]>>(3*e+3))==(c>>(3*e+3)): break
+      for node in P: yield node+(e,)
+      P.clear()
+    node = (c,x,y,z)
+    e = 0
+    while e<E:
+      P = pending[e]
+      P.append(node)
+      if len(P)<8: break
+      node = P[0]
+      P.clear()
+      e += 1
+    if e==E: pending[E].append(node) # the root
+  for e in range(E+1):
+    for node in pending[e]: yield node+(e,)
+
+def streamOctreeBuild(SX, SY, SZ, ordered_cubes):
+  """
+  Build the linear octree for the given 3D image which covers
+  the cube [0,SX-1] x [0,SY-1] x [0,SZ-1], whose black voxels are
+  given in Morton order (a list, or any iterable), with streamLeaves.
+  """
+  Q = OCT_LinearTree(SX, SY, SZ)
+  Q.levels = [([],[],[],[]) for e in range(Q.exponent+1)]
+  for c,x,y,z,e in streamLeaves(ordered_cubes, Q.exponent):
+    codes, xs, ys, zs = Q.levels[e]
+    codes.append(c)
+    xs.append(x)
+    ys.append(y)
+    zs.append(z)
+  return Q
+
+def buildStreamOctree(black_cubes, ordered=False):
+  """
+  Build and return the linear octree for the 3D image 
+  given as list of black cubes, by sorting them in Morton
+  order (unless ordered is true) and using streamOctreeBuild.
+  """
+  maxX, maxY, maxZ = maxCoordinates(black_cubes, 3)
+  if not ordered: black_cubes = mortonSort(black_cubes)
+  return streamOctreeBuild(maxX+1, maxY+1, maxZ+1, black_cubes)
+
+#---------------------SUMMED VOLUME TABLE-----------------------
+
+def summedVolumeTable(black_cubes, SX, SY, SZ):
+  """
+  Return the summed volume table of the 3D image covering
+  [0,SX] x [0,SY] x [0,SZ], as a flat array S of integers with
+  rows of W=SX+2 elements and slices of H=(SY+2)*W elements, where
+  S[(z+1)*H+(y+1)*W+x+1] is the number of black voxels (x',y',z')
+  with x'<=x, y'<=y and z'<=z, and the first slice, row and column
+  are 0. Return the triplet (S,W,H).
+  """
+  W = SX+2
+  H = (SY+2)*W
+  if np is not None:
+    A = np.zeros((SZ+2, SY+2, W), dtype=np.int64)
+    if hasattr(black_cubes, "column"):
+      xs = np.asarray(black_cubes.column(0), dtype=np.int64)
+      ys = np.asarray(black_cubes.column(1), dtype=np.int64)
+      zs = np.asarray(black_cubes.column(2), dtype=np.int64)
+    else:
+      coords = np.fromiter(chain.from_iterable(black_cubes), dtype=np.int64).reshape(-1,3)
+      xs, ys, zs = coords[:,0], coords[:,1], coords[:,2]
+    A[zs+1, ys+1, xs+1] = 1
+    S = array("q")
+    S.frombytes(A.cumsum(axis=0).cumsum(axis=1).cumsum(axis=2).tobytes())
+    return S, W, H
+  slices = BW_Bitmap3D(SX, SY, SZ).slices
+  fillSlices(slices, black_cubes)
+  S = array("q", bytes(8*H))
+  previous = S[0:H]
+  for rows in slices:
+    # summed area table of the slice, added to the table of the previous slices
+    current = array("q", bytes(8*W))
+    previous_row = current[0:W]
+    for row in rows:
+      current_row = array("q", [0])
+      current_row.extend(map(add, previous_row[1:], accumulate(row)))
+      current.extend(current_row)
+      previous_row = current_row
+    current = array("q", map(add, previous, current))
+    S.extend(current)
+    previous = current
+  return S, W, H
+
+def summedOctreeBuild(SX, SY, SZ, black_cubes=[]):
+  """
+  Build the octree for the given 3D image which covers the cube
+  [0,SX-1] x [0,SY-1] x [0,SZ-1] and whose black voxels are
+  contained in black_cubes, the other voxels are white, from the top.
+  With the summed volume table of the image, the number of black
+  voxels inside a node is found in constant time, then a node is
+  white (no black voxels), a black leaf (all voxels are black)
+  or it is divided into its eight children. Nodes which are partly
+  outside the image are never all black.
+  The result has the same black leaves as octreeBuild.
+  """
+  Q = OCT_Tree(SX, SY, SZ)
+  del Q.leaves[()]
+  S, W, H = summedVolumeTable(black_cubes, SX-1, SY-1, SZ-1)
+  #stack of nodes to be visited: location code, minimum voxel, exponent
+  stack = [((), 0, 0, 0, Q.exponent)]
+  while stack:
+    C, x0, y0, z0, e = stack.pop()
+    if x0>=SX or y0>=SY or z0>=SZ: continue # outside the image
+    L = 2**e
+    x1 = min(x0+L, SX) # x1, y1, z1 are the first voxels after the node
+    y1 = min(y0+L, SY)
+    z1 = min(z0+L, SZ)
+    Y0, Y1, Z0, Z1 = y0*W, y1*W, z0*H, z1*H
+    black = S[Z1+Y1+x1] - S[Z1+Y1+x0] - S[Z1+Y0+x1] + S[Z1+Y0+x0] \
+          - S[Z0+Y1+x1] + S[Z0+Y1+x0] + S[Z0+Y0+x1] - S[Z0+Y0+x0]
+    if black==0: continue
+    if black==L*L*L:
+      Q.leaves[C] = OCT_Node(x0,y0,z0, e, 1)
+      continue
+    half = L//2
+    for digit in range(8):
+      stack.append((C+(digit,), x0+half*((digit>>1)&1), y0+half*(digit&1),
+                    z0+half*(digit>>2), e-1))
+  return Q
+
+def buildSummedOctree(black_cubes):
+  """
+  Build and return the octree for the 3D image 
+  given as list of black cubes, with summedOctreeBuild.
+  """
+  maxX, maxY, maxZ = maxCoordinates(black_cubes, 3)
+  return summedOctreeBuild(maxX+1, maxY+1, maxZ+1, black_cubes)
+
+def checkSummed(QT, black_cubes):
+  """
+  Check that the octree of the image built with the summed volume
+  table has the same black leaves as the octree QT.
+  """
+  ST = buildSummedOctree(black_cubes)
+  first = set([C for C in QT.leaves if QT.leaves[C].color==1])
+  if first==set(ST.leaves) and set(QT.black_leaves())==set(ST.black_leaves()):
+    print("TUTTO VA BENE")
+  else:
+    print("ERRORE: the octree from the summed volume table is different")
+    sys.exit(1)
+
+from bitmap import BW_Bitmap3D, fillSlices
+from itertools import chain, accumulate
+from operator import add
+from array import array
+import sys
 
 
 if __name__ == "__main__":
@@ -364,3 +769,6 @@ if __name__ == "__main__":
   Q = octreeBuild(6,6,4, P)
   
   stampa(Q)
+  checkLinear(Q, P)
+  checkLinear(Q, P, buildStreamOctree)
+  checkSummed(Q, P)
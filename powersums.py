@@ -0,0 +1,220 @@
+"""
+Moments of a set of blocks (rectangles or cuboids) grouped
+by shape, from sums of powers of the coordinates of their
+barycenters.
+
+In order to work with integers, the barycenter of a segment
+[x0,x1] is represented by its doubled coordinate X = x0+x1.
+The moment of order k of a segment with D pixels and doubled
+barycenter X is P_k(X) / DEN[k], where P_k is a polynomial in X
+with integer coefficients depending on D:
+  P_0 = D                   DEN[0] = 1
+  P_1 = D*X                 DEN[1] = 2
+  P_2 = 3*D*X^2 + (D^3-D)   DEN[2] = 12
+  P_3 = D*X^3 + (D^3-D)*X   DEN[3] = 8
+where (D^3-D)/12 is the central moment of order 2 of the segment.
+The moment m_{p,q} of a rectangle is the product of the moments
+of its sides, so the sum of m_{p,q} over all rectangles with the
+same sides DX, DY is a combination of the sums of X^i*Y^j over
+the rectangles, with coefficients given by P_p(DX) and P_q(DY).
+The same holds for cuboids in 3D.
+
+The coordinates of a group can also be given as NumPy arrays:
+then the sums are computed with NumPy on 64 bit integers when
+they cannot overflow, otherwise on Python integers.
+
+When only some orders are wanted (see wantedSums), the sums of
+(2x)^k over the sides of the blocks are computed along each axis
+only up to the max power k of that axis in the wanted orders.
+"""
+
+from operator import add, mul
+
+# NumPy is optional, and only used if the coordinates
+# are given as NumPy arrays
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+# denominators of the moments of order 0,1,2,3 of a segment
+DEN = (1, 2, 12, 8)
+
+def segmentPolynomial(k, D):
+  """
+  Return the list of coefficients of P_k(X), from
+  the coefficient of X^0 to the one of X^k, for a segment
+  of D pixels.
+  """
+  C2 = D*D*D-D
+  if k==0: return [D]
+  if k==1: return [0, D]
+  if k==2: return [C2, 0, 3*D]
+  return [0, C2, 0, D] # k==3
+
+def powerLists(values, max_degree):
+  """
+  Return the list of lists of the powers 0..max_degree of the
+  given values, where the list for power 0 is None.
+  """
+  result = [None, values]
+  for k in range(2, max_degree+1):
+    result.append(list(map(mul, result[-1], values)))
+  return result
+
+# for each list of orders, the plan of the computation (see makePlan)
+PLANS = dict()
+
+def makePlan(orders):
+  """
+  Return the plan of the computation of the given orders:
+  - the list of the tuples of exponents (of the doubled
+    barycenter coordinates) whose sums are needed
+  - for each order, the tuple (order, denominator, terms) where
+    terms is the list of tuples of exponents of the non-zero
+    terms of the product of P_k, over the orders k of the axes
+  Since P_k only has terms with the same parity as k,
+  with exponents up to k, only these terms are listed.
+  """
+  key = tuple(orders)
+  if key in PLANS: return PLANS[key]
+  needed = set()
+  steps = []
+  for order in orders:
+    den = 1
+    for k in order: den *= DEN[k]
+    terms = [()]
+    for k in order:
+      terms = [exps+(e,) for exps in terms for e in range(k%2, k+1, 2)]
+    needed.update(terms)
+    steps.append((order, den, terms))
+  PLANS[key] = (sorted(needed), steps)
+  return PLANS[key]
+
+def arrayPowerLists(values, max_degree):
+  """
+  Same as powerLists, on a NumPy array of integers.
+  """
+  result = [None, values]
+  for k in range(2, max_degree+1):
+    result.append(result[-1]*values)
+  return result
+
+def fitsInt64(coords):
+  """
+  Return true iff the sums of products of three coordinates
+  of the NumPy arrays in coords fit in 64 bit integers.
+  """
+  top = max([int(abs(c).max()) for c in coords])
+  return len(coords[0])*top**3 < 2**63
+
+def monomialSum(powers, exps):
+  """
+  Return the sum over the blocks of the product of the
+  doubled barycenter coordinates raised to exps, given the lists
+  of powers of the coordinates along each axis (see powerLists).
+  """
+  lists = [powers[a][e] for a,e in enumerate(exps) if e>0]
+  if len(lists)==0: return len(powers[0][1])
+  if np is not None and isinstance(lists[0], np.ndarray):
+    prod = lists[0]
+    for L in lists[1:]: prod = prod*L
+    return int(prod.sum())
+  if len(lists)==1: return sum(lists[0])
+  if len(lists)==2: return sum(map(mul, lists[0], lists[1]))
+  return sum(map(mul, map(mul, lists[0], lists[1]), lists[2]))
+
+def groupMoments(shape, coords, plan, MM):
+  """
+  Add to the moments in MM (a dictionary with key the order)
+  the moments of all blocks with the given shape (the tuple of
+  the number of pixels along each axis), whose doubled
+  barycenters are given in coords, a list with one list of
+  coordinates for each axis.
+  """
+  needed, steps = plan
+  if np is not None and isinstance(coords[0], np.ndarray):
+    if len(coords[0])>1 and fitsInt64(coords):
+      coords = [c.astype(np.int64) for c in coords]
+      powerF = arrayPowerLists
+    else:
+      coords = [c.tolist() for c in coords]
+      powerF = powerLists
+  else:
+    powerF = powerLists
+  if len(coords[0])==0: return
+  if len(coords[0])==1: # one block: powers of its coordinates
+    values = [[c[0]**e for e in range(4)] for c in coords]
+    sums = dict()
+    for exps in needed:
+      prod = 1
+      for a,e in enumerate(exps): prod *= values[a][e]
+      sums[exps] = prod
+  else:
+    powers = [powerF(values, 3) for values in coords]
+    sums = dict([(exps, monomialSum(powers, exps)) for exps in needed])
+  # polys[a][k] = coefficients of P_k for the side along axis a
+  polys = [[segmentPolynomial(k, D) for k in range(4)] for D in shape]
+  for order, den, terms in steps:
+    numerator = 0
+    for exps in terms:
+      coeff = sums[exps]
+      for a,e in enumerate(exps): coeff *= polys[a][order[a]][e]
+      numerator += coeff
+    MM[order] += numerator//den
+
+def shapeMoments(groups, orders):
+  """
+  Return the moments (a dictionary with key the order) of
+  a set of blocks given as a dictionary groups, where
+  the key is the shape of the blocks and the value is the list
+  of the lists of doubled barycenter coordinates along each axis.
+  """
+  plan = makePlan(orders)
+  MM = {key:0 for key in orders}
+  for shape in groups:
+    groupMoments(shape, groups[shape], plan, MM)
+  return MM
+
+def maxPowers(wanted):
+  """
+  Return the list of the max power of each coordinate in the
+  wanted orders: the sums of powers along an axis are computed
+  one from the other (T_3 from T_2, T_2 from T_1), so all lower
+  powers are needed and all higher ones can be skipped.
+  """
+  return [max([order[a] for order in wanted]) for a in range(len(wanted[0]))]
+
+def sideTerms(D, X, top, table=None):
+  """
+  Return the list [T_0,...,T_top] of the lists of the sums of (2x)^k
+  over the sides with D pixels and doubled barycenter X (lists):
+    T_0 = D, T_1 = D*X, T_2 = T_1*X + C, T_3 = X*(T_2 + 2*C)
+  where C = (D^3-D)/3 is taken from table (indexed by D), or
+  computed if table is None.
+  """
+  T = [D]
+  if top>=1:
+    T.append(list(map(mul, D, X)))
+  if top>=2:
+    if table is None: C = [(d*d*d-d)//3 for d in D]
+    else: C = list(map(table.__getitem__, D))
+    T.append(list(map(add, map(mul, T[1], X), C)))
+  if top>=3:
+    T.append(list(map(mul, X, map(add, T[2], map(add, C, C)))))
+  return T
+
+def wantedSums(terms, wanted):
+  """
+  Return the moments (a dictionary with key the order) in wanted,
+  given for each axis the list of terms T_k (see sideTerms): the
+  sum over the blocks of the product of the terms of the axes is
+  2^(p+q+r)*m_{p,q,r}.
+  """
+  MM = dict()
+  for order in wanted:
+    lists = [terms[a][k] for a,k in enumerate(order)]
+    if len(lists)==2: total = sum(map(mul, lists[0], lists[1]))
+    else: total = sum(map(mul, map(mul, lists[0], lists[1]), lists[2]))
+    MM[order] = total >> sum(order)
+  return MM
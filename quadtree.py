@@ -180,6 +180,15 @@ class QTR_Tree:
     black_leaves = [C for C in self.leaves if self.leaves[C].color==1]
     return len(black_leaves)
 
+  def black_leaves(self):
+    """
+    Iterate on the black leaves of this quadtree, as
+    triplets (xmin,ymin,exponent) where (xmin,ymin) is the
+    pixel of minimum coordinates and 2^exponent is the side.
+    """
+    for node in self.leaves.values():
+      if node.color==1: yield (node.xmin, node.ymin, node.exponent)
+
   def print_me(self, filename):
     F = open(filename,'w')
     for C in self.leaves:
@@ -331,13 +340,394 @@ def buildQuadtree(black_pixels):
   Build and return the quadtree for the 2D image 
   given as list of black squares.
   """
-  maxX = 1+max([c[0] for c in black_pixels])
-  maxY = 1+max([c[1] for c in black_pixels])
-  return quadtreeBuild(maxX, maxY, black_pixels)
+  maxX, maxY = maxCoordinates(black_pixels, 2)
+  return quadtreeBuild(maxX+1, maxY+1, black_pixels)
+
+#---------------------LINEAR QUADTREE-----------------------
+
+"""
+In a linear quadtree the leaves are not stored as a dictionary
+of nodes, but as integers: the Morton code of a pixel (x,y) is
+obtained by interleaving the bits of x and y, bit i of x going to
+bit 2i+1 and bit i of y to bit 2i. Its digits in base 4 are the
+digits of the location code of the pixel (as in code_for_pixel).
+A node with side 2^e is identified by its level e and by the Morton
+code of its pixel of minimum coordinates, whose lowest 2e bits are 0.
+The four children of a node have consecutive Morton codes,
+therefore they can be found and merged level by level on the
+sorted array of codes.
+"""
+
+# NumPy is optional: without it, codes are computed with
+# a lookup table and levels are merged with a Python loop
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+# SPREAD[b] = the 8 bits of b moved to the even positions 0,2,...,14
+SPREAD = [sum([((b>>i)&1)<<(2*i) for i in range(8)]) for b in range(256)]
+
+def mortonCode(x, y):
+  """
+  Return the Morton code of the pixel (x,y).
+  """
+  code = 0
+  shift = 0
+  while x or y:
+    code |= ((SPREAD[x&255]<<1)|SPREAD[y&255])<<shift
+    x >>= 8
+    y >>= 8
+    shift += 16
+  return code
+
+def spreadBits(v):
+  """
+  Move the bits of the integers in the NumPy array v
+  (less than 2^32) to the even positions.
+  """
+  v = v.astype(np.uint64)
+  v = (v | (v<<16)) & 0x0000FFFF0000FFFF
+  v = (v | (v<<8)) & 0x00FF00FF00FF00FF
+  v = (v | (v<<4)) & 0x0F0F0F0F0F0F0F0F
+  v = (v | (v<<2)) & 0x3333333333333333
+  v = (v | (v<<1)) & 0x5555555555555555
+  return v
+
+def mortonArrays(black_pixels):
+  """
+  Return three NumPy arrays with the Morton codes and the
+  x,y coordinates of the black pixels (a list of pairs, a bitmap
+  or a BinaryImage), sorted by Morton code, without repetitions.
+  """
+  if hasattr(black_pixels, "column"):
+    xs = np.asarray(black_pixels.column(0), dtype=np.int64)
+    ys = np.asarray(black_pixels.column(1), dtype=np.int64)
+  else:
+    coords = np.fromiter(chain.from_iterable(black_pixels), dtype=np.int64).reshape(-1,2)
+    xs, ys = coords[:,0], coords[:,1]
+  codes = (spreadBits(xs)<<1) | spreadBits(ys)
+  codes, first = np.unique(codes, return_index=True)
+  return codes, xs[first], ys[first]
+
+def mortonLists(black_pixels):
+  """
+  Return three lists with the Morton codes and the x,y
+  coordinates of the black pixels, sorted by Morton code,
+  without repetitions (version without NumPy).
+  """
+  found = sorted(set([(mortonCode(x,y),x,y) for x,y in black_pixels]))
+  if len(found)==0: return [],[],[]
+  return [list(col) for col in zip(*found)]
+
+class QTR_LinearTree:
+  """
+  An object of this class is a linear quadtree representing
+  an image: only the black leaves are stored.
+  It stores the same information as QTR_Tree about the sides
+  of the image and of the quadtree domain, and
+  - levels: list indexed by the exponent e, levels[e] is the
+    triplet (codes,xs,ys) of the Morton codes and of the
+    minimum coordinates of the black leaves with side 2^e,
+    sorted by Morton code (lists, or NumPy arrays).
+  """
+  def __init__(self, SX = 1, SY = 1):
+    self.x_side = SX
+    self.y_side = SY
+    self.exponent = power_of_two(self.x_side, self.y_side)
+    self.side = 2**self.exponent
+    self.levels = [([],[],[]) for e in range(self.exponent+1)]
+
+  def location_code(self, code, e):
+    """
+    Return the location code (as in QTR_Tree) of the node with
+    given Morton code at level e.
+    """
+    return tuple([(code>>(2*i))&3 for i in range(self.exponent-1,e-1,-1)])
+
+  def num_elem(self):
+    """
+    Return the number of black leaves of this quadtree.
+    """
+    return sum([len(codes) for codes,xs,ys in self.levels])
+
+  def black_leaves(self):
+    """
+    Iterate on the black leaves of this quadtree, as
+    triplets (xmin,ymin,exponent), level by level.
+    """
+    for e in range(len(self.levels)):
+      codes, xs, ys = self.levels[e]
+      if np is not None and isinstance(xs, np.ndarray):
+        xs, ys = xs.tolist(), ys.tolist()
+      for x,y in zip(xs,ys):
+        yield (x,y,e)
+
+  def print_me(self, filename):
+    F = open(filename,'w')
+    for x,y,e in self.black_leaves():
+       F.write(str(QTR_Node(x,y,e))+'\n')
+    F.close()
+
+def mergeLevelArrays(codes, xs, ys, shift):
+  """
+  Find the groups of four sibling leaves in the sorted NumPy
+  array of Morton codes, where siblings have equal codes after
+  removing the lowest shift bits.
+  Return the arrays of the leaves which are not merged, and the
+  arrays of the merged parents.
+  """
+  parents = codes>>shift
+  # four distinct codes with the same parent are all its children
+  first = np.nonzero(parents[:-3]==parents[3:])[0]
+  merged = np.zeros(len(codes), dtype=bool)
+  for i in range(4): merged[first+i] = True
+  kept = ~merged
+  return (codes[kept], xs[kept], ys[kept]), (codes[first], xs[first], ys[first])
+
+def mergeLevelLists(codes, xs, ys, shift):
+  """
+  Same as mergeLevelArrays, on lists (version without NumPy).
+  """
+  kept = ([],[],[])
+  up = ([],[],[])
+  i, n = 0, len(codes)
+  while i<n:
+    c = codes[i]
+    if i+3<n and (codes[i+3]>>shift)==(c>>shift):
+      target = up
+      step = 4
+    else:
+      target = kept
+      step = 1
+    target[0].append(c)
+    target[1].append(xs[i])
+    target[2].append(ys[i])
+    i += step
+  return kept, up
+
+def linearQuadtreeBuild(SX, SY, black_pixels=[]):
+  """
+  Build the linear quadtree for the given 2D image which covers
+  the square [0,SX-1] x [0,SY-1] and whose black pixels are
+  contained in black_pixels, the other pixels are white.
+  The Morton codes of all pixels are computed at once and sorted,
+  then sibling leaves are merged level by level, from the pixels
+  up to the root.
+  """
+  Q = QTR_LinearTree(SX, SY)
+  if np is not None:
+    current = mortonArrays(black_pixels)
+    mergeLevel = mergeLevelArrays
+  else:
+    current = mortonLists(black_pixels)
+    mergeLevel = mergeLevelLists
+  for e in range(Q.exponent):
+    if len(current[0])<4:
+      Q.levels[e] = current
+      return Q
+    Q.levels[e], current = mergeLevel(*current, 2*(e+1))
+  Q.levels[Q.exponent] = current
+  return Q
+
+def buildLinearQuadtree(black_pixels):
+  """
+  Build and return the linear quadtree for the 2D image 
+  given as list of black squares.
+  """
+  maxX, maxY = maxCoordinates(black_pixels, 2)
+  return linearQuadtreeBuild(maxX+1, maxY+1, black_pixels)
+
+def checkLinear(QT, black_pixels, buildF=None):
+  """
+  Check that the linear quadtree of the image, built by
+  buildF (by default buildLinearQuadtree), has the
+  same black leaves as the quadtree QT.
+  """
+  LT = (buildF or buildLinearQuadtree)(black_pixels)
+  first = set([C for C in QT.leaves if QT.leaves[C].color==1])
+  second = set()
+  for e in range(len(LT.levels)):
+    second.update([LT.location_code(c,e) for c in LT.levels[e][0]])
+  if first==second and sorted(QT.black_leaves())==sorted(LT.black_leaves()):
+    print("TUTTO VA BENE")
+  else:
+    print("ERRORE: the linear quadtree is different")
+    sys.exit(1)
+
+#---------------------STREAMING LINEAR QUADTREE-----------------------
+
+def mortonSort(black_pixels):
+  """
+  Return the list of the black pixels sorted in Morton order,
+  to be given to streamQuadtreeBuild.
+  """
+  if np is not None:
+    codes, xs, ys = mortonArrays(black_pixels)
+    return list(zip(xs.tolist(), ys.tolist()))
+  return sorted(black_pixels, key=lambda c: mortonCode(*c))
+
+def streamLeaves(ordered_pixels, E):
+  """
+  Consume the black pixels of an image, given in Morton order,
+  and yield the black leaves of its quadtree with side 2^E,
+  as quadruples (code,xmin,ymin,exponent).
+  In one pass, keep for each level e a list pending[e] of at most
+  three nodes which are children of the same parent: a fourth one
+  completes the parent, which is passed to the next level;
+  a node with a different parent makes them final leaves.
+  """
+  pending = [[] for e in range(E+1)]
+  last = -1
+  for x,y in ordered_pixels:
+    c = mortonCode(x,y)
+    if c==last: continue # repeated pixel
+    assert c>last, "pixels are not in Morton order"
+    last = c
+    # the nodes waiting for a parent different from the one of c
+    # cannot be completed any more; if the parent at level e is
+    # the same, it is the same at all higher levels too
+    for e in range(E):
+      P = pending[e]
+      if len(P)==0: continue
+      if (P[0][0]>>(2*e+2))==(c>>(2*e+2)): break
+      for node in P: yield node+(e,)
+      P.clear()
+    node = (c,x,y)
+    e = 0
+    while e<E:
+      P = pending[e]
+      P.append(node)
+      if len(P)<4: break
+      node = P[0]
+      P.clear()
+      e += 1
+    if e==E: pending[E].append(node) # the root
+  for e in range(E+1):
+    for node in pending[e]: yield node+(e,)
+
+def streamQuadtreeBuild(SX, SY, ordered_pixels):
+  """
+  Build the linear quadtree for the given 2D image which covers
+  the square [0,SX-1] x [0,SY-1], whose black pixels are given
+  in Morton order (a list, or any iterable), with streamLeaves.
+  """
+  Q = QTR_LinearTree(SX, SY)
+  Q.levels = [([],[],[]) for e in range(Q.exponent+1)]
+  for c,x,y,e in streamLeaves(ordered_pixels, Q.exponent):
+    codes, xs, ys = Q.levels[e]
+    codes.append(c)
+    xs.append(x)
+    ys.append(y)
+  return Q
+
+def buildStreamQuadtree(black_pixels, ordered=False):
+  """
+  Build and return the linear quadtree for the 2D image 
+  given as list of black squares, by sorting them in Morton
+  order (unless ordered is true) and using streamQuadtreeBuild.
+  """
+  maxX, maxY = maxCoordinates(black_pixels, 2)
+  if not ordered: black_pixels = mortonSort(black_pixels)
+  return streamQuadtreeBuild(maxX+1, maxY+1, black_pixels)
+
+#---------------------SUMMED AREA TABLE-----------------------
+
+def summedAreaTable(black_pixels, SX, SY):
+  """
+  Return the summed area table of the 2D image covering
+  [0,SX] x [0,SY], as a flat array S of integers with rows of
+  W=SX+2 elements, where S[(y+1)*W+x+1] is the number of black
+  pixels (x',y') with x'<=x and y'<=y, and the first row and
+  column are 0. Return the pair (S,W).
+  """
+  W = SX+2
+  if np is not None:
+    A = np.zeros((SY+2, W), dtype=np.int64)
+    if hasattr(black_pixels, "column"):
+      xs = np.asarray(black_pixels.column(0), dtype=np.int64)
+      ys = np.asarray(black_pixels.column(1), dtype=np.int64)
+    else:
+      coords = np.fromiter(chain.from_iterable(black_pixels), dtype=np.int64).reshape(-1,2)
+      xs, ys = coords[:,0], coords[:,1]
+    A[ys+1, xs+1] = 1
+    S = array("q")
+    S.frombytes(A.cumsum(axis=0).cumsum(axis=1).tobytes())
+    return S, W
+  rows = BW_Bitmap2D(SX, SY).rows
+  fillRows(rows, black_pixels)
+  S = array("q", bytes(8*W))
+  previous = S[0:W]
+  for row in rows:
+    # sums of the row up to x, added to the sums of the previous row
+    current = array("q", [0])
+    current.extend(map(add, previous[1:], accumulate(row)))
+    S.extend(current)
+    previous = current
+  return S, W
+
+def summedQuadtreeBuild(SX, SY, black_pixels=[]):
+  """
+  Build the quadtree for the given 2D image which covers the
+  square [0,SX-1] x [0,SY-1] and whose black pixels are contained
+  in black_pixels, the other pixels are white, from the top.
+  With the summed area table of the image, the number of black
+  pixels inside a node is found in constant time, then a node is
+  white (no black pixels), a black leaf (all pixels are black)
+  or it is divided into its four children. Nodes which are partly
+  outside the image are never all black.
+  The result has the same black leaves as quadtreeBuild.
+  """
+  Q = QTR_Tree(SX, SY)
+  del Q.leaves[()]
+  S, W = summedAreaTable(black_pixels, SX-1, SY-1)
+  #stack of nodes to be visited: location code, minimum pixel, exponent
+  stack = [((), 0, 0, Q.exponent)]
+  while stack:
+    C, x0, y0, e = stack.pop()
+    if x0>=SX or y0>=SY: continue # outside the image
+    L = 2**e
+    x1 = min(x0+L, SX) # x1, y1 are the first pixels after the node
+    y1 = min(y0+L, SY)
+    black = S[y1*W+x1] - S[y0*W+x1] - S[y1*W+x0] + S[y0*W+x0]
+    if black==0: continue
+    if black==L*L:
+      Q.leaves[C] = QTR_Node(x0,y0, e, 1)
+      continue
+    half = L//2
+    for digit in range(4):
+      stack.append((C+(digit,), x0+half*(digit>>1), y0+half*(digit&1), e-1))
+  return Q
+
+def buildSummedQuadtree(black_pixels):
+  """
+  Build and return the quadtree for the 2D image 
+  given as list of black squares, with summedQuadtreeBuild.
+  """
+  maxX, maxY = maxCoordinates(black_pixels, 2)
+  return summedQuadtreeBuild(maxX+1, maxY+1, black_pixels)
+
+def checkSummed(QT, black_pixels):
+  """
+  Check that the quadtree of the image built with the summed area
+  table has the same black leaves as the quadtree QT.
+  """
+  ST = buildSummedQuadtree(black_pixels)
+  first = set([C for C in QT.leaves if QT.leaves[C].color==1])
+  if first==set(ST.leaves) and set(QT.black_leaves())==set(ST.black_leaves()):
+    print("TUTTO VA BENE")
+  else:
+    print("ERRORE: the quadtree from the summed area table is different")
+    sys.exit(1)
 
 #---------------------MAIN-----------------------
 
 from commons2D import readPixels
+from coordfile import maxCoordinates
+from bitmap import BW_Bitmap2D, fillRows
+from itertools import chain, accumulate
+from operator import add
+from array import array
 import sys
 
 def main(arg):
@@ -351,6 +741,11 @@ def main(arg):
          print("Number of black nodes: ",QT.num_elem())
          QT.print_me("builtqtree_out.txt")
          print("Nodi stampati su builtqtree_out.txt")
+         if len(arg)>2 and arg[2]=="linear":
+            checkLinear(QT, input_pixels)
+            checkLinear(QT, input_pixels, buildStreamQuadtree)
+         if len(arg)>2 and arg[2]=="summed":
+            checkSummed(QT, input_pixels)
 
 if __name__ == "__main__":
    main(sys.argv)
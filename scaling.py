@@ -0,0 +1,230 @@
+"""
+Empirical scaling laws of the methods, from the FileScaledMpeg series
+(lista0500, lista1000, lista2000, lista4000) and from synthetic images
+of larger sides (see synthetic.py).
+
+The images are run with benchsuite.py (each image and method in a
+fresh process), whose records carry, besides the time and memory of
+each stage, the variables of the image: side (max coordinate + 1),
+pixels (number of black pixels) and elements (number of leaves,
+runs or blocks of the decomposition), see main_for_tests.py.
+For each pipeline (method, and level for block_new) and each stage
+(decompose, preprocess, moments, and total of the three) the
+median wall time and the peak memory are fitted against each
+variable with a power law
+  y = coeff * x^exponent
+by least squares on log y = log coeff + exponent * log x.
+The exponents are printed as a table, with the R^2 of the fit, and
+for each pair of pipelines the crossover of the fitted total times
+against the number of pixels and the side, i.e. the size where the
+faster pipeline changes (marked "extrapolated" if outside the measured
+range, and not reported if farther than EXTRAPOLATION times).
+
+Usage:
+  python3 scaling.py run OUT.json [DATASET,...] [methods=M1,M2,...] [opts=0,1,2]
+                     [times=3] [synthetic=N1,N2,...] [shapes=disc,blobs] [dim=2]
+run the benchmark (by default on the four lists of FileScaledMpeg, with
+tree_old, tree_new, block_old, block_new at levels 0, 1, 2), adding the
+synthetic images of the given sides (written if missing)
+  python3 scaling.py report RESULTS.json
+print the fitted exponents and the crossovers
+"""
+
+import math
+import os
+import sys
+
+DEFAULT_DATASETS = ["lista0500", "lista1000", "lista2000", "lista4000"]
+DEFAULT_SHAPES = ["disc", "blobs"]
+DEFAULT_TIMES = 3
+
+STAGES = ["decompose", "preprocess", "moments"]
+VARIABLES = ["side", "pixels", "elements"]
+# crossovers farther than this factor from the measured range are not reported
+EXTRAPOLATION = 10
+
+#---------------------FIT-----------------------
+
+def fitPowerLaw(xs, ys):
+  """
+  Return (exponent, coeff, r2) of the least squares fit of
+  log y = log coeff + exponent * log x, or None if the x are
+  less than two distinct positive values.
+  """
+  points = [(math.log(x), math.log(y)) for x,y in zip(xs, ys) if x>0 and y>0]
+  if len(set([u for u,v in points]))<2: return None
+  n = len(points)
+  mu = sum([u for u,v in points])/n
+  mv = sum([v for u,v in points])/n
+  suu = sum([(u-mu)**2 for u,v in points])
+  suv = sum([(u-mu)*(v-mv) for u,v in points])
+  svv = sum([(v-mv)**2 for u,v in points])
+  exponent = suv/suu
+  intercept = mv-exponent*mu
+  r2 = 1.0 if svv==0 else suv*suv/(suu*svv)
+  return exponent, math.exp(intercept), r2
+
+def crossover(fit1, fit2):
+  """
+  Return the x where the two power laws are equal, or None if
+  they are parallel.
+  """
+  if fit1[0]==fit2[0]: return None
+  return math.exp((math.log(fit2[1])-math.log(fit1[1]))/(fit1[0]-fit2[0]))
+
+#---------------------RECORDS-----------------------
+
+def pipelineName(r):
+  if r.get("cell") in OPT_METHODS: return "%s/opt%s" % (r["cell"], r["opt"])
+  return r.get("cell") or r["method"]
+
+def collectPoints(records):
+  """
+  Return a dictionary pipeline -> list of points, one per image,
+  each a dictionary with the variables of the image and, for each
+  stage and for "total", the median wall time (stage) and the
+  peak memory (stage+"_peak").
+  """
+  points = dict()
+  for r in records:
+    if r["stage"] not in STAGES: continue
+    point = points.setdefault(pipelineName(r), dict()).setdefault(r["image"], dict())
+    for var in VARIABLES:
+      if var in r: point[var] = r[var]
+    point[r["stage"]] = point.get(r["stage"], 0.0) + r["wall_median"]
+    point[r["stage"]+"_peak"] = max(point.get(r["stage"]+"_peak", 0), r["peak_bytes"])
+  for pipeline in points:
+    for point in points[pipeline].values():
+      point["total"] = sum([point.get(stage, 0.0) for stage in STAGES])
+      point["total_peak"] = max([point.get(stage+"_peak", 0) for stage in STAGES])
+  return {pipeline: list(images.values()) for pipeline, images in points.items()}
+
+def fitAll(points):
+  """
+  Return a dictionary (pipeline, measure, variable) -> fit, where
+  the measure is a stage, "total", or one of them followed by "_peak".
+  """
+  fits = dict()
+  for pipeline, P in points.items():
+    for stage in STAGES+["total"]:
+      for measure in (stage, stage+"_peak"):
+        for var in VARIABLES:
+          pairs = [(p[var], p[measure]) for p in P if var in p and measure in p]
+          if not pairs: continue
+          fit = fitPowerLaw(*zip(*pairs))
+          if fit is not None: fits[(pipeline, measure, var)] = fit
+  return fits
+
+#---------------------REPORT-----------------------
+
+def printExponents(fits, kind):
+  """
+  Print the table of the exponents of the time (kind="time")
+  or of the memory (kind="memory").
+  """
+  print("Fitted exponents of %s (R^2 in parentheses)" % kind)
+  print("  %-16s %-11s" % ("pipeline", "stage") + "".join(["%-18s" % var for var in VARIABLES]))
+  for pipeline in sorted(set([key[0] for key in fits])):
+    for stage in STAGES+["total"]:
+      measure = stage if kind=="time" else stage+"_peak"
+      row = []
+      for var in VARIABLES:
+        fit = fits.get((pipeline, measure, var))
+        row.append("%-18s" % ("-" if fit is None else "%6.3f (%.3f)" % (fit[0], fit[2])))
+      if row.count("%-18s" % "-")<len(row):
+        print("  %-16s %-11s" % (pipeline, stage) + "".join(row))
+  print("")
+
+def printCrossovers(points, fits, var="pixels"):
+  """
+  Print the crossovers of the fitted total times of each pair of
+  pipelines against the variable var.
+  """
+  print("Crossovers of the total time against %s" % var)
+  pipelines = sorted([p for p in points if (p, "total", var) in fits])
+  for i, p1 in enumerate(pipelines):
+    for p2 in pipelines[i+1:]:
+      f1, f2 = fits[(p1, "total", var)], fits[(p2, "total", var)]
+      x = crossover(f1, f2)
+      values = [p[var] for p in points[p1]+points[p2] if var in p]
+      low, high = min(values), max(values)
+      if x is None or not low/EXTRAPOLATION<=x<=high*EXTRAPOLATION:
+        # compare the fits in the middle of the range
+        middle = math.sqrt(low*high)
+        faster = p1 if f1[1]*middle**f1[0]<f2[1]*middle**f2[0] else p2
+        print("  %-16s %-16s none: %s faster in the whole range" % (p1, p2, faster))
+        continue
+      # the pipeline with the larger exponent is faster below x
+      below, above = (p1, p2) if f1[0]>f2[0] else (p2, p1)
+      inside = low<=x<=high
+      print("  %-16s %-16s at %10.4g %s: %s faster below, %s above" %
+            (p1, p2, x, "(measured)    " if inside else "(extrapolated)", below, above))
+  print("")
+
+def report(results):
+  points = collectPoints(results["records"])
+  fits = fitAll(points)
+  print("Environment:", describeEnvironment(results["environment"]))
+  print("Images per pipeline:", ", ".join(["%s %d" % (p, len(P)) for p,P in sorted(points.items())]))
+  print("")
+  printExponents(fits, "time")
+  printExponents(fits, "memory")
+  printCrossovers(points, fits, "pixels")
+  printCrossovers(points, fits, "side")
+
+#---------------------RUN-----------------------
+
+def syntheticImages(dim, sides, shapes):
+  """
+  Return the names of the synthetic images of the given sides
+  and shapes, writing the missing ones.
+  """
+  names = []
+  for N in sides:
+    for shape in shapes:
+      name = synthetic.imageName(dim, shape, N)
+      if not os.path.exists(name):
+        print("Writing", name)
+        synthetic.writeImage(dim, shape, N, synthetic.defaultParams(shape, N), name)
+      names.append(name)
+  return names
+
+#---------------------MAIN-----------------------
+
+from benchsuite import runSuite, loadResults, describeEnvironment
+from coordfile import options
+from benchsuite import OPT_METHODS, DEFAULT_METHODS, DEFAULT_OPTS
+import synthetic
+
+def main(arg):
+  try:
+    command = arg[1]
+    assert command in ("run", "report")
+    if command=="report":
+      results = loadResults(arg[2])
+    else:
+      out_file = arg[2]
+      rest = arg[3:]
+      datasets = DEFAULT_DATASETS
+      if rest and "=" not in rest[0]:
+        datasets = rest[0].split(",")
+        rest = rest[1:]
+      opt = options(rest)
+      methods = opt["methods"].split(",") if "methods" in opt else DEFAULT_METHODS
+      opts = [int(o) for o in opt["opts"].split(",")] if "opts" in opt else DEFAULT_OPTS
+      times = int(opt.get("times", DEFAULT_TIMES))
+      sides = [int(N) for N in opt["synthetic"].split(",")] if "synthetic" in opt else []
+      shapes = opt["shapes"].split(",") if "shapes" in opt else DEFAULT_SHAPES
+      dim = int(opt.get("dim", 2))
+  except:
+    print(__doc__)
+    return
+  if command=="report":
+    report(results)
+    return
+  datasets = datasets + syntheticImages(dim, sides, shapes)
+  runSuite(out_file, datasets, methods, opts, times)
+  report(loadResults(out_file))
+
+if __name__ == "__main__":
+  main(sys.argv)
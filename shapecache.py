@@ -0,0 +1,93 @@
+"""
+Cache of the central moments of blocks (rectangles or cuboids),
+with key the shape of the block, i.e. the tuple of its sides.
+
+The central moments are computed on first use from the closed
+formulas
+  mu_0 = product of the sides
+  mu_2 along the side D = (mu_0/D) * c2(D)
+where c2(D) = (D^3-D)/12 is the central moment of order 2 of
+a segment of D pixels; all other central moments up to order 3
+are zero. The moments of order 2 are kept times 4, so that
+they are integers (4*c2(D) = (D^3-D)/3).
+The cache has a bounded size: when it is full, the least
+recently used shape is removed.
+After share() the cache can be used by many threads at once:
+every get holds a lock, since the LRU order is updated also
+on hits.
+"""
+
+from collections import OrderedDict
+import sys
+import threading
+
+# default max number of shapes in the cache
+CACHE_SIZE = 2**16
+
+class ShapeCache:
+  """
+  LRU cache: table maps the shape (DX,DY) or (DX,DY,DZ)
+  to the tuple (mu_0, 4*mu_2 along x, 4*mu_2 along y [, along z]).
+  """
+  def __init__(self, max_size=CACHE_SIZE):
+    self.max_size = max_size
+    self.table = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    # lock of get, if the cache is shared by threads
+    self.lock = None
+
+  def share(self):
+    """
+    Make the cache safe for many threads.
+    """
+    if self.lock is None: self.lock = threading.Lock()
+
+  def get(self, shape):
+    """
+    Return the central moments of a block with the given shape.
+    """
+    if self.lock is not None:
+      with self.lock: return self.lookup(shape)
+    return self.lookup(shape)
+
+  def lookup(self, shape):
+    table = self.table
+    value = table.get(shape)
+    if value is not None:
+      self.hits += 1
+      table.move_to_end(shape)
+      return value
+    self.misses += 1
+    mu0 = 1
+    for D in shape: mu0 *= D
+    value = (mu0,) + tuple([(mu0//D)*((D*D*D-D)//3) for D in shape])
+    table[shape] = value
+    if len(table)>self.max_size:
+      table.popitem(last=False)
+      self.evictions += 1
+    return value
+
+  def size(self):
+    return len(self.table)
+
+  def memory(self):
+    """
+    Return the approximate memory (bytes) used by the cache.
+    """
+    total = sys.getsizeof(self.table)
+    for key, value in self.table.items():
+      total += sys.getsizeof(key) + sys.getsizeof(value)
+      total += sum([sys.getsizeof(v) for v in value])
+    return total
+
+  def hit_rate(self):
+    requests = self.hits+self.misses
+    if requests==0: return 0.0
+    return self.hits/requests
+
+  def statistiche(self):
+    print("Shape cache: %d shapes (max %d), %d evicted" % (self.size(), self.max_size, self.evictions))
+    print("  hits %d, misses %d, hit rate %.1f%%" % (self.hits, self.misses, 100*self.hit_rate()))
+    print("  memory %.1f KB" % (self.memory()/1024))
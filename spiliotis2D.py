@@ -6,6 +6,9 @@ image and tries to merge runs of equal length
 existing in consecutive rows.
 """
 
+from array import array
+from operator import sub
+
 #---------------------CLASSES-----------------------
 
 class BW_Block:
@@ -56,19 +59,69 @@ class BW_Block:
 class BW_BlockImage2D:
   """
   Image Block Representation by Spiliotis and Mertzios.
-  The image is represented as a list of blocks.
+  The image is represented as a list of blocks, stored
+  column-wise: the i-th block is the rectangle
+  [x0[i],x1[i]] x [y0[i],y1[i]], and each of x0,y0,x1,y1
+  is an array of C integers.
   """
 
   def __init__(self):
-    self.block = []
+    self.x0 = array("i")
+    self.y0 = array("i")
+    self.x1 = array("i")
+    self.y1 = array("i")
     self.origsize = 0
 
+  def append(self, x0,y0, x1,y1):
+    """
+    Add the block [x0,x1] x [y0,y1].
+    """
+    self.x0.append(x0)
+    self.y0.append(y0)
+    self.x1.append(x1)
+    self.y1.append(y1)
+
+  def extend(self, x0,y0, x1,y1):
+    """
+    Add many blocks, given as one sequence for each coordinate
+    (lists, arrays or NumPy arrays).
+    """
+    for col, values in zip(self.columns(), (x0,y0,x1,y1)):
+      if hasattr(values,"astype"): col.frombytes(values.astype("intc").tobytes())
+      else: col.extend(values)
+
   def add_block(self, b):
     assert isinstance(b,BW_Block)
-    self.block.append(b)
+    self.append(b.x0,b.y0, b.x1,b.y1)
+
+  def columns(self):
+    """
+    Return the arrays x0,y0,x1,y1 (not a copy).
+    """
+    return (self.x0, self.y0, self.x1, self.y1)
+
+  def arrays(self):
+    """
+    Return the columns as NumPy arrays sharing memory
+    with the arrays x0,y0,x1,y1 (requires NumPy).
+    """
+    return tuple([np.frombuffer(col, dtype=np.intc) for col in self.columns()])
+
+  @property
+  def block(self):
+    """
+    List of blocks as BW_Block objects, built on request
+    (the moment computations use the columns).
+    """
+    blocks = []
+    for x0,y0,x1,y1 in zip(*self.columns()):
+      b = BW_Block()
+      b.set(x0,y0, x1,y1)
+      blocks.append(b)
+    return blocks
 
   def size(self):
-    return len(self.block)
+    return len(self.x0)
 
   def __str__(self):
      s = "Block 2D image\n"
@@ -77,7 +130,7 @@ class BW_BlockImage2D:
      return s
      
   def num_elem(self):
-     return len(self.block)
+     return len(self.x0)
 
   def all_blocks(self):
      return self.block
@@ -86,20 +139,15 @@ class BW_BlockImage2D:
      """
      Return the max side of a block in this block decomposition
      """
-     max_s = 0
-     for b in self.block:
-       max_s = max(max_s,b.x1-b.x0+1,b.y1-b.y0+1)
-     return max_s
+     return max(self.max_pair())
 
   def max_pair(self):
      """
      Return a pair formed by the max height of a rectangle
      and the max width of a rectangle in this block decoposition
      """
-     max_deltaX, max_deltaY = 0,0
-     for b in self.block:
-       max_deltaX = max(max_deltaX,b.x1-b.x0+1)
-       max_deltaY = max(max_deltaY,b.y1-b.y0+1)
+     max_deltaX = max(map(sub, self.x1, self.x0), default=-1)+1
+     max_deltaY = max(map(sub, self.y1, self.y0), default=-1)+1
      return (max_deltaY,max_deltaX)
 
   def print_me(self, filename):
@@ -112,19 +160,59 @@ class BW_BlockImage2D:
      dim_uno = 0
      dim_piccole = 0 
      soglia = 7
-     for b in self.block:
-       if b.x1-b.x0<soglia and b.y1-b.y0<soglia:
+     for x0,y0,x1,y1 in zip(*self.columns()):
+       if x1-x0<soglia and y1-y0<soglia:
          dim_piccole += 1
-       if b.x1==b.x0 or b.y1==b.y0:
+       if x1==x0 or y1==y0:
          dim_uno += 1
-     print("Di",len(self.block),"blocchi: hanno spessore 1 in",dim_uno," e dimensioni<8 in",dim_piccole)
+     print("Di",self.size(),"blocchi: hanno spessore 1 in",dim_uno," e dimensioni<8 in",dim_piccole)
      print("Max dimens: ",self.max_pair())
      
 #---------------------DECOMPOSITION------------------------
 
 def extractSliceBlocks(IMG, SX, SY):
   """
-  Create the blocks for the 2D image.
+  Create the blocks for the 2D image, given as a bitmap
+  (see bitmap.py). The runs of each row are taken from
+  the bitmap, then each run either extends the in-progress
+  block ending at the same x, or replaces it.
+  """
+  # Arrays used to store in-progress blocks, indexed on x1:
+  # the in-progress block ending at x is [temp_x0[x],x] x [temp_y0[x],temp_y1[x]],
+  # and temp_x0[x]==-1 if there is none.
+  temp_x0 = [-1 for i in range(SX+1)]
+  temp_y0 = [0 for i in range(SX+1)]
+  temp_y1 = [0 for i in range(SX+1)]
+  # Result to be returned
+  slice = BW_BlockImage2D()
+  slice.origsize = max([SX,SY])
+  append = slice.append
+
+  for y in range(SY+1):
+     for start_x, end_x in IMG.runs(y):
+         if temp_x0[end_x]>=0:
+           #if this block starts at start_x and extends up to previous y, then extend the block
+           if (temp_x0[end_x]==start_x) and (temp_y1[end_x]==y-1):
+             temp_y1[end_x] = y
+             continue
+           #write the block and overwrite it 
+           append(temp_x0[end_x],temp_y0[end_x], end_x,temp_y1[end_x])
+         # set a new block
+         temp_x0[end_x] = start_x
+         temp_y0[end_x] = y
+         temp_y1[end_x] = y
+  #now write all remaining in-progress blocks
+  for x in range(SX+1):
+     if temp_x0[x]>=0:
+        append(temp_x0[x],temp_y0[x], x,temp_y1[x])
+  return slice
+
+def extractSliceBlocksDict(IMG, SX, SY):
+  """
+  Create the blocks for the 2D image, given as a dictionary
+  of black pixels, by visiting all pixels of the bounding box.
+  This is the original version of extractSliceBlocks,
+  kept for comparison (see benchmarks.py).
   """
   #print("==================FORMO BLOCCHI")
   num = 0
@@ -194,23 +282,130 @@ def extractSliceBlocks(IMG, SX, SY):
   return slice
   
 def extractBlocks(black_pixels):
+  """
+  Build the decomposition into blocks from a 2D image given 
+  as a list of black pixels (or as a bitmap), and return it.
+  """
+  # Convert the image from list of black pixels to a bitmap
+  IMG = makeBitmap2D(black_pixels)
+  SX, SY = IMG.max_coords
+  # Result to be returned
+  final_blocks = extractSliceBlocks(IMG, SX, SY)
+  return final_blocks
+
+def extractBlocksDict(black_pixels):
   """
   Build the decomposition into blocks from a 2D image given 
   as a list of black pixels, and return it.
+  Original version of extractBlocks, which represents
+  the image as a dictionary.
   """
   # Convert the image from list of black voxels to 
   # a dictionary with key=(x,y,z) and value =1
   IMG = dict([(c,1) for c in black_pixels])
-  SX = max([c[0] for c in black_pixels])
-  SY = max([c[1] for c in black_pixels])
+  SX, SY = maxCoordinates(black_pixels, 2)
   #num = 0
   # Result to be returned
-  final_blocks = extractSliceBlocks(IMG, SX, SY)
+  final_blocks = extractSliceBlocksDict(IMG, SX, SY)
   #CHECK
   #checkBlocks(final_blocks, black_pixels)
   #print("Number of blocks = ",final_blocks.size())
   return final_blocks
 
+#---------------------NUMPY DECOMPOSITION------------------------
+
+# NumPy is optional: without it, extractBlocksNumpy
+# falls back to extractBlocks
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+def pixelsToArray(black_pixels):
+  """
+  Return the 2D image as a boolean NumPy array A indexed
+  as A[y,x], so that each row of the image is a row of A.
+  The image can be a list of black pixels, a BinaryImage,
+  a bitmap or already a NumPy array.
+  """
+  if isinstance(black_pixels, np.ndarray): return black_pixels
+  SX, SY = maxCoordinates(black_pixels, 2)
+  if isinstance(black_pixels, BW_MaskBitmap2D):
+    width = (SX+8)//8
+    data = b"".join([row.to_bytes(width,"little") for row in black_pixels.rows])
+    bits = np.unpackbits(np.frombuffer(data,dtype=np.uint8), bitorder="little")
+    return bits.reshape(SY+1, 8*width)[:,0:SX+1].astype(bool)
+  if isinstance(black_pixels, BW_Bitmap2D):
+    data = b"".join(black_pixels.rows)
+    return np.frombuffer(data,dtype=np.uint8).reshape(SY+1, SX+1).astype(bool)
+  A = np.zeros((SY+1, SX+1), dtype=bool)
+  if hasattr(black_pixels, "column"):
+    xs = np.asarray(black_pixels.column(0))
+    ys = np.asarray(black_pixels.column(1))
+  else:
+    coords = np.fromiter(chain.from_iterable(black_pixels), dtype=np.int64).reshape(-1,2)
+    xs, ys = coords[:,0], coords[:,1]
+  A[ys, xs] = True
+  return A
+
+def arrayRuns(A):
+  """
+  Return three arrays y, x0, x1 with the runs [x0,x1] of
+  black pixels in the rows y of the boolean array A[y,x],
+  sorted by y and then by x.
+  """
+  P = np.zeros((A.shape[0], A.shape[1]+2), dtype=np.int8)
+  P[:,1:-1] = A
+  D = np.diff(P, axis=1)
+  # D[y,x]==1 iff x is the first pixel of a run,
+  # D[y,x]==-1 iff x-1 is the last pixel of a run
+  y, x0 = np.nonzero(D==1)
+  x1 = np.nonzero(D==-1)[1]-1
+  return y, x0, x1
+
+def arrayBlocks(y, x0, x1, SY):
+  """
+  Merge the runs (given as arrays sorted by y and x) into blocks,
+  as extractSliceBlocks does: a run extends the block formed by
+  equal runs in the previous rows.
+  Return arrays y0, x0, x1, y1 of the blocks, sorted in the
+  order in which extractSliceBlocks writes them, that is when a
+  later run ends at the same x1 (or at the end of the image).
+  """
+  # for each run, the next row with a run ending at the same x1
+  order = np.lexsort((y, x1))
+  next_y = np.full(len(y), SY+1, dtype=np.int64)
+  same = x1[order][1:]==x1[order][:-1]
+  next_y[order[:-1][same]] = y[order][1:][same]
+  # chains of equal runs in consecutive rows
+  order = np.lexsort((y, x1, x0))
+  y, x0, x1, next_y = y[order], x0[order], x1[order], next_y[order]
+  follows = (x0[1:]==x0[:-1]) & (x1[1:]==x1[:-1]) & (y[1:]==y[:-1]+1)
+  first = np.nonzero(np.concatenate(([True], ~follows)))[0]
+  last = np.concatenate((first[1:]-1, [len(y)-1]))
+  y0, x0, x1, y1, written = y[first], x0[first], x1[first], y[last], next_y[last]
+  order = np.lexsort((x1, written))
+  return y0[order], x0[order], x1[order], y1[order]
+
+def extractBlocksNumpy(image):
+  """
+  Build the same decomposition into blocks as extractBlocks
+  (same blocks, in the same order) with NumPy array operations.
+  The image can be a boolean NumPy array A[y,x] or anything
+  accepted by extractBlocks.
+  Without NumPy, call extractBlocks.
+  """
+  if np is None: return extractBlocks(image)
+  A = pixelsToArray(image)
+  y, x0, x1 = arrayRuns(A)
+  final_blocks = BW_BlockImage2D()
+  if len(y)==0: return final_blocks
+  SX, SY = int(x1.max()), int(y.max())
+  final_blocks.origsize = max([SX,SY])
+  by0, bx0, bx1, by1 = arrayBlocks(y, x0, x1, SY)
+  final_blocks.extend(bx0,by0, bx1,by1)
+  return final_blocks
+
 def checkBlocks(ibr, img):
    """
    Take a block representation and a 2D image (given as a list of black
@@ -247,9 +442,29 @@ def checkBlocks(ibr, img):
       print("ERRORE")
       sys.exit(1)
 
+def checkNumpy(ibr, img):
+   """
+   Take the block representation built by extractBlocks for an
+   image and check that extractBlocksNumpy builds the same
+   blocks, in the same order.
+   """
+   if np is None:
+      print("NumPy not available")
+      return
+   other = extractBlocksNumpy(img)
+   first = list(zip(*ibr.columns()))
+   second = list(zip(*other.columns()))
+   if first==second: print("TUTTO VA BENE")
+   else:
+      print("ERRORE: NumPy blocks are different")
+      sys.exit(1)
+
 #---------------------MAIN-----------------------
 
 from commons2D import readPixels
+from coordfile import maxCoordinates
+from bitmap import makeBitmap2D, BW_Bitmap2D, BW_MaskBitmap2D
+from itertools import chain
 import sys
 
 def main(arg):
@@ -265,6 +480,8 @@ def main(arg):
          BB.print_me("decomposition_out.txt")
          print("Nodi stampati su decomposition_out.txt")
          BB.statistiche()
+         if len(arg)>2 and arg[2]=="numpy":
+            checkNumpy(BB, input_pixels)
 
 if __name__ == "__main__":
    main(sys.argv)
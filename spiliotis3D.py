@@ -8,6 +8,9 @@ existing in consecutive rows.
 Then, it tries to merge equal rectangles existing in
 consecutive slices.
 """
+from array import array
+from operator import sub
+
 #---------------------CLASSES-----------------------
 
 class BW_Block:
@@ -62,19 +65,73 @@ class BW_Block:
 class BW_BlockImage3D:
   """
   Image Block Representation by Spiliotis & Mertzios.
-  The image is represented as a list of blocks.
+  The image is represented as a list of blocks, stored
+  column-wise: the i-th block is the cuboid
+  [x0[i],x1[i]] x [y0[i],y1[i]] x [z0[i],z1[i]], and each
+  of x0,y0,z0,x1,y1,z1 is an array of C integers.
   """
 
   def __init__(self):
-    self.block = []
+    self.x0 = array("i")
+    self.y0 = array("i")
+    self.z0 = array("i")
+    self.x1 = array("i")
+    self.y1 = array("i")
+    self.z1 = array("i")
     self.origsize = 0
 
+  def append(self, x0,y0,z0, x1,y1,z1):
+    """
+    Add the block [x0,x1] x [y0,y1] x [z0,z1].
+    """
+    self.x0.append(x0)
+    self.y0.append(y0)
+    self.z0.append(z0)
+    self.x1.append(x1)
+    self.y1.append(y1)
+    self.z1.append(z1)
+
+  def extend(self, x0,y0,z0, x1,y1,z1):
+    """
+    Add many blocks, given as one sequence for each coordinate
+    (lists, arrays or NumPy arrays).
+    """
+    for col, values in zip(self.columns(), (x0,y0,z0,x1,y1,z1)):
+      if hasattr(values,"astype"): col.frombytes(values.astype("intc").tobytes())
+      else: col.extend(values)
+
   def add_block(self, b):
     assert isinstance(b,BW_Block)
-    self.block.append(b)
+    self.append(b.x0,b.y0,b.z0, b.x1,b.y1,b.z1)
+
+  def columns(self):
+    """
+    Return the arrays x0,y0,z0,x1,y1,z1 (not a copy).
+    """
+    return (self.x0, self.y0, self.z0, self.x1, self.y1, self.z1)
+
+  def arrays(self):
+    """
+    Return the columns as NumPy arrays sharing memory
+    with the arrays x0,y0,z0,x1,y1,z1 (requires NumPy).
+    """
+    return tuple([np.frombuffer(col, dtype=np.intc) for col in self.columns()])
+
+  @property
+  def block(self):
+    """
+    List of blocks as BW_Block objects, built on request
+    (the moment computations use the columns).
+    """
+    blocks = []
+    for x0,y0,z0,x1,y1,z1 in zip(*self.columns()):
+      b = BW_Block()
+      b.set(x0,y0,z0, x1,y1,z1)
+      blocks.append(b)
+    return blocks
 
   def size(self):
-    return len(self.block)
+    return len(self.x0)
 
   def __str__(self):
      s = "Block 3D image\n"
@@ -83,7 +140,7 @@ class BW_BlockImage3D:
      return s
 
   def num_elem(self):
-     return len(self.block)
+     return len(self.x0)
      
   def all_blocks(self):
      return self.block
@@ -93,23 +150,21 @@ class BW_BlockImage3D:
      Return a triplet by the max height of a block
      the max width of a block, and the max depth of a block
      """
-     max_deltaX, max_deltaY, max_deltaZ = 0,0,0
-     for b in self.block:
-       max_deltaX = max(max_deltaX,b.x1-b.x0+1)
-       max_deltaY = max(max_deltaY,b.y1-b.y0+1)
-       max_deltaZ = max(max_deltaZ,b.z1-b.z0+1)
+     max_deltaX = max(map(sub, self.x1, self.x0), default=-1)+1
+     max_deltaY = max(map(sub, self.y1, self.y0), default=-1)+1
+     max_deltaZ = max(map(sub, self.z1, self.z0), default=-1)+1
      return (max_deltaX,max_deltaY,max_deltaZ)
 
   def statistiche(self):
      dim_uno = 0
      dim_piccole = 0 
      soglia = 7
-     for b in self.block:
-       if b.x1-b.x0<soglia and b.y1-b.y0<soglia and b.z1-b.z0<soglia:
+     for x0,y0,z0,x1,y1,z1 in zip(*self.columns()):
+       if x1-x0<soglia and y1-y0<soglia and z1-z0<soglia:
          dim_piccole += 1
-       if b.x1==b.x0 or b.y1==b.y0 or b.z1==b.z0:
+       if x1==x0 or y1==y0 or z1==z0:
          dim_uno += 1
-     print("Di",len(self.block),"blocchi: hanno spessore 1 in",dim_uno," e dimensioni<8 in",dim_piccole)
+     print("Di",self.size(),"blocchi: hanno spessore 1 in",dim_uno," e dimensioni<8 in",dim_piccole)
      print("Max dimens: ",self.max_triplet())
      
 
@@ -118,7 +173,49 @@ class BW_BlockImage3D:
 
 def extractSliceBlocks(IMG, SX, SY, z):
   """
-  Create the blocks for the 2D slice with given z.
+  Create the blocks for the 2D slice with given z of
+  the image, given as a bitmap (see bitmap.py).
+  The runs of each row are taken from the bitmap, then each
+  run either extends the in-progress block ending at the
+  same x, or replaces it.
+  """
+  # Arrays used to store in-progress blocks, indexed on x1:
+  # the in-progress block ending at x is [temp_x0[x],x] x [temp_y0[x],temp_y1[x]],
+  # and temp_x0[x]==-1 if there is none.
+  temp_x0 = [-1 for i in range(SX+1)]
+  temp_y0 = [0 for i in range(SX+1)]
+  temp_y1 = [0 for i in range(SX+1)]
+  # Result to be returned
+  slice = BW_BlockImage3D()
+  slice.origsize = max([SX,SY,z])
+  append = slice.append
+
+  for y in range(SY+1):
+     for start_x, end_x in IMG.runs(y,z):
+         if temp_x0[end_x]>=0:
+           #if this block starts at start_x and extends up to previous y, then extend the block
+           if (temp_x0[end_x]==start_x) and (temp_y1[end_x]==y-1):
+             temp_y1[end_x] = y
+             continue
+           #write the block and overwrite it 
+           append(temp_x0[end_x],temp_y0[end_x],z, end_x,temp_y1[end_x],z)
+         # set a new block
+         temp_x0[end_x] = start_x
+         temp_y0[end_x] = y
+         temp_y1[end_x] = y
+  #now write all remaining in-progress blocks
+  for x in range(SX+1):
+     if temp_x0[x]>=0:
+        append(temp_x0[x],temp_y0[x],z, x,temp_y1[x],z)
+  return slice
+
+def extractSliceBlocksDict(IMG, SX, SY, z):
+  """
+  Create the blocks for the 2D slice with given z, of the
+  image given as a dictionary of black voxels, by visiting
+  all voxels of the slice.
+  This is the original version of extractSliceBlocks,
+  kept for comparison (see benchmarks.py).
   """
   #print("==================FORMO BLOCCHI DELLA FETTA z=",z)
   num = 0
@@ -189,74 +286,194 @@ def extractSliceBlocks(IMG, SX, SY, z):
   return slice
   
 def extractBlocks(black_cubes):
+  """
+  Build the decomposition into blocks from a 3D image given
+  as a list of black cubes (or as a bitmap), and return it.
+  """
+  # Convert the image from list of black voxels to a bitmap
+  IMG = makeBitmap3D(black_cubes)
+  return mergeSlices(IMG, IMG.max_coords, extractSliceBlocks)
+
+def extractBlocksDict(black_cubes):
   """
   Build the decomposition into blocks from a 3D image given
   as a list of black cubes, and return it.
+  Original version of extractBlocks, which represents
+  the image as a dictionary.
   """
   # Convert the image from list of black voxels to 
   # a dictionary with key=(x,y,z) and value =1
   IMG = dict([(c,1) for c in black_cubes])
-  SX = max([c[0] for c in black_cubes])
-  SY = max([c[1] for c in black_cubes])
-  SZ = max([c[2] for c in black_cubes])
-  num = 0
-  # Array used to store in-progress blocks of the previous slice
-  # The array is indexed on x1.
-  # For all used x, either block[x]=None or block[x].x1 = x.
-  temp_block = [None for i in range(SX+1)]
+  return mergeSlices(IMG, maxCoordinates(black_cubes, 3), extractSliceBlocksDict)
+
+def mergeSlices(IMG, max_coords, sliceF):
+  """
+  Decompose each slice of the image IMG with the function
+  sliceF, and merge equal blocks of consecutive slices
+  (see mergeSliceLists).
+  """
+  SX, SY, SZ = max_coords
+  # columns of the blocks of all slices, in the order of the slices
+  bz, by0, bx0, bx1, by1 = [], [], [], [], []
+  for z in range(SZ+1):
+      slice_blocks = sliceF(IMG, SX, SY, z)
+      #CHECK SLICE
+      #checkBlocks(slice_blocks,[c for c in black_cubes if c[2]==z])
+      bx0.extend(slice_blocks.x0)
+      by0.extend(slice_blocks.y0)
+      bx1.extend(slice_blocks.x1)
+      by1.extend(slice_blocks.y1)
+      bz.extend(slice_blocks.z0)
   # Result to be returned
   final_blocks = BW_BlockImage3D()
   final_blocks.origsize = max([SX,SY,SZ])
+  mergeSliceLists(bz, by0, bx0, bx1, by1, SZ, final_blocks)
+  #print("Number of blocks = ",final_blocks.size())
+  return final_blocks
 
+def mergeSliceLists(bz, by0, bx0, bx1, by1, SZ, final_blocks):
+  """
+  Merge equal blocks of consecutive slices and append the
+  resulting blocks to final_blocks (a BW_BlockImage3D).
+  The blocks of the slices are given as lists of coordinates,
+  sorted by slice, and inside each slice in the order in which
+  extractSliceBlocks writes them.
+  A block of slice z is merged with the in-progress block ending
+  at the same x1, if it has the same x0,y0,y1; otherwise all
+  in-progress blocks inside its x range are written and it
+  becomes the in-progress block ending at x1. After each slice,
+  the in-progress blocks not extended to z are written.
+  Instead of scanning the x range of a block in an array of
+  in-progress blocks, the x1 of in-progress blocks are kept
+  in a sorted list and the range is found by binary search.
+  """
+  append = final_blocks.append
+  # in-progress blocks, indexed on x1, and their sorted x1
+  temp_block = dict()
+  used = []
+  i, n = 0, len(bz)
   for z in range(SZ+1):
-      slice_blocks = extractSliceBlocks(IMG, SX, SY, z)
-      #CHECK SLICE
-      #checkBlocks(slice_blocks,[c for c in black_cubes if c[2]==z])
-      #print("======Blocchi fetta z=",z," vanno bene")
-      #print("======FUSIONE")
-      for BL in slice_blocks.all_blocks():
-           #print("===Guardo se posso fondere il blocco ",BL)
-           x = BL.x1+1
-           if temp_block[x-1]!=None:
-               if temp_block[x-1].has_equal_xy(BL):
-                  #print("   si: fondo con blocco ",temp_block[x-1])
-                  temp_block[x-1].z1 = z
-               else: #write the block and overwrite it 
-                  for xx in range(BL.x0,BL.x1+1):
-                     if temp_block[xx]!=None:
-                        #print("   no: salvo blocco ",temp_block[xx])
-                        final_blocks.add_block(BW_Block(temp_block[xx]))
-                        temp_block[xx] = None
-                  temp_block[x-1] = BL
-                  num += 1
-                  #print("   e aggiorno ", temp_block[x-1])
-           else: # there is not an in-progress block ending at x-1, set a new block
-               for xx in range(BL.x0,BL.x1+1):
-                  if temp_block[xx]!=None:
-                     #print("   no: salvo blocco ",temp_block[xx])
-                     final_blocks.add_block(BW_Block(temp_block[xx]))
-                     temp_block[xx] = None
-               temp_block[x-1] = BL
-               #print("   creo blocco ", temp_block[x-1]);
-      # end for BL
-      for x in range(SX+1):
-        if temp_block[x]!=None and temp_block[x].z1==z-1:
-          # this block finishes at z-1 and has no chance to be merged
-          # with the new block that will be built on next slice
-          #print("salvo blocco pendente z-1",temp_block[x])
-          final_blocks.add_block(BW_Block(temp_block[x]))
-          temp_block[x] = None
-          num += 1   
-  # end for z
+    while i<n and bz[i]==z:
+      x0, y0, x1, y1 = bx0[i], by0[i], bx1[i], by1[i]
+      i += 1
+      T = temp_block.get(x1)
+      if T!=None and T[0]==x0 and T[1]==y0 and T[4]==y1:
+        T[5] = z
+      else: # write the blocks in [x0,x1] and replace them
+        first = bisect_left(used, x0)
+        last = bisect_right(used, x1)
+        for xx in used[first:last]:
+          append(*temp_block.pop(xx))
+        used[first:last] = [x1]
+        temp_block[x1] = [x0,y0,z, x1,y1,z]
+    # write the blocks which finish at z-1
+    kept = []
+    for xx in used:
+      if temp_block[xx][5]==z-1: append(*temp_block.pop(xx))
+      else: kept.append(xx)
+    used = kept
   #now write all remaining in-progress blocks
-  for x in range(SX+1):
-     if temp_block[x]!=None:
-        #print("salvo blocco pendente finale",temp_block[x])
-        final_blocks.add_block(BW_Block(temp_block[x]))
-        num += 1
-  #print("Number of blocks = ",final_blocks.size())
+  for xx in used:
+    append(*temp_block[xx])
   return final_blocks
 
+#---------------------NUMPY DECOMPOSITION-----------------------
+
+# NumPy is optional: without it, extractBlocksNumpy
+# falls back to extractBlocks
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+def voxelsToArray(black_cubes):
+  """
+  Return the 3D image as a boolean NumPy array A indexed
+  as A[z,y,x], so that each row of the image is a row of A.
+  The image can be a list of black voxels, a BinaryImage,
+  a bitmap or already a NumPy array.
+  """
+  if isinstance(black_cubes, np.ndarray): return black_cubes
+  SX, SY, SZ = maxCoordinates(black_cubes, 3)
+  if isinstance(black_cubes, BW_MaskBitmap3D):
+    width = (SX+8)//8
+    data = b"".join([row.to_bytes(width,"little") for S in black_cubes.slices for row in S])
+    bits = np.unpackbits(np.frombuffer(data,dtype=np.uint8), bitorder="little")
+    return bits.reshape(SZ+1, SY+1, 8*width)[:,:,0:SX+1].astype(bool)
+  if isinstance(black_cubes, BW_Bitmap3D):
+    data = b"".join([row for S in black_cubes.slices for row in S])
+    return np.frombuffer(data,dtype=np.uint8).reshape(SZ+1, SY+1, SX+1).astype(bool)
+  A = np.zeros((SZ+1, SY+1, SX+1), dtype=bool)
+  if hasattr(black_cubes, "column"):
+    xs = np.asarray(black_cubes.column(0))
+    ys = np.asarray(black_cubes.column(1))
+    zs = np.asarray(black_cubes.column(2))
+  else:
+    coords = np.fromiter(chain.from_iterable(black_cubes), dtype=np.int64).reshape(-1,3)
+    xs, ys, zs = coords[:,0], coords[:,1], coords[:,2]
+  A[zs, ys, xs] = True
+  return A
+
+def arrayRuns(A):
+  """
+  Return four arrays z, y, x0, x1 with the runs [x0,x1] of
+  black voxels in the rows (y,z) of the boolean array A[z,y,x],
+  sorted by z, then by y, then by x.
+  """
+  NZ, NY, NX = A.shape
+  P = np.zeros((NZ*NY, NX+2), dtype=np.int8)
+  P[:,1:-1] = A.reshape(NZ*NY, NX)
+  D = np.diff(P, axis=1)
+  # D[r,x]==1 iff x is the first voxel of a run in row r,
+  # D[r,x]==-1 iff x-1 is the last voxel of a run in row r
+  r, x0 = np.nonzero(D==1)
+  x1 = np.nonzero(D==-1)[1]-1
+  return r//NY, r%NY, x0, x1
+
+def arraySliceBlocks(z, y, x0, x1, SY):
+  """
+  Merge the runs (given as arrays sorted by z, y and x) into the
+  blocks of each slice, as extractSliceBlocks does: a run extends
+  the block formed by equal runs in the previous rows.
+  Return arrays z, y0, x0, x1, y1 of the blocks, sorted by slice
+  and, inside each slice, in the order in which extractSliceBlocks
+  writes them (when a later run ends at the same x1, or at the
+  end of the slice).
+  """
+  # for each run, the next row with a run ending at the same x1
+  order = np.lexsort((y, x1, z))
+  next_y = np.full(len(y), SY+1, dtype=np.int64)
+  same = (x1[order][1:]==x1[order][:-1]) & (z[order][1:]==z[order][:-1])
+  next_y[order[:-1][same]] = y[order][1:][same]
+  # chains of equal runs in consecutive rows of the same slice
+  order = np.lexsort((y, x1, x0, z))
+  z, y, x0, x1, next_y = z[order], y[order], x0[order], x1[order], next_y[order]
+  follows = (z[1:]==z[:-1]) & (x0[1:]==x0[:-1]) & (x1[1:]==x1[:-1]) & (y[1:]==y[:-1]+1)
+  first = np.nonzero(np.concatenate(([True], ~follows)))[0]
+  last = np.concatenate((first[1:]-1, [len(y)-1]))
+  z, y0, x0, x1, y1, written = z[first], y[first], x0[first], x1[first], y[last], next_y[last]
+  order = np.lexsort((x1, written, z))
+  return z[order], y0[order], x0[order], x1[order], y1[order]
+
+def extractBlocksNumpy(image):
+  """
+  Build the same decomposition into blocks as extractBlocks
+  (same blocks, in the same order) with NumPy array operations
+  for finding the runs and the blocks of all slices.
+  The image can be a boolean NumPy array A[z,y,x] or anything
+  accepted by extractBlocks.
+  Without NumPy, call extractBlocks.
+  """
+  if np is None: return extractBlocks(image)
+  A = voxelsToArray(image)
+  z, y, x0, x1 = arrayRuns(A)
+  final_blocks = BW_BlockImage3D()
+  if len(z)==0: return final_blocks
+  SX, SY, SZ = int(x1.max()), int(y.max()), int(z.max())
+  final_blocks.origsize = max([SX,SY,SZ])
+  columns = arraySliceBlocks(z, y, x0, x1, SY)
+  return mergeSliceLists(*[c.tolist() for c in columns], SZ, final_blocks)
+
 def checkBlocks(ibr, img):
    """
    Take an image block representation and a 3D image (given as a
@@ -296,9 +513,28 @@ def checkBlocks(ibr, img):
       sys.exit(1)
 
 
+def checkNumpy(ibr, img):
+   """
+   Take the block representation built by extractBlocks for an
+   image and check that extractBlocksNumpy builds the same
+   blocks, in the same order.
+   """
+   if np is None:
+      print("NumPy not available")
+      return
+   other = extractBlocksNumpy(img)
+   if list(zip(*ibr.columns()))==list(zip(*other.columns())): print("TUTTO VA BENE")
+   else:
+      print("ERRORE: NumPy blocks are different")
+      sys.exit(1)
+
 #---------------------MAIN-----------------------
 
 from commons3D import readCubes
+from coordfile import maxCoordinates
+from bitmap import makeBitmap3D, BW_Bitmap3D, BW_MaskBitmap3D
+from bisect import bisect_left, bisect_right
+from itertools import chain
 import sys
 
 def main(arg):
@@ -312,6 +548,8 @@ def main(arg):
          #checkBlocks(BB, input_cubes)
          print("Number of blocks: ",BB.num_elem())
          BB.statistiche()
+         if len(arg)>2 and arg[2]=="numpy":
+            checkNumpy(BB, input_cubes)
 
 if __name__ == "__main__":
    main(sys.argv)
@@ -0,0 +1,366 @@
+"""
+Deterministic generator of synthetic 2D and 3D images, for stress
+benchmarks at sizes beyond the bundled data (e.g. 16000x16000 in 2D,
+512^3 or 1024^3 in 3D).
+
+Shapes, in an image of side N with center c = N//2:
+  disc     2D disc / 3D sphere: distance from the center <= radius
+  shell    hollow disc / sphere: radius-thickness < distance <= radius
+  torus    2D annulus / 3D torus around the z axis, with distance
+           of the points from the circle of the given radius <= tube
+  blobs    union of random discs / spheres (from the seed)
+  checker  checkerboard of cells of side cell, black where the sum of
+           the cell indices is even (with cell=1 the worst case for the
+           number of blocks)
+The parameters (radius, thickness, tube, blobs, cell, seed) have
+defaults proportional to N, and all tests on the pixels are done
+with integers, so the same parameters give the same image on any
+machine.
+
+Each shape is generated one row (y, or y,z) at a time, as the list
+of runs [x0,x1] of black pixels of the row, so that the image is
+written without being stored, and its exact moments are computed
+from the runs with the closed forms of the sums of powers:
+  sum for x=x0..x1 of x^p = S_p(x1) - S_p(x0-1)
+(see faulhaber in bigmatrix.py), i.e. with one operation per run
+instead of one per pixel; for the checkerboard the moments are
+computed in closed form from the sums along each axis.
+The moments are written in a file next to the image (see
+momentsName), and can be checked against the ones computed by
+the programs at scales where brute force is too slow.
+
+Usage:
+  python3 synthetic.py DIM shape N [name=value ...] [bin] [out=FILE]
+write the image (binary format with bin, see coordfile.py), by
+default in FileSynthetic2D or FileSynthetic3D, and its moments
+  python3 synthetic.py DIM all N [name=value ...] [bin]
+write all shapes and the list file listaSynthetic{DIM}D_N, which
+can be given to main_for_tests.py and to benchsuite.py
+  python3 synthetic.py check DIM image
+compute the moments of the image (block decomposition and kernelgen.py)
+and check them against the exact ones
+"""
+
+import json
+import os
+import random
+import sys
+from math import isqrt
+
+SHAPES = ["disc", "shell", "torus", "blobs", "checker"]
+
+def defaultParams(shape, N):
+  """
+  Return the default parameters of a shape in an image of side N.
+  """
+  if shape=="disc": return {"radius": N//2-1}
+  if shape=="shell": return {"radius": N//2-1, "thickness": max(1, N//16)}
+  if shape=="torus": return {"radius": 3*N//10, "tube": max(1, N//6)}
+  if shape=="blobs": return {"blobs": 20, "seed": 1}
+  return {"cell": 1}
+
+#---------------------ROWS-----------------------
+
+def ringRuns(c, lo, hi):
+  """
+  Return the runs of the x with lo <= (x-c)^2 <= hi.
+  """
+  if hi<0: return []
+  w = isqrt(hi)
+  if lo<=0: return [(c-w, c+w)]
+  v = isqrt(lo-1) # largest |x-c| with (x-c)^2 < lo
+  if v>=w: return []
+  return [(c-w, c-v-1), (c+v+1, c+w)]
+
+def inTorus(q, R, a):
+  """
+  True if (sqrt(q)-R)^2 <= a, with integers only.
+  """
+  L = q+R*R-a
+  return L<=0 or L*L<=4*R*R*q
+
+def torusBounds(R, a):
+  """
+  Return the min and max integer q with (sqrt(q)-R)^2 <= a (a>=0).
+  """
+  s = isqrt(a)
+  # max q: (R+s)^2 is inside, (R+s+1)^2 is outside
+  low, high = (R+s)**2, (R+s+1)**2
+  while high-low>1:
+    mid = (low+high)//2
+    if inTorus(mid, R, a): low = mid
+    else: high = mid
+  qhi = low
+  if s>=R: return 0, qhi
+  # min q: (R-s-1)^2 is outside, (R-s)^2 is inside
+  low, high = (R-s-1)**2, (R-s)**2
+  while high-low>1:
+    mid = (low+high)//2
+    if inTorus(mid, R, a): high = mid
+    else: low = mid
+  return high, qhi
+
+def mergeRuns(runs):
+  """
+  Return the union of the runs, sorted and without overlaps.
+  """
+  runs.sort()
+  merged = []
+  for x0, x1 in runs:
+    if merged and x0<=merged[-1][1]+1:
+      if x1>merged[-1][1]: merged[-1] = (merged[-1][0], x1)
+    else:
+      merged.append((x0, x1))
+  return merged
+
+def rowIndices(dim, N):
+  """
+  Return the rows (y,) or (y,z) of an image of side N.
+  """
+  if dim==2: return [(y,) for y in range(N)]
+  return [(y,z) for z in range(N) for y in range(N)]
+
+def randomBlobs(dim, N, num, seed):
+  """
+  Return the list of num random blobs (center, radius) inside
+  the image of side N.
+  """
+  rnd = random.Random(seed)
+  blobs = []
+  for i in range(num):
+    radius = rnd.randint(max(1, N//40), max(1, N//8))
+    center = tuple([rnd.randint(radius, N-1-radius) for a in range(dim)])
+    blobs.append((center, radius))
+  return blobs
+
+def shapeRows(dim, shape, N, params):
+  """
+  Generate the pairs (row, runs) of the rows with black pixels,
+  where row is (y,) or (y,z) and runs is the list of the runs
+  (x0,x1) of black pixels of the row, sorted.
+  """
+  c = N//2
+  if shape=="checker":
+    cell = params["cell"]
+    for row in rowIndices(dim, N):
+      parity = sum([k//cell for k in row]) % 2
+      runs = [(x0, min(x0+cell, N)-1) for x0 in range(parity*cell, N, 2*cell)]
+      if runs: yield row, runs
+    return
+  if shape=="blobs":
+    blobs = randomBlobs(dim, N, params["blobs"], params["seed"])
+    # blobs crossing each y
+    byY = dict()
+    for center, radius in blobs:
+      for y in range(center[1]-radius, center[1]+radius+1):
+        byY.setdefault(y, []).append((center, radius))
+    for row in rowIndices(dim, N):
+      runs = []
+      for center, radius in byY.get(row[0], []):
+        d2 = sum([(k-h)**2 for k,h in zip(row, center[1:])])
+        runs += ringRuns(center[0], 0, radius*radius-d2)
+      if runs: yield row, mergeRuns(runs)
+    return
+  R = params["radius"]
+  if shape=="torus":
+    r = params["tube"]
+    extent = R+r
+  else:
+    extent = R
+  rows = rowIndices(dim, N)
+  rows = [row for row in rows if all([abs(k-c)<=extent for k in row])]
+  for row in rows:
+    dy2 = (row[0]-c)**2
+    if shape=="disc":
+      d2 = sum([(k-c)**2 for k in row])
+      runs = ringRuns(c, 0, R*R-d2)
+    elif shape=="shell":
+      d2 = sum([(k-c)**2 for k in row])
+      inner = R-params["thickness"]
+      runs = ringRuns(c, inner*inner+1-d2 if inner>=0 else 0, R*R-d2)
+    else:
+      a = r*r - (row[1]-c)**2 if dim==3 else r*r
+      if a<0: continue
+      qlo, qhi = torusBounds(R, a)
+      runs = ringRuns(c, qlo-dy2, qhi-dy2)
+    if runs: yield row, runs
+
+#---------------------MOMENTS-----------------------
+
+def powerSum(p, x0, x1):
+  """
+  Return the sum of x^p for x=x0..x1 (0 <= x0 <= x1).
+  """
+  if p==0: return x1-x0+1
+  return faulhaber(p, x1) - faulhaber(p, x0-1)
+
+def runsMoments(dim, rows):
+  """
+  Return the moments (a dictionary with key the order) of the
+  image given by the pairs (row, runs) of shapeRows.
+  """
+  orders = orders2D if dim==2 else orders3D
+  MM = {key:0 for key in orders}
+  for row, runs in rows:
+    sx = [sum([powerSum(p, x0, x1) for x0,x1 in runs]) for p in range(4)]
+    for key in orders:
+      m = sx[key[0]]
+      for k,e in zip(row, key[1:]): m *= k**e
+      MM[key] += m
+  return MM
+
+def checkerMoments(dim, N, cell):
+  """
+  Return the moments of the checkerboard in closed form: along
+  each axis the sums of the powers over the even cells (E) and
+  over the odd cells (O) are computed, and a pixel is black if
+  the number of its coordinates in odd cells is even.
+  """
+  orders = orders2D if dim==2 else orders3D
+  sums = [[0]*4, [0]*4]
+  for k, x0 in enumerate(range(0, N, cell)):
+    x1 = min(x0+cell, N)-1
+    for p in range(4): sums[k%2][p] += powerSum(p, x0, x1)
+  MM = dict()
+  for key in orders:
+    m = 0
+    for parities in product((0,1), repeat=dim):
+      if sum(parities)%2==1: continue
+      term = 1
+      for par, e in zip(parities, key): term *= sums[par][e]
+      m += term
+    MM[key] = m
+  return MM
+
+def exactMoments(dim, shape, N, params):
+  if shape=="checker": return checkerMoments(dim, N, params["cell"])
+  return runsMoments(dim, shapeRows(dim, shape, N, params))
+
+#---------------------OUTPUT-----------------------
+
+def imageName(dim, shape, N, binary=False):
+  """
+  Return the default name of the image, in the style of the
+  bundled data (e.g. FileSynthetic3D/torus512_cubes.txt).
+  """
+  name = "FileSynthetic%dD/%s%d" % (dim, shape, N)
+  if dim==3: name += "_cubes"
+  return name + (".bin" if binary else ".txt")
+
+def momentsName(image_file):
+  """
+  Return the name of the file with the exact moments of an image.
+  """
+  return os.path.splitext(image_file)[0] + "_moments.json"
+
+def pixelsOfRows(rows):
+  for row, runs in rows:
+    for x0, x1 in runs:
+      for x in range(x0, x1+1):
+        yield (x,) + row
+
+def writeImage(dim, shape, N, params, out_file, binary=False):
+  """
+  Write the image in text or binary format, and its exact
+  moments in the file momentsName(out_file).
+  Return the number of black pixels.
+  """
+  folder = os.path.dirname(out_file)
+  if folder: os.makedirs(folder, exist_ok=True)
+  if binary:
+    width = 2 if N<=(1<<16) else 4
+    count = writeBinary(out_file, pixelsOfRows(shapeRows(dim, shape, N, params)), dim, width)
+  else:
+    count = 0
+    f = open(out_file, "w")
+    for row, runs in shapeRows(dim, shape, N, params):
+      tail = "".join([" %d" % k for k in row]) + "\n"
+      for x0, x1 in runs:
+        f.write("".join([str(x)+tail for x in range(x0, x1+1)]))
+        count += x1-x0+1
+    f.close()
+  MM = exactMoments(dim, shape, N, params)
+  assert MM[orders2D[0] if dim==2 else orders3D[0]]==count
+  f = open(momentsName(out_file), "w")
+  json.dump({"dim": dim, "shape": shape, "side": N, "params": params,
+             "moments": {"".join([str(k) for k in key]): value for key, value in MM.items()}}, f, indent=1)
+  f.close()
+  return count
+
+def readMoments(image_file):
+  """
+  Return the exact moments (a dictionary with key the order)
+  written with the image.
+  """
+  f = open(momentsName(image_file), "r")
+  data = json.load(f)
+  f.close()
+  return {tuple([int(c) for c in key]): value for key, value in data["moments"].items()}
+
+def checkImage(dim, image_file):
+  """
+  Compute the moments of the image on its block decomposition
+  and check them against the exact ones.
+  """
+  if dim==2:
+    from commons2D import readPixels as readInput
+    from spiliotis2D import extractBlocks
+  else:
+    from commons3D import readCubes as readInput
+    from spiliotis3D import extractBlocks
+  exact = readMoments(image_file)
+  MM = blockMomentsKernel(extractBlocks(readInput(image_file)), list(exact))
+  ok = True
+  for key in exact:
+    if MM[key]!=exact[key]:
+      print("ERRORE: moment",key,"is",MM[key],"instead of",exact[key])
+      ok = False
+  if ok: print("TUTTO VA BENE")
+  return ok
+
+#---------------------MAIN-----------------------
+
+from bigmatrix import faulhaber
+from commons2D import orders as orders2D
+from commons3D import orders as orders3D
+from coordfile import writeBinary
+from itertools import product
+from kernelgen import blockMomentsKernel
+
+def main(arg):
+  try:
+    if arg[1]=="check":
+      dim = int(arg[2])
+      assert dim in (2,3)
+      return checkImage(dim, arg[3])
+    dim = int(arg[1])
+    assert dim in (2,3)
+    shape = arg[2]
+    assert shape in SHAPES or shape=="all"
+    N = int(arg[3])
+    assert N>2
+    binary = "bin" in arg[4:]
+    options = dict([a.split("=", 1) for a in arg[4:] if "=" in a])
+    out_file = options.pop("out", None)
+    given = {key: int(value) for key, value in options.items()}
+  except:
+    print(__doc__)
+    return
+  shapes = SHAPES if shape=="all" else [shape]
+  written = []
+  for shape in shapes:
+    params = defaultParams(shape, N)
+    params.update({key: value for key, value in given.items() if key in params})
+    name = out_file if out_file and len(shapes)==1 else imageName(dim, shape, N, binary)
+    count = writeImage(dim, shape, N, params, name, binary)
+    print("Written %s: %s %s, %d black pixels" % (name, shape, params, count))
+    written.append(name)
+  if len(shapes)>1:
+    list_file = "listaSynthetic%dD_%d" % (dim, N)
+    f = open(list_file, "w")
+    for name in written: f.write(name+"\n")
+    f.close()
+    print("Written list "+list_file)
+
+if __name__ == "__main__":
+  main(sys.argv)